@@ -0,0 +1,339 @@
+import csv
+import io
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from budget import Budget, BudgetExceeded
+from cache import DedupTable, ResultCache
+from corrector import STATUS_BUDGET_EXCEEDED, STATUS_CORRECTED, STATUS_ERROR, STATUS_SYNTAX_ERROR, STATUS_UNCHANGED, correct_statement
+from hopcache import HOP_CACHE_SIZE, hop_cache
+from mapped import RANGE_SIZE, MappedCsv
+from preprocessing import convert_to_single_line
+from schema import load_snapshot, schema_pool
+from store import PersistentCache
+
+# Number of output rows collected before they are written to the file in one go
+WRITE_BATCH_SIZE = 1024
+# Size of the output file buffer in bytes
+OUTPUT_BUFFER_SIZE = 1 << 20
+# Number of rows sent to a worker process at once
+CHUNK_SIZE = 256
+# Number of chunks queued per worker process, keeps memory bounded while the workers stay busy
+CHUNKS_PER_WORKER = 2
+# Header of the corrected output file
+OUTPUT_HEADER = ['statement', 'schema', 'corrected_query']
+
+# Rows the pipeline fails on are logged with their traceback before they are marked as 'Syntax error'
+logger = logging.getLogger(__name__)
+
+def read_rows(csv_path: str) -> Iterator[list[str]]:
+    """
+    Generator that streams the rows of the input csv file one by one, the file is only read once.
+    Statements split over multiple lines are kept inside one quoted field by the csv reader and are
+    converted to a single line later by convert_to_single_line
+
+    Input: csv_path
+    Output: rows like ['MATCH (a)-->(b) RETURN a', '(Person, KNOWS, Person)', ...] without the header
+    """
+    with open(csv_path, 'r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        # Skip the header
+        next(csv_reader, None)
+        yield from csv_reader
+
+# Result cache, dedup table, persistent cache and budget of the current process, every worker process creates its own
+result_cache = None
+dedup_table = None
+persistent_cache = None
+row_budget = None
+
+def init_cache(cache_size: int, dedup_size: int = 0, persistent: dict | None = None, snapshot: str | None = None,
+               budget: Budget | None = None, hop_cache_size: int = HOP_CACHE_SIZE) -> None:
+    """
+    Creates the result cache, the dedup table and the persistent cache of the current process and resizes its hop cache,
+    a size of 0 or no persistent options disable them. The schema snapshot is loaded so the process never parses its schemas.
+
+    Input: maximum number of query templates in the cache, maximum number of (query, schema) pairs in the dedup table,
+           keyword arguments of PersistentCache like {'path': 'cache.sqlite', 'max_entries': None, 'max_age': None},
+           path of a schema snapshot written by compile-schema, budget of every query, maximum number of hops in the hop cache
+    Output: None
+    """
+    if snapshot is not None:
+        load_snapshot(snapshot)
+    global result_cache, dedup_table, persistent_cache, row_budget
+    row_budget = budget
+    result_cache = ResultCache(cache_size) if cache_size > 0 else None
+    dedup_table = DedupTable(dedup_size) if dedup_size > 0 else None
+    hop_cache.resize(hop_cache_size)
+    if persistent_cache is not None:
+        persistent_cache.close()
+    persistent_cache = PersistentCache(**persistent) if persistent else None
+
+def correct_row(row: list[str]) -> str:
+    """
+    Function that corrects the statement of a single row, statements the pipeline is unable to parse
+    are marked as 'Syntax error' so one bad row does not stop the whole batch.
+    Rows that repeat an earlier (query, schema) pair take the result from the dedup table.
+    Rows that go over the budget are returned unchanged in a single line.
+
+    Input: row with statement and schema
+    Output: corrected statement or 'Syntax error'
+    """
+    try:
+        return _correct_deduped(row[0], row[1])
+    except BudgetExceeded:
+        return convert_to_single_line(row[0])
+    except (IndexError, ValueError, KeyError):
+        logger.exception('Unable to correct statement %r', row[0])
+        return 'Syntax error'
+
+def _correct_deduped(statement: str, schema: str) -> str:
+    # Raises the exceptions of the pipeline, so the callers can tell an error or an abandoned row from a result
+    if dedup_table is not None:
+        return dedup_table.correct(statement, schema, _correct_pair)
+    return _correct_pair(statement, schema)
+
+def _correct_pair(statement: str, schema: str) -> str:
+    if result_cache is not None:
+        return result_cache.correct(statement, schema, row_budget)
+    return correct_statement(statement, schema, row_budget)
+
+def pool_rows(rows: Iterable[list[str]]) -> Iterator[list[str]]:
+    """
+    Generator that replaces the schema of every row by the canonical string of the schema pool,
+    so the copy of the schema that was read with the row is dropped right away
+
+    Input: iterable of rows
+    Output: rows like [statement, pooled schema]
+    """
+    for row in rows:
+        yield [row[0], schema_pool.intern(row[1])]
+
+def correct_chunk(rows: list[list[str]]) -> list[str]:
+    """
+    Corrects a chunk of rows inside a worker process, every worker keeps its own compiled schema cache.
+    With a persistent cache the stored results of the chunk are looked up at once and the new ones are inserted at once.
+
+    Input: list of rows
+    Output: list of corrected statements in the same order
+    """
+    if persistent_cache is None:
+        return [correct_row(row) for row in rows]
+    results = persistent_cache.correct_many([(row[0], row[1]) for row in rows], _row_status)
+    return ['Syntax error' if corrected is None else corrected for corrected, _ in results]
+
+def correct_pooled_chunk(rows: list[list[str]]) -> list[str]:
+    """
+    Corrects a chunk of rows sent to a worker process like correct_chunk. Rows of a chunk that share a schema arrive
+    as a single string, the schema pool of the worker maps it to the string of the earlier chunks.
+
+    Input: list of rows
+    Output: list of corrected statements in the same order
+    """
+    return correct_chunk(list(pool_rows(rows)))
+
+def _row_status(statement: str, schema: str) -> tuple[str | None, str]:
+    # Gives the result of correct_row the status correct_with_status would give it, so the persistent cache stores
+    # the same results whichever caller filled it. Errors are written as 'Syntax error' but never stored.
+    try:
+        corrected = _correct_deduped(statement, schema)
+    except BudgetExceeded:
+        return convert_to_single_line(statement), STATUS_BUDGET_EXCEEDED
+    except (IndexError, ValueError, KeyError):
+        logger.exception('Unable to correct statement %r', statement)
+        return None, STATUS_ERROR
+    if corrected == 'Syntax error':
+        return None, STATUS_SYNTAX_ERROR
+    return corrected, STATUS_UNCHANGED if corrected == convert_to_single_line(statement) else STATUS_CORRECTED
+
+def iter_chunks(rows: Iterable[list[str]], chunk_size: int = CHUNK_SIZE) -> Iterator[list[list[str]]]:
+    """
+    Generator that splits the stream of rows into lists of chunk_size rows
+
+    Input: iterable of rows, chunk_size
+    Output: lists of rows
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def correct_rows(rows: Iterable[list[str]], workers: int = 1, cache_size: int = 0, dedup_size: int = 0,
+                 persistent: dict | None = None, snapshot: str | None = None, budget: Budget | None = None,
+                 hop_cache_size: int = HOP_CACHE_SIZE) -> Iterator[list[str]]:
+    """
+    Generator that corrects the rows lazily. With a single worker rows are corrected one at a time (one chunk at a time with a persistent cache),
+    with more workers chunks of rows are corrected in a process pool and returned in input order,
+    only a bounded number of chunks is in flight at the same time
+
+    Input: iterable of rows, number of worker processes, size of the result cache and the dedup table of every process,
+           options of the persistent cache, path of a schema snapshot, budget of every query, size of the hop cache of every process
+    Output: rows like [statement, schema, corrected_query]
+    """
+    # Rows keep the pooled schema string, chunks are pickled with every distinct schema written once
+    rows = pool_rows(rows)
+    if workers <= 1:
+        init_cache(cache_size, dedup_size, persistent, snapshot, budget, hop_cache_size)
+        if persistent_cache is not None:
+            for chunk in iter_chunks(rows):
+                yield from _output_rows(chunk, correct_chunk(chunk))
+            return
+        for row in rows:
+            yield [row[0], row[1], correct_row(row)]
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_cache, initargs=(cache_size, dedup_size, persistent, snapshot, budget, hop_cache_size)) as executor:
+        pending = deque()
+        for chunk in iter_chunks(rows):
+            pending.append((chunk, executor.submit(correct_pooled_chunk, chunk)))
+            # Wait for the oldest chunk once enough chunks are queued so the output stays in input order
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                chunk, future = pending.popleft()
+                yield from _output_rows(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            yield from _output_rows(chunk, future.result())
+
+def _output_rows(chunk: list[list[str]], results: list[str]) -> Iterator[list[str]]:
+    for row, corrected in zip(chunk, results):
+        yield [row[0], row[1], corrected]
+
+def write_rows(output_path: str, rows: Iterable[list[str]]) -> int:
+    """
+    Writes the output rows to a csv file through a large buffer in batches of WRITE_BATCH_SIZE rows
+
+    Input: output_path, iterable of output rows
+    Output: number of rows written
+    """
+    count = 0
+    with open(output_path, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(OUTPUT_HEADER)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == WRITE_BATCH_SIZE:
+                csv_writer.writerows(batch)
+                count += len(batch)
+                batch.clear()
+        csv_writer.writerows(batch)
+        count += len(batch)
+    return count
+
+def correct_file(input_path: str, output_path: str, workers: int = 1, cache_size: int = 0, dedup_size: int = 0,
+                 persistent: dict | None = None, snapshot: str | None = None, budget: Budget | None = None,
+                 hop_cache_size: int = HOP_CACHE_SIZE) -> int:
+    """
+    Corrects every statement of the input csv file in a single streaming pass and writes the results to the output csv file
+
+    Input: input_path, output_path, number of worker processes, size of the result cache and the dedup table of every process,
+           options of the persistent cache, path of a schema snapshot, budget of every query, size of the hop cache of every process
+    Output: number of rows corrected
+    """
+    return write_rows(output_path, correct_rows(read_rows(input_path), workers, cache_size, dedup_size, persistent, snapshot, budget,
+                                                hop_cache_size))
+
+# Memory map of the input file of the current process, every worker process maps the file itself
+mapped_source = None
+
+def correct_range(input_path: str, start: int, end: int) -> tuple[int, str]:
+    """
+    Corrects the rows of a byte range of the input file inside a worker process, the worker maps the file itself
+    so only the offsets are sent to it. The output rows are formatted as csv text by the worker.
+
+    Input: input_path, byte range that starts and ends on a record boundary
+    Output: number of rows and their csv text
+    """
+    global mapped_source
+    if mapped_source is None or mapped_source.path != input_path:
+        mapped_source = MappedCsv(input_path)
+    count, text = correct_source_range(mapped_source, start, end)
+    mapped_source.release(start, end)
+    return count, text
+
+def correct_source_range(source: MappedCsv, start: int, end: int) -> tuple[int, str]:
+    """
+    Corrects the rows of a byte range of a mapped input file in the current process
+
+    Input: mapped input file, byte range that starts and ends on a record boundary
+    Output: number of rows and their csv text
+    """
+    output = io.StringIO()
+    csv_writer = csv.writer(output)
+    count = 0
+    # Every field is decoded once
+    rows = pool_rows(source.rows(start, end))
+    if persistent_cache is not None:
+        for chunk in iter_chunks(rows):
+            csv_writer.writerows(_output_rows(chunk, correct_chunk(chunk)))
+            count += len(chunk)
+        return count, output.getvalue()
+    for row in rows:
+        csv_writer.writerow([row[0], row[1], correct_row(row)])
+        count += 1
+    return count, output.getvalue()
+
+def correct_mapped_file(input_path: str, output_path: str, workers: int = 1, cache_size: int = 0, dedup_size: int = 0,
+                        persistent: dict | None = None, snapshot: str | None = None, budget: Budget | None = None,
+                        hop_cache_size: int = HOP_CACHE_SIZE, range_size: int = RANGE_SIZE) -> int:
+    """
+    Corrects every statement of the input csv file like correct_file, but the input is memory-mapped and cut into
+    byte ranges on record boundaries. Workers receive the offsets of a range instead of pickled rows and the pages
+    of finished ranges are released, so the resident memory stays flat regardless of the size of the input.
+
+    Input: input_path, output_path, number of worker processes, size of the result cache and the dedup table of every process,
+           options of the persistent cache, path of a schema snapshot, budget of every query, size of the hop cache of every process,
+           approximate size of a range in bytes
+    Output: number of rows corrected
+    """
+    count = 0
+    with MappedCsv(input_path) as source, open(output_path, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE) as csv_file:
+        csv.writer(csv_file).writerow(OUTPUT_HEADER)
+        if workers <= 1:
+            init_cache(cache_size, dedup_size, persistent, snapshot, budget, hop_cache_size)
+            for start, end in source.ranges(range_size):
+                rows, text = correct_source_range(source, start, end)
+                csv_file.write(text)
+                count += rows
+                source.release(start, end)
+            return count
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_cache, initargs=(cache_size, dedup_size, persistent, snapshot, budget, hop_cache_size)) as executor:
+            pending = deque()
+            for start, end in source.ranges(range_size):
+                pending.append(((start, end), executor.submit(correct_range, input_path, start, end)))
+                # Write the oldest range once enough ranges are queued so the output stays in input order
+                while pending and (len(pending) >= workers * CHUNKS_PER_WORKER or pending[0][1].done()):
+                    count += _write_range(source, csv_file, *pending.popleft())
+            while pending:
+                count += _write_range(source, csv_file, *pending.popleft())
+    return count
+
+def _write_range(source: MappedCsv, csv_file, byte_range: tuple[int, int], future) -> int:
+    rows, text = future.result()
+    csv_file.write(text)
+    # The pages the boundary search touched in this process are not needed anymore
+    source.release(*byte_range)
+    return rows
+
+def measure_throughput(input_path: str, worker_counts: Iterable[int]) -> list[dict[str, float]]:
+    """
+    Corrects the whole input file once for every worker count and measures the throughput,
+    the output is discarded so only the correction and the reading of the input is measured
+
+    Input: input_path, worker counts like [1, 2, 4]
+    Output: list of results like [{'workers': 1, 'rows': 74, 'seconds': 0.02, 'rows_per_second': 3700.0}]
+    """
+    report = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        rows = write_rows(os.devnull, correct_rows(read_rows(input_path), workers))
+        seconds = time.perf_counter() - start
+        report.append({'workers': workers, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0})
+    return report
@@ -0,0 +1,37 @@
+import argparse
+import json
+
+def compare(old: dict, new: dict) -> list[tuple[str, int, str, float, float]]:
+    """
+    Pairs the timings of two benchmark runs by workload, size and stage
+
+    Input: results of the old run, results of the new run
+    Output: list of (workload, size, stage, old seconds, new seconds)
+    """
+    rows = []
+    for name, new_entries in new['workloads'].items():
+        old_entries = {entry['size']: entry for entry in old['workloads'].get(name, [])}
+        for entry in new_entries:
+            old_entry = old_entries.get(entry['size'])
+            if old_entry is None:
+                continue
+            rows.append((name, entry['size'], 'pipeline', old_entry['pipeline'], entry['pipeline']))
+            for stage, seconds in entry['stages'].items():
+                if stage in old_entry['stages']:
+                    rows.append((name, entry['size'], stage, old_entry['stages'][stage], seconds))
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        rows = compare(json.load(old_file), json.load(new_file))
+    for name, size, stage, old_seconds, new_seconds in rows:
+        speedup = old_seconds / new_seconds if new_seconds else float('inf')
+        print(f'{name:>16} {size:>6} {stage:>26} {old_seconds * 1000:>10.3f} ms {new_seconds * 1000:>10.3f} ms {speedup:>7.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import random
+from benchmarks.run import STAGES, time_stages
+from benchmarks.scaling import growth_exponent
+from schema import format_schema
+
+# Sizes of a random case when the dimension is not the one that grows
+BASE_SIZES = {'hops': 16, 'labels': 1, 'triples': 12, 'literal': 16}
+# Dimensions that grow and the sizes every dimension is measured at
+DIMENSIONS = {
+    'hops': [125, 250, 500, 1000],
+    'labels': [8, 16, 32, 64],
+    'triples': [250, 500, 1000, 2000],
+    'literal': [2000, 8000, 32000, 128000],
+}
+# Stages that grow faster than this exponent fail the run
+MAX_EXPONENT = 1.5
+# Stages that take less than this many seconds at the largest size are too noisy to fit
+MIN_SECONDS = 0.002
+# Number of hops of a pattern before the path continues in the next clause
+HOPS_PER_PATTERN = 25
+
+def random_case(rng: random.Random, hops: int, labels: int, triples: int, literal: int) -> tuple[str, str]:
+    """
+    Generates a random valid schema and a query that only uses its triples. The query is a path cut into comma separated
+    patterns and MATCH clauses that continue from the bare variable of the previous one, about a third of the arrows
+    point the wrong way, every node carries labels labels and the first node a string literal of literal characters.
+
+    Input: random generator, number of hops, labels per node, number of triples in the schema, length of the literal
+    Output: query, schema
+    """
+    # Names have the same width so no name is a prefix of another, the pipeline reads labels and relationships by prefix
+    pool = [f'L{i:05d}' for i in range(max(4, 2 * labels, triples // 2))]
+    schema = [(rng.choice(pool), f'R{i:05d}', rng.choice(pool)) for i in range(triples)]
+    by_label = {}
+    for triple in schema:
+        by_label.setdefault(triple[0], []).append((triple, False))
+        by_label.setdefault(triple[2], []).append((triple, True))
+
+    def node(index: int, label: str) -> str:
+        extra = rng.sample(pool, labels - 1) if labels > 1 else []
+        return f"(n{index}:{':'.join([label] + [name for name in extra if name != label])})"
+
+    triple = rng.choice(schema)
+    label = triple[0]
+    clauses = [f'MATCH (n0:{label} {{name: "{"x" * literal}"}})']
+    for i in range(1, hops + 1):
+        options = by_label.get(label)
+        if not options:
+            # The path can not go on from this label, start a new pattern
+            triple = rng.choice(schema)
+            label = triple[0]
+            clauses.append(f', {node(i - 1, label)}')
+            options = by_label[label]
+        (source, relationship, target), reverse = rng.choice(options)
+        forward = (not reverse) != (rng.random() < 0.3)
+        arrow = f'-[:{relationship}]->' if forward else f'<-[:{relationship}]-'
+        label = source if reverse else target
+        clauses.append(f'{arrow}{node(i, label)}')
+        if i % HOPS_PER_PATTERN == 0 and i < hops:
+            # The next clause starts from the bare variable, its labels come from the binding in this clause
+            clauses.append(f' MATCH (n{i})' if i % (2 * HOPS_PER_PATTERN) else f', (n{i})')
+    return ''.join(clauses) + ' RETURN count(*)', format_schema(schema)
+
+def case_for(dimension: str, size: int, seed: int) -> tuple[str, str]:
+    """
+    Generates the random case of a seed with one dimension set to size and the others at their base size
+
+    Input: dimension like 'hops', size of that dimension, seed
+    Output: query, schema
+    """
+    sizes = dict(BASE_SIZES, **{dimension: size})
+    return random_case(random.Random(seed), **sizes)
+
+def measure(dimension: str, sizes: list[int], seed: int, repeat: int) -> dict[str, list[float]]:
+    """
+    Times every stage on the cases of a seed at growing sizes of one dimension, the fastest of the repetitions is kept
+
+    Input: dimension, sizes, seed, number of repetitions
+    Output: dictionary of stage -> seconds for every size, 'total' holds the sum of the stages
+    """
+    results = {stage: [] for stage in STAGES + ['total']}
+    for size in sizes:
+        query, schema = case_for(dimension, size, seed)
+        runs = [time_stages(query, schema) for _ in range(repeat)]
+        for stage in STAGES:
+            results[stage].append(min(run[stage] for run in runs))
+        results['total'].append(min(sum(run.values()) for run in runs))
+    return results
+
+def check(dimension: str, sizes: list[int], results: dict[str, list[float]], max_exponent: float,
+          min_seconds: float) -> list[tuple[str, float]]:
+    """
+    Fits the growth exponent of every stage and returns the stages that grow faster than max_exponent,
+    stages that stay below min_seconds at the largest size are skipped
+
+    Input: dimension, sizes, results of measure, maximum exponent, minimum seconds at the largest size
+    Output: list of (stage, exponent)
+    """
+    failures = []
+    for stage, seconds in results.items():
+        if seconds[-1] < min_seconds:
+            continue
+        exponent = growth_exponent(sizes, seconds)
+        if exponent > max_exponent:
+            failures.append((stage, exponent))
+    return failures
+
+def save_case(directory: str, dimension: str, sizes: list[int], seed: int, stage: str, exponent: float,
+              seconds: list[float]) -> str:
+    """
+    Saves the largest input of a failing series together with everything needed to generate the whole series again
+
+    Input: directory of the cases, dimension, sizes, seed, failing stage, its exponent and seconds for every size
+    Output: path of the case file
+    """
+    os.makedirs(directory, exist_ok=True)
+    query, schema = case_for(dimension, sizes[-1], seed)
+    path = os.path.join(directory, f'{dimension}-{stage}-{seed}.json')
+    with open(path, 'w') as case_file:
+        json.dump({'dimension': dimension, 'sizes': sizes, 'seed': seed, 'base_sizes': BASE_SIZES, 'stage': stage,
+                   'exponent': exponent, 'seconds': seconds, 'query': query, 'schema': schema}, case_file, indent=2)
+    return path
+
+def replay(path: str, repeat: int) -> None:
+    """
+    Times every stage of a saved case again, once on the saved input and once on the whole generated series
+
+    Input: path of the case file, number of repetitions
+    Output: None
+    """
+    with open(path) as case_file:
+        case = json.load(case_file)
+    runs = [time_stages(case['query'], case['schema']) for _ in range(repeat)]
+    print(f"saved input, {len(case['query'])} query characters, {len(case['schema'])} schema characters")
+    for stage in STAGES:
+        print(f'{stage:>26} {min(run[stage] for run in runs) * 1000:>10.3f} ms')
+    results = measure(case['dimension'], case['sizes'], case['seed'], repeat)
+    print(f"{case['dimension']} {case['sizes']}: {case['stage']} exponent {growth_exponent(case['sizes'], results[case['stage']]):.2f}"
+          f" (saved {case['exponent']:.2f})")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generates random schema and query pairs at growing sizes and fails when a stage grows faster than an exponent')
+    parser.add_argument('--dimension', nargs='+', choices=sorted(DIMENSIONS), default=list(DIMENSIONS))
+    parser.add_argument('--trials', type=int, default=3, help='number of random seeds per dimension')
+    parser.add_argument('--seed', type=int, default=0, help='first seed, trial k uses seed + k')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-exponent', type=float, default=MAX_EXPONENT)
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS)
+    parser.add_argument('--cases', default='fuzz_cases', help='directory the failing inputs are saved to')
+    parser.add_argument('--replay', help='time a saved case again instead of fuzzing')
+    args = parser.parse_args()
+
+    if args.replay:
+        replay(args.replay, args.repeat)
+        return
+
+    failed = []
+    for dimension in args.dimension:
+        sizes = DIMENSIONS[dimension]
+        for seed in range(args.seed, args.seed + args.trials):
+            results = measure(dimension, sizes, seed, args.repeat)
+            failures = check(dimension, sizes, results, args.max_exponent, args.min_seconds)
+            exponents = {stage: growth_exponent(sizes, seconds) for stage, seconds in results.items() if seconds[-1] >= args.min_seconds}
+            total = f'{dimension:>8} seed {seed:>4} total {results["total"][-1] * 1000:>9.2f} ms'
+            if exponents:
+                worst = max(exponents, key=exponents.get)
+                print(f'{total}  highest exponent {exponents[worst]:.2f} ({worst})')
+            else:
+                # No stage ran long enough at the largest size for its exponent to mean anything
+                print(f'{total}  no stage above {args.min_seconds} s, nothing measured')
+            for stage, exponent in failures:
+                path = save_case(args.cases, dimension, sizes, seed, stage, exponent, results[stage])
+                print(f'{"":>8} {stage} grows with exponent {exponent:.2f}, saved {path}')
+                failed.append(path)
+    if failed:
+        raise SystemExit(f'{len(failed)} stages grow faster than exponent {args.max_exponent}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import random
+from schema import format_schema
+
+# Labels and relationships used by the generated schemas
+LABELS = ['Person', 'Movie', 'Genre', 'Organization', 'User', 'Actor']
+RELATIONSHIPS = ['KNOWS', 'ACTED_IN', 'DIRECTED', 'RATED', 'WORKS_AT', 'IN_GENRE', 'FOLLOWS']
+
+def base_schema() -> list[tuple[str, str, str]]:
+    """
+    Returns the small movie schema used by most workloads
+
+    Input: None
+    Output: list of triples
+    """
+    return [('Person', 'KNOWS', 'Person'), ('Person', 'ACTED_IN', 'Movie'), ('Person', 'DIRECTED', 'Movie'),
+            ('Movie', 'IN_GENRE', 'Genre'), ('Person', 'WORKS_AT', 'Organization'), ('User', 'RATED', 'Movie')]
+
+def hop(rng: random.Random, triple: tuple[str, str, str], reverse: bool) -> tuple[str, str]:
+    """
+    Writes one hop of a pattern for the triple, the direction is randomly flipped so the corrector has work to do
+
+    Input: random generator, triple, True if the hop is written from the target to the source
+    Output: relationship text and right node label like ('-[:KNOWS]->', 'Person')
+    """
+    source, relationship, target = triple
+    wrong = rng.random() < 0.3
+    forward = not reverse if not wrong else reverse
+    arrow = f'-[:{relationship}]->' if forward else f'<-[:{relationship}]-'
+    return arrow, source if reverse else target
+
+def path_chain(rng: random.Random, hops: int) -> tuple[str, str]:
+    """
+    Long path chain of the KNOWS relationship with hundreds of hops
+
+    Input: random generator, number of hops
+    Output: query, schema
+    """
+    parts = ['(n0:Person)']
+    for i in range(1, hops + 1):
+        arrow, label = hop(rng, ('Person', 'KNOWS', 'Person'), False)
+        parts.append(f'{arrow}(n{i}:{label})')
+    return f"MATCH p = {''.join(parts)} RETURN p", format_schema(base_schema())
+
+def long_path(rng: random.Random, hops: int) -> tuple[str, str]:
+    """
+    Machine generated path that alternates between people and movies through ACTED_IN and DIRECTED,
+    so every hop has to be resolved by the whole pipeline
+
+    Input: random generator, number of hops
+    Output: query, schema
+    """
+    parts = ['(n0:Person)']
+    label = 'Person'
+    for i in range(1, hops + 1):
+        if label == 'Person':
+            arrow, label = hop(rng, ('Person', 'ACTED_IN', 'Movie'), False)
+        else:
+            arrow, label = hop(rng, ('Person', 'DIRECTED', 'Movie'), True)
+        parts.append(f'{arrow}(n{i}:{label})')
+    return f"MATCH p = {''.join(parts)} RETURN p", format_schema(base_schema())
+
+def wide_schema(rng: random.Random, triples: int) -> tuple[str, str]:
+    """
+    Small query against a schema with thousands of triples
+
+    Input: random generator, number of triples in the schema
+    Output: query, schema
+    """
+    schema = [(f'Label{rng.randrange(triples)}', f'REL_{i}', f'Label{rng.randrange(triples)}') for i in range(triples)]
+    source, relationship, target = schema[rng.randrange(triples)]
+    query = f'MATCH (a:{target})<-[:{relationship}]-(b:{source}) RETURN a, b'
+    return query, format_schema(schema)
+
+def comma_patterns(rng: random.Random, patterns: int) -> tuple[str, str]:
+    """
+    Single MATCH with many comma separated patterns
+
+    Input: random generator, number of patterns
+    Output: query, schema
+    """
+    schema = base_schema()
+    parts = []
+    for i in range(patterns):
+        triple = rng.choice(schema)
+        arrow, label = hop(rng, triple, False)
+        parts.append(f'(a{i}:{triple[0]}){arrow}(b{i}:{label})')
+    return f"MATCH {', '.join(parts)} RETURN count(*)", format_schema(schema)
+
+def property_maps(rng: random.Random, properties: int) -> tuple[str, str]:
+    """
+    Single hop whose nodes carry large property maps
+
+    Input: random generator, number of properties in every map
+    Output: query, schema
+    """
+    def property_map():
+        return '{' + ', '.join(f'p{i}: "value {rng.randrange(10**6)}"' if i % 2 else f'p{i}: {rng.randrange(10**6)}' for i in range(properties)) + '}'
+    return f'MATCH (p:Person {property_map()})<-[:WORKS_AT]-(o:Organization {property_map()}) RETURN p, o', format_schema(base_schema())
+
+def multi_clause(rng: random.Random, clauses: int) -> tuple[str, str]:
+    """
+    Query with many MATCH, OPTIONAL MATCH and WITH clauses that reuse variables bound in earlier clauses
+
+    Input: random generator, number of clauses
+    Output: query, schema
+    """
+    schema = base_schema()
+    parts = []
+    for i in range(clauses):
+        triple = rng.choice(schema)
+        arrow, label = hop(rng, triple, False)
+        keyword = 'OPTIONAL MATCH' if i % 3 == 1 else 'MATCH'
+        parts.append(f'{keyword} (a{i}:{triple[0]}){arrow}(b{i}:{label})')
+        if i % 3 == 2:
+            parts.append(f"WITH {', '.join(f'a{j}, b{j}' for j in range(i + 1))}")
+    return f"{' '.join(parts)} RETURN count(*)", format_schema(schema)
+
+# Workload name -> (generator, sizes to run it with)
+WORKLOADS = {
+    'path_chain': (path_chain, [10, 100, 300]),
+    'long_path': (long_path, [100, 1000, 10000]),
+    'wide_schema': (wide_schema, [100, 1000, 3000]),
+    'comma_patterns': (comma_patterns, [10, 50, 200]),
+    'property_maps': (property_maps, [10, 100, 1000]),
+    'multi_clause': (multi_clause, [5, 20, 50]),
+}
@@ -0,0 +1,70 @@
+import argparse
+import json
+import random
+import tracemalloc
+from batch import read_rows
+from benchmarks.generators import WORKLOADS
+from preprocessing import prepare_string
+from schema import compile_schema
+
+# Workloads and sizes measured by default, examples.csv is always measured as well
+MEMORY_WORKLOADS = [('comma_patterns', 50), ('long_path', 1000), ('multi_clause', 20), ('property_maps', 100)]
+
+def measure_query(query: str, schema: str, repeat: int) -> dict[str, float]:
+    """
+    Measures the memory prepare_string allocates for a single query with tracemalloc,
+    the schema is compiled before so only the per-query allocations are counted
+
+    Input: query, schema, number of repetitions
+    Output: dictionary with the smallest peak and retained bytes of the repetitions
+    """
+    compile_schema(schema)
+    peaks, retained = [], []
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        output = prepare_string([query, schema])
+        current, peak = tracemalloc.get_traced_memory()
+        del output
+        peaks.append(peak - before)
+        retained.append(tracemalloc.get_traced_memory()[0] - before)
+    return {'peak': min(peaks), 'retained': min(retained)}
+
+def run(examples_path: str, repeat: int, seed: int) -> dict[str, dict[str, float]]:
+    """
+    Measures the examples and the synthetic workloads, examples are reported as the mean per query
+
+    Input: path of the examples csv, number of repetitions, seed of the generators
+    Output: dictionary of workload -> peak and retained bytes per query
+    """
+    tracemalloc.start()
+    try:
+        results = {}
+        rows = list(read_rows(examples_path))
+        measured = [measure_query(row[0], row[1], repeat) for row in rows]
+        results['examples'] = {key: sum(entry[key] for entry in measured) / len(measured) for key in ('peak', 'retained')}
+        for name, size in MEMORY_WORKLOADS:
+            query, schema = WORKLOADS[name][0](random.Random(seed), size)
+            results[f'{name}_{size}'] = measure_query(query, schema, repeat)
+        return results
+    finally:
+        tracemalloc.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measures the memory allocated per query by prepare_string with tracemalloc')
+    parser.add_argument('--input', default='examples.csv')
+    parser.add_argument('--output', help='save the results to this json file')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.input, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    print(f"{'workload':>20} {'peak bytes':>12} {'retained bytes':>15}")
+    for name, entry in results.items():
+        print(f"{name:>20} {entry['peak']:>12.0f} {entry['retained']:>15.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import time
+from dicts import extract_relationship, identify_nodes
+from corrector import correct_statement
+from preprocessing import (check_brackets, convert_to_single_line, extract_directed_statement, get_mappings, process_relationship,
+                           process_target_source, split_into_patterns, validate_hops)
+from reconstruction import solver
+from schema import CompiledSchema
+from benchmarks.generators import WORKLOADS
+
+# Stages in the order prepare_string runs them, followed by the solver
+STAGES = ['compile_schema', 'get_mappings', 'extract_directed_statement', 'check_brackets', 'process_relationship', 'process_target_source',
+          'split_into_substatements', 'identify_nodes', 'validate_hops', 'solver']
+
+def time_stages(query: str, schema: str) -> dict[str, float]:
+    """
+    Runs the pipeline stage by stage the same way prepare_string and solver do and measures every stage,
+    validate_hops validates the direction and checks the syntax of every hop in one stage like prepare_string does.
+    The hop cache is shared with the other runs of the process.
+
+    Input: query, schema
+    Output: dictionary of stage -> seconds
+    """
+    timings = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter
+
+    start = clock()
+    compiled = CompiledSchema(schema)
+    timings['compile_schema'] = clock() - start
+
+    start = clock()
+    statement = get_mappings(convert_to_single_line(query), compiled)
+    timings['get_mappings'] = clock() - start
+
+    start = clock()
+    directed_statment = extract_directed_statement(statement)
+    timings['extract_directed_statement'] = clock() - start
+
+    start = clock()
+    variable_length_flag = check_brackets(statement)
+    timings['check_brackets'] = clock() - start
+    if variable_length_flag:
+        return timings
+
+    for i in range(len(directed_statment)):
+        start = clock()
+        directed_statment[i], _ = process_relationship(directed_statment[i], compiled)
+        timings['process_relationship'] += clock() - start
+        start = clock()
+        directed_statment[i] = process_target_source(directed_statment[i], compiled)
+        timings['process_target_source'] += clock() - start
+
+    start = clock()
+    hops = [hop for pattern in split_into_patterns(directed_statment) for hop in pattern.hops]
+    timings['split_into_substatements'] = clock() - start
+
+    start = clock()
+    identify_nodes(extract_relationship(hops), compiled)
+    timings['identify_nodes'] = clock() - start
+
+    start = clock()
+    directed_statment, valid, _ = validate_hops(hops, compiled)
+    output = [directed_statment[i] if valid[i] else 'Syntax error' for i in range(len(directed_statment))]
+    timings['validate_hops'] = clock() - start
+
+    start = clock()
+    solver(output, convert_to_single_line(query))
+    timings['solver'] = clock() - start
+    return timings
+
+def time_pipeline(query: str, schema: str) -> float:
+    """
+    Measures the whole pipeline on the query
+
+    Input: query, schema
+    Output: seconds
+    """
+    start = time.perf_counter()
+    correct_statement(query, schema)
+    return time.perf_counter() - start
+
+def run(workloads: list[str], repeat: int, seed: int) -> dict:
+    """
+    Runs every workload at every size repeat times and keeps the median of every stage
+
+    Input: names of the workloads, number of repetitions, seed of the generators
+    Output: dictionary with the environment and the results of every workload
+    """
+    results = {'python': platform.python_version(), 'machine': platform.machine(), 'timestamp': time.time(), 'repeat': repeat, 'workloads': {}}
+    for name in workloads:
+        generator, sizes = WORKLOADS[name]
+        results['workloads'][name] = []
+        for size in sizes:
+            query, schema = generator(random.Random(seed), size)
+            runs = [time_stages(query, schema) for _ in range(repeat)]
+            results['workloads'][name].append({
+                'size': size,
+                'query_length': len(query),
+                'schema_length': len(schema),
+                'stages': {stage: statistics.median(run[stage] for run in runs) for stage in STAGES},
+                'pipeline': statistics.median(time_pipeline(query, schema) for _ in range(repeat)),
+            })
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Times every stage of the pipeline on synthetic workloads')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--workload', nargs='+', choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.workload, args.repeat, args.seed)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    for name, entries in results['workloads'].items():
+        for entry in entries:
+            slowest = max(entry['stages'], key=entry['stages'].get)
+            print(f"{name:>16} {entry['size']:>6} pipeline {entry['pipeline'] * 1000:>9.3f} ms  slowest stage {slowest} {entry['stages'][slowest] * 1000:.3f} ms")
+    print(f'Results saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
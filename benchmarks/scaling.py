@@ -0,0 +1,52 @@
+import argparse
+import math
+import random
+from benchmarks.generators import long_path
+from benchmarks.run import STAGES, time_stages
+
+# Number of hops of the generated paths
+HOP_COUNTS = [1000, 2500, 5000, 10000]
+
+def growth_exponent(sizes: list[int], seconds: list[float]) -> float:
+    """
+    Fits seconds = c * size ** exponent with least squares on the logarithms
+
+    Input: sizes, measured seconds for every size
+    Output: exponent, 1.0 means linear scaling
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, 1e-9)) for value in seconds]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+def measure(hop_counts: list[int], repeat: int, seed: int) -> dict[str, list[float]]:
+    """
+    Times every stage on long paths of the given number of hops, the fastest of the repetitions is kept
+
+    Input: hop counts, number of repetitions, seed of the generator
+    Output: dictionary of stage -> seconds for every hop count, 'total' holds the sum of the stages
+    """
+    results = {stage: [] for stage in STAGES + ['total']}
+    for hops in hop_counts:
+        query, schema = long_path(random.Random(seed), hops)
+        runs = [time_stages(query, schema) for _ in range(repeat)]
+        for stage in STAGES:
+            results[stage].append(min(run[stage] for run in runs))
+        results['total'].append(min(sum(run.values()) for run in runs))
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Shows how every stage of the pipeline scales with the number of hops of a path')
+    parser.add_argument('--hops', type=int, nargs='+', default=HOP_COUNTS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = measure(args.hops, args.repeat, args.seed)
+    print(f"{'stage':>26} " + ' '.join(f'{f"us/hop@{hops}":>14}' for hops in args.hops) + f" {'exponent':>9}")
+    for stage, seconds in results.items():
+        per_hop = ' '.join(f'{value / hops * 1e6:>14.2f}' for value, hops in zip(seconds, args.hops))
+        print(f'{stage:>26} {per_hop} {growth_exponent(args.hops, seconds):>9.2f}')
+
+if __name__ == '__main__':
+    main()
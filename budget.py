@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import NamedTuple
+from lexer import ARROW
+
+# Limits a query can go over
+BUDGET_REASONS = ('length', 'hops', 'time')
+
+class BudgetExceeded(Exception):
+    """
+    Raised inside the pipeline when a query goes over a limit of its budget, the query is abandoned at the next check
+    and returned unchanged by the callers instead of being marked as 'Syntax error'
+    """
+
+    def __init__(self, reason: str, limit: float, value: float):
+        super().__init__(f'{reason} {value} is over the limit of {limit}')
+        self.reason = reason
+        self.limit = limit
+        self.value = value
+
+class Budget(NamedTuple):
+    """
+    Limits of a single query, None disables a limit. Budgets are plain tuples, so they can be sent to worker processes
+
+    Attributes:
+        - max_length: maximum length of the statement in characters
+        - max_hops: maximum number of hops of all patterns of the statement
+        - max_seconds: maximum seconds spent on the statement, checked between the stages of the pipeline
+    """
+    max_length: int | None = None
+    max_hops: int | None = None
+    max_seconds: float | None = None
+
+    def start(self, statement: str) -> 'QueryBudget':
+        """
+        Starts the clock of a statement, the length is checked right away
+
+        Input: cypher statement
+        Output: QueryBudget that the pipeline checks between its stages
+        """
+        if self.max_length is not None and len(statement) > self.max_length:
+            raise _exceeded('length', self.max_length, len(statement))
+        return QueryBudget(self)
+
+class QueryBudget:
+    """
+    Budget of a query that is being corrected, the pipeline checks it between its stages and abandons the query
+    with BudgetExceeded as soon as a limit is crossed
+    """
+    __slots__ = ('budget', 'start')
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.start = time.perf_counter()
+
+    def check_time(self) -> None:
+        """
+        Raises BudgetExceeded if the query took longer than max_seconds so far
+        """
+        if self.budget.max_seconds is not None:
+            seconds = time.perf_counter() - self.start
+            if seconds > self.budget.max_seconds:
+                raise _exceeded('time', self.budget.max_seconds, seconds)
+
+    def check_hops(self, hops: int) -> None:
+        """
+        Raises BudgetExceeded if the query has more than max_hops hops
+
+        Input: number of hops of the query
+        """
+        if self.budget.max_hops is not None and hops > self.budget.max_hops:
+            raise _exceeded('hops', self.budget.max_hops, hops)
+
+    def check_tokens(self, tokens: list[tuple[str, int, int]]) -> None:
+        """
+        Checks the hops and the time of a query from its tokens, callers run it before the fast path and the result cache
+        so a query that is answered without the pipeline still goes over its budget
+
+        Input: tokens of the query
+        """
+        if self.budget.max_hops is not None:
+            # Every hop has two arrow fragments
+            self.check_hops(sum(1 for kind, _, _ in tokens if kind == ARROW) // 2)
+        self.check_time()
+
+class BudgetCounter:
+    """
+    Thread safe counters of the queries that went over their budget, by limit
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.trips = dict.fromkeys(BUDGET_REASONS, 0)
+
+    def record(self, reason: str) -> None:
+        with self._lock:
+            self.trips[reason] += 1
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the counters of the budget trips
+
+        Input: None
+        Output: dictionary with the total trips and the trips of every limit
+        """
+        with self._lock:
+            return {'budget_exceeded': sum(self.trips.values()), **self.trips}
+
+# Budget trips of the whole process
+budget_counter = BudgetCounter()
+
+def _exceeded(reason: str, limit: float, value: float) -> BudgetExceeded:
+    # Every trip is counted where it happens, so it is counted once whoever catches it
+    budget_counter.record(reason)
+    return BudgetExceeded(reason, limit, value)
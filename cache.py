@@ -0,0 +1,225 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from budget import Budget, QueryBudget
+from hashlib import blake2b
+from fastpath import classify_query
+from lexer import ARROW, NUMBER, STRING, tokenize
+from preprocessing import convert_to_single_line, prepare_string
+from reconstruction import apply_edits, solver_edits
+from schema import CompiledSchema, compile_schema, literals_affect_result, schema_fingerprint
+
+# Default number of query templates kept in the result cache
+RESULT_CACHE_SIZE = 4096
+# Default number of distinct (query, schema) pairs kept in the dedup table
+DEDUP_TABLE_SIZE = 65536
+# Text that replaces every lifted literal in the query template
+PLACEHOLDER = '?'
+
+def normalize_query(query: str, tokens: list[tuple[str, int, int]] | None = None) -> tuple[str, list[str]]:
+    """
+    Function that lifts the string and number literals of the query, including the values inside property maps,
+    into placeholders so queries of the same shape share one template. Quoted names like `ACTED_IN` are kept.
+
+    Input: query like 'MATCH (p:Person {id:"Foo"}) RETURN p LIMIT 10', optional tokens of the query
+    Output: template like 'MATCH (p:Person {id:?}) RETURN p LIMIT ?' and the lifted literals ['"Foo"', '10']
+    """
+    if tokens is None:
+        tokens = tokenize(query)
+    template = []
+    literals = []
+    copied = 0
+    for kind, start, end in tokens:
+        if kind == NUMBER or kind == STRING and query[start] != '`':
+            template.append(query[copied:start])
+            template.append(PLACEHOLDER)
+            literals.append(query[start:end])
+            copied = end
+    template.append(query[copied:])
+    return ''.join(template), literals
+
+class ResultCache:
+    """
+    Bounded LRU cache in front of prepare_string/solver. Queries are keyed by their normalized template and the
+    schema fingerprint and the cache stores the arrow edits, which are reapplied to every concrete query of the template.
+    Edits are stored by the position of the arrow in the query, so they do not depend on the length of the literals.
+    Variable length statements and queries whose literals could change the outcome are corrected without the cache.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        # (template, schema fingerprint) -> tuple of (arrow number, replacement) edits or None for 'Syntax error'
+        self._entries = OrderedDict()
+        # schema fingerprint -> keys of the entries for that schema, used to invalidate them
+        self._keys_by_schema = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+
+    def correct(self, statement: str, schema: str | CompiledSchema, budget: Budget | None = None) -> str:
+        """
+        Corrects the statement, the result is taken from the cache if a query of the same template was already corrected.
+        With a budget a query over the limits raises BudgetExceeded like correct_statement, hits included, and nothing is stored.
+
+        Input: cypher statement (may be split over multiple lines), schema string or compiled schema, optional budget
+        Output: corrected cypher statement in a single line or 'Syntax error'
+        """
+        query_budget = budget.start(statement) if budget is not None else None
+        schema = compile_schema(schema)
+        query = convert_to_single_line(statement)
+        tokens = tokenize(query)
+        # The budget is checked before the fast path and the cache lookup, so hits never skip it
+        if query_budget: query_budget.check_tokens(tokens)
+        # Queries with nothing to correct never reach the cache
+        if classify_query(query, schema, tokens):
+            return query
+        template, literals = normalize_query(query, tokens)
+
+        if literals_affect_result(literals, schema):
+            self.bypasses += 1
+            return self._solve(statement, query, schema, query_budget)[0]
+
+        key = (template, schema.fingerprint)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            arrow_edits = self._entries[key]
+            if arrow_edits is None:
+                return 'Syntax error'
+            # Translate the arrow numbers back into offsets of this concrete query
+            arrows = [(start, end) for kind, start, end in tokens if kind == ARROW]
+            return apply_edits(query, [(*arrows[number], replacement) for number, replacement in arrow_edits])
+
+        corrected, edits = self._solve(statement, query, schema, query_budget)
+        if edits is False:
+            # Variable length statements are not cached
+            self.bypasses += 1
+            return corrected
+        self.misses += 1
+        if edits is not None:
+            # Store the edits by the number of the arrow they replace
+            arrow_numbers = {}
+            for kind, start, _ in tokens:
+                if kind == ARROW:
+                    arrow_numbers[start] = len(arrow_numbers)
+            edits = tuple((arrow_numbers[start], replacement) for start, _, replacement in edits)
+        self._store(key, edits)
+        return corrected
+
+    def _solve(self, statement: str, query: str, schema: CompiledSchema,
+               query_budget: QueryBudget | None = None) -> tuple[str, list | None | bool]:
+        # Returns the corrected query and its edits, the edits are None for syntax errors and False for variable length statements
+        output, variable_length_flag = prepare_string([statement, schema], query_budget)
+        if variable_length_flag:
+            return output, False
+        if query_budget: query_budget.check_time()
+        edits = solver_edits(output, query)
+        if edits is None:
+            return 'Syntax error', None
+        return apply_edits(query, edits), edits
+
+    def _store(self, key: tuple[str, str], edits: tuple | None) -> None:
+        self._entries[key] = edits
+        self._keys_by_schema.setdefault(key[1], set()).add(key)
+        while len(self._entries) > self.maxsize:
+            old_key, _ = self._entries.popitem(last=False)
+            self._forget(old_key)
+            self.evictions += 1
+
+    def _forget(self, key: tuple[str, str]) -> None:
+        keys = self._keys_by_schema[key[1]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_schema[key[1]]
+
+    def invalidate_schema(self, schema: str | CompiledSchema) -> int:
+        """
+        Removes every cached result for the schema
+
+        Input: schema string or compiled schema
+        Output: number of removed entries
+        """
+        fingerprint = schema.fingerprint if isinstance(schema, CompiledSchema) else schema_fingerprint(schema)
+        keys = self._keys_by_schema.pop(fingerprint, set())
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        """
+        Removes every cached result, the counters are kept
+        """
+        self._entries.clear()
+        self._keys_by_schema.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the cache
+
+        Input: None
+        Output: dictionary with size, maxsize, hits, misses, evictions, bypasses and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'bypasses': self.bypasses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class DedupTable:
+    """
+    Bounded LRU table of the results of exact (single line query, schema) pairs, so every distinct pair of a batch is
+    corrected once and the result fans out to all of its duplicates. The pair is kept as a 16 byte hash of the query and
+    the fingerprint of the schema, so the memory
+    of the table only depends on maxsize and the length of the results. The time every result took to compute is kept
+    to report the time saved by the duplicates.
+    """
+
+    def __init__(self, maxsize: int = DEDUP_TABLE_SIZE):
+        self.maxsize = maxsize
+        # (hash of the query, schema fingerprint) -> (result, seconds it took to compute)
+        self._entries = OrderedDict()
+        self.rows = 0
+        self.duplicates = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+
+    def correct(self, statement: str, schema: str, compute: Callable[[str, str], str]) -> str:
+        """
+        Returns the result of the pair from the table or computes and stores it
+
+        Input: cypher statement (may be split over multiple lines), schema string, function that corrects a statement
+        Output: corrected statement
+        """
+        self.rows += 1
+        # The schema is keyed by its fingerprint, so long schemas are not hashed again for every row
+        key = (blake2b(convert_to_single_line(statement).encode(), digest_size=16).digest(), compile_schema(schema).fingerprint)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.duplicates += 1
+            self.seconds_saved += entry[1]
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        start = time.perf_counter()
+        result = compute(statement, schema)
+        self._entries[key] = (result, time.perf_counter() - start)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the table
+
+        Input: None
+        Output: dictionary with size, maxsize, rows, unique, duplicates, evictions, dedup_ratio and seconds_saved
+        """
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'rows': self.rows, 'unique': self.rows - self.duplicates,
+                'duplicates': self.duplicates, 'evictions': self.evictions,
+                'dedup_ratio': self.duplicates / self.rows if self.rows else 0.0, 'seconds_saved': self.seconds_saved}
+
+    def __len__(self) -> int:
+        return len(self._entries)
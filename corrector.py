@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+from budget import Budget, BudgetExceeded
+from fastpath import classify_query
+from instrumentation import metrics
+from lexer import tokenize
+from reconstruction import solver
+from preprocessing import convert_to_single_line, prepare_string
+from schema import CompiledSchema, compile_schema
+
+# Version of the corrector, stored with every persistent cache entry. Bump it when the output changes without a change
+# to the source of the pipeline modules, for example after an upgrade of Python
+CORRECTOR_VERSION = '1'
+
+logger = logging.getLogger(__name__)
+
+def correct_statement(statement: str, schema: str | CompiledSchema, budget: Budget | None = None) -> str:
+    """
+    Function that runs a single cypher statement through the whole pipeline and returns the corrected statement.
+    With a budget the statement is abandoned with BudgetExceeded as soon as it goes over one of the limits.
+
+    Input: cypher statement (may be split over multiple lines), schema string or compiled schema, optional budget
+    Output: corrected cypher statement in a single line or 'Syntax error'
+    """
+    query_budget = budget.start(statement) if budget is not None else None
+
+    # Queries with nothing to correct are returned untouched without running the pipeline, the budget is checked first
+    query = convert_to_single_line(statement)
+    tokens = tokenize(query)
+    if query_budget: query_budget.check_tokens(tokens)
+    if classify_query(query, schema, tokens):
+        return query
+
+    # Call main preprocessing funciton on input cypher statemenet which also validates the cypher direction
+    output, variable_length_flag = prepare_string([statement, schema], query_budget)
+
+    # When variable length is present, the output should just match the input statement
+    if variable_length_flag:
+        return output
+    if query_budget: query_budget.check_time()
+
+    # Call main processing function on input cypher statemenet
+    # Triple string quotes are used so this code can work for older versions of python
+    if not metrics.enabled:
+        return solver(output, f'''{query}''')
+    start = time.perf_counter()
+    solution = solver(output, f'''{query}''')
+    metrics.record_stage('solver', time.perf_counter() - start)
+    return solution
+
+# Statuses returned together with the corrected statement
+STATUS_UNCHANGED = 'unchanged'
+STATUS_CORRECTED = 'corrected'
+STATUS_VARIABLE_LENGTH = 'variable_length'
+STATUS_SYNTAX_ERROR = 'syntax_error'
+STATUS_ERROR = 'error'
+STATUS_BUDGET_EXCEEDED = 'budget_exceeded'
+
+def correct_with_status(statement: str, schema: str | CompiledSchema, budget: Budget | None = None) -> tuple[str | None, str]:
+    """
+    Function that corrects the statement and describes the outcome with a status instead of the 'Syntax error' sentinel,
+    statements the pipeline is unable to parse get the error status instead of raising and the exception is logged.
+    Queries taken by the fast path are returned untouched with the status of the fast path like 'schema_match'.
+    Statements that go over the budget are returned untouched with the status 'budget_exceeded'.
+
+    Input: cypher statement, schema string or compiled schema, optional budget
+    Output: corrected statement or None, status like 'corrected'
+    """
+    query = convert_to_single_line(statement)
+    try:
+        query_budget = budget.start(statement) if budget is not None else None
+        tokens = tokenize(query)
+        if query_budget: query_budget.check_tokens(tokens)
+        fast_path_status = classify_query(query, schema, tokens)
+        if fast_path_status:
+            return query, fast_path_status
+        output, variable_length_flag = prepare_string([statement, schema], query_budget)
+        if variable_length_flag:
+            return output, STATUS_VARIABLE_LENGTH
+        if query_budget: query_budget.check_time()
+        solution = solver(output, query)
+    except BudgetExceeded:
+        return query, STATUS_BUDGET_EXCEEDED
+    except (IndexError, ValueError, KeyError):
+        # The error status hides the exception from the caller, so the traceback is logged to keep bugs of the pipeline visible
+        logger.exception('Unable to correct statement %r', query)
+        return None, STATUS_ERROR
+    if solution == 'Syntax error':
+        return None, STATUS_SYNTAX_ERROR
+    return solution, STATUS_UNCHANGED if solution == query else STATUS_CORRECTED
+
+class Result(NamedTuple):
+    """
+    Outcome of a correction, the query is the statement in a single line and corrected is None
+    for the statuses 'syntax_error' and 'error'
+    """
+    query: str
+    corrected: str | None
+    status: str
+
+    @property
+    def ok(self) -> bool:
+        return self.corrected is not None
+
+class Corrector:
+    """
+    Reusable corrector of a single schema for long lived services. The schema is compiled once when the corrector
+    is created, so a call only runs the pipeline. The compiled schema is never changed after it was built and every call
+    keeps its intermediate state to itself, so one corrector can be shared by the threads of a ThreadPoolExecutor.
+    The counters of the statuses are guarded by a lock. The optional budget applies to every call.
+    """
+
+    def __init__(self, schema: str | CompiledSchema, budget: Budget | None = None):
+        self.schema = compile_schema(schema)
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def correct(self, query: str) -> Result:
+        """
+        Corrects a single statement, see correct_with_status
+
+        Input: cypher statement (may be split over multiple lines)
+        Output: Result like Result(query='MATCH (a)<-[:KNOWS]-(b) RETURN a', corrected='MATCH (a)-[:KNOWS]->(b) RETURN a', status='corrected')
+        """
+        corrected, status = correct_with_status(query, self.schema, self.budget)
+        with self._lock:
+            self._counts[status] = self._counts.get(status, 0) + 1
+        return Result(convert_to_single_line(query), corrected, status)
+
+    def correct_many(self, queries: Iterable[str]) -> Iterator[Result]:
+        """
+        Generator that corrects the statements lazily one at a time in input order
+
+        Input: iterable of cypher statements
+        Output: Result of every statement
+        """
+        for query in queries:
+            yield self.correct(query)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the number of corrected statements by status
+
+        Input: None
+        Output: dictionary like {'corrected': 10, 'schema_match': 25}
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def __repr__(self) -> str:
+        return f'Corrector({self.schema.source!r})'
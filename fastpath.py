@@ -0,0 +1,149 @@
+import threading
+import time
+from instrumentation import metrics
+from lexer import NUMBER, STRING, tokenize
+from patterns import find_hops, node_labels
+from preprocessing import bind_variables, check_brackets, scan_nodes
+from schema import BACKWARD, FORWARD, INVALID, CompiledSchema, compile_schema, literals_affect_result
+
+# Statuses of the queries that are returned untouched without running the pipeline
+STATUS_NO_PATTERNS = 'no_patterns'
+STATUS_UNDIRECTED = 'undirected'
+STATUS_SCHEMA_MATCH = 'schema_match'
+FAST_PATH_STATUSES = (STATUS_NO_PATTERNS, STATUS_UNDIRECTED, STATUS_SCHEMA_MATCH)
+
+class FastPathCounter:
+    """
+    Thread safe counters of the queries that were checked by the fast path and of the hits per status
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checked = 0
+            self.hits = dict.fromkeys(FAST_PATH_STATUSES, 0)
+
+    def record(self, status: str | None) -> None:
+        with self._lock:
+            self.checked += 1
+            if status is not None:
+                self.hits[status] += 1
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the fast path
+
+        Input: None
+        Output: dictionary with checked, hits, hit_rate and the hits of every status
+        """
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {'checked': self.checked, 'hits': hits, 'hit_rate': hits / self.checked if self.checked else 0.0, **self.hits}
+
+# Fast path counters shared by the whole process
+fast_path_counter = FastPathCounter()
+
+def classify_query(query: str, schema: str | CompiledSchema, tokens: list[tuple[str, int, int]] | None = None) -> str | None:
+    """
+    Cheap pre-classifier that recognizes queries the pipeline would return untouched:
+        - no_patterns: the query has no relationship patterns
+        - undirected: every hop is undirected and the pipeline has nothing to flip or reject
+        - schema_match: every directed hop is labeled and the direction table of the schema allows its direction
+    Every other query is ambiguous and has to go through prepare_string. The outcome is counted in fast_path_counter,
+    hits are also recorded as queries by the instrumentation when it is enabled.
+
+    Input: single line cypher query, schema string or compiled schema, optional tokens of the query
+    Output: one of the statuses above or None if the query needs the whole pipeline
+    """
+    start = time.perf_counter() if metrics.enabled else None
+    if tokens is None:
+        tokens = tokenize(query)
+    status = _classify(query, compile_schema(schema), tokens)
+    fast_path_counter.record(status)
+    # Queries that go through the pipeline are recorded by prepare_string
+    if status is not None and start is not None:
+        metrics.record_fast_path(time.perf_counter() - start)
+    return status
+
+def _classify(query: str, schema: CompiledSchema, tokens: list[tuple[str, int, int]]) -> str | None:
+    # Variable length relationships are returned with the labels from get_mappings, so they are never untouched
+    if check_brackets(query, tokens):
+        return None
+    hops = find_hops(query, tokens)
+    if hops is None:
+        return None
+    if not hops:
+        return STATUS_NO_PATTERNS
+    # process_target_source rewrites every fragment that starts with a label, an empty label matches every fragment
+    if '' in schema.clean_labels:
+        return None
+
+    # Literals inside the hops could be read as part of the pattern by the pipeline
+    literals = []
+    hop_index = 0
+    for kind, start, end in tokens:
+        if kind == NUMBER or kind == STRING and query[start] != '`':
+            while hop_index < len(hops) and hops[hop_index][5] <= start:
+                hop_index += 1
+            if hop_index < len(hops) and hops[hop_index][0] <= start:
+                literals.append(query[start:end])
+    if literals_affect_result(literals, schema):
+        return None
+
+    labeled_variables = None
+    directed = False
+    for left_start, left_end, relationship_start, relationship_end, right_start, right_end, direction in hops:
+        nodes = (node_labels(query, left_start, left_end), node_labels(query, right_start, right_end))
+        for (variable, labels), (start, end) in zip(nodes, ((left_start, left_end), (right_start, right_end))):
+            # process_target_source rewrites nodes that start with a label, the trie walks only the first characters of the node
+            if schema.label_prefixes.prefixes(query[start+1:end].lstrip('`')):
+                return None
+            if not labels:
+                # get_mappings adds labels to unlabeled nodes that are named like a label or labeled somewhere else
+                if labeled_variables is None:
+                    labeled_variables = _labeled_variables(query, tokens)
+                content = query[start+1:end-1].strip()
+                if ':' in content or content in schema.label_relationships or content in labeled_variables:
+                    return None
+
+        relationship = _relationship_type(query, relationship_start, relationship_end, schema)
+        if relationship is None:
+            return None
+        left_labels, right_labels = [[label.strip('`') for label in labels] for _, labels in nodes]
+
+        if direction == '-':
+            # check_syntax only rejects typed undirected hops between two labeled nodes that fit no triple
+            if relationship and left_labels and right_labels and schema.direction(left_labels, relationship, right_labels) == INVALID:
+                return None
+            continue
+
+        # A directed hop is settled when the direction table allows the direction it already has
+        directed = True
+        if not relationship or not left_labels or not right_labels:
+            return None
+        if not schema.direction(left_labels, relationship, right_labels) & (FORWARD if direction == '->' else BACKWARD):
+            return None
+
+    return STATUS_SCHEMA_MATCH if directed else STATUS_UNDIRECTED
+
+def _relationship_type(query: str, start: int, end: int, schema: CompiledSchema) -> str | None:
+    # Returns the type of the relationship, '' if it is untyped and None if the pipeline would read it differently
+    if start == -1:
+        return ''
+    relationship = query[start:end]
+    # process_relationship replaces the relationship with the first schema relationship it contains
+    mapped = schema.find_relationship(relationship)
+    content = relationship[1:-1].split('{', 1)[0]
+    if ':' not in content:
+        return '' if mapped is None else None
+    relationship_type = content.split(':', 1)[1].strip().strip('`')
+    if relationship_type != mapped or any(character in relationship_type for character in ('|', '!', '*', '`')):
+        return None
+    return relationship_type
+
+def _labeled_variables(query: str, tokens: list[tuple[str, int, int]]) -> dict[str, str]:
+    # Names of the nodes that have a label somewhere in the query, read the same way get_mappings reads them
+    return bind_variables(scan_nodes(query, tokens))[1]
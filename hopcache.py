@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+# Default number of distinct hops whose validation is kept
+HOP_CACHE_SIZE = 65536
+
+class HopCache:
+    """
+    Thread safe bounded LRU cache of the outcome of orient_hop and check_syntax for a single hop. Hops are keyed
+    by (left labels, text between the nodes, right labels, whether the relationship is used, schema fingerprint), so the
+    same hop is validated once however many queries it occurs in and whatever the variables and property maps of its
+    labeled nodes are. The value holds the rewritten text between the nodes and whether the rewritten hop fits the schema.
+    """
+
+    def __init__(self, maxsize: int = HOP_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        # hop key -> (text between the nodes, valid)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> tuple[str, bool] | None:
+        """
+        Looks up the outcome of a hop and marks it as recently used
+
+        Input: hop key
+        Output: (text between the nodes, valid) or None if the hop was not validated yet
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: tuple[str, bool]) -> None:
+        """
+        Stores the outcome of a hop, the least recently used hops are evicted above maxsize. Nothing is stored while
+        the cache is disabled with a size of 0
+
+        Input: hop key, (text between the nodes, valid)
+        Output: None
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def resize(self, maxsize: int) -> None:
+        """
+        Changes the number of hops kept, a size of 0 disables the cache
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Removes every cached hop, the counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the cache
+
+        Input: None
+        Output: dictionary with size, maxsize, hits, misses, evictions and hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Hop cache shared by the whole process, the keys hold the schema fingerprint so schemas never share an entry
+hop_cache = HopCache()
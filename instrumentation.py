@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+
+# Upper bounds of the latency histogram buckets in seconds, the last bucket holds everything slower
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1, 2.5e-1, 1.0)
+# Upper bounds of the substatements per query histogram buckets
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+class Histogram:
+    """
+    Histogram with fixed bucket bounds that also keeps the count, sum and maximum of the observed values
+    """
+    __slots__ = ('bounds', 'buckets', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> dict:
+        labels = [f'<={bound}' for bound in self.bounds] + [f'>{self.bounds[-1]}']
+        return {'count': self.count, 'sum': self.total, 'max': self.max, 'mean': self.total / self.count if self.count else 0,
+                'buckets': dict(zip(labels, self.buckets))}
+
+class QueryTimer:
+    """
+    Measures the stages of a single query, every lap adds the time since the previous lap to the stage
+    """
+    __slots__ = ('instrumentation', 'start', 'last', 'stages')
+
+    def __init__(self, instrumentation: 'Instrumentation'):
+        self.instrumentation = instrumentation
+        self.start = self.last = time.perf_counter()
+        self.stages = {}
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def finish(self, query: str, substatements: int = 0, syntax_error: bool = False, variable_length: bool = False) -> None:
+        self.instrumentation.record(self, query, substatements, syntax_error, variable_length)
+
+class Instrumentation:
+    """
+    Optional per-stage instrumentation of prepare_string. While disabled start_query returns None and the pipeline
+    only checks that value between stages, so the cost is a single comparison per stage.
+
+    Collected data:
+        - stage latency histograms
+        - substatements per query histogram
+        - counters of queries, fast path hits, syntax error outcomes and variable length passthroughs
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._slow_query_threshold = None
+        self._slow_query_callback = None
+        self.reset()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        """
+        Removes all collected data, the slow query callback is kept
+        """
+        with self._lock:
+            self.stages = {}
+            self.substatements = Histogram(SIZE_BUCKETS)
+            self.counters = {'queries': 0, 'fast_path_hits': 0, 'syntax_errors': 0, 'variable_length_passthroughs': 0, 'slow_queries': 0}
+
+    def on_slow_query(self, threshold: float, callback: Callable[[str, float, dict[str, float]], None] | None) -> None:
+        """
+        Registers a callback that is called with (query, seconds, stage seconds) for every query slower than threshold seconds,
+        a callback of None removes it
+
+        Input: threshold in seconds, callback
+        Output: None
+        """
+        self._slow_query_threshold = threshold
+        self._slow_query_callback = callback
+
+    def start_query(self) -> QueryTimer | None:
+        """
+        Starts measuring a query
+
+        Input: None
+        Output: QueryTimer or None when the instrumentation is disabled
+        """
+        return QueryTimer(self) if self.enabled else None
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        """
+        Adds a single measurement of a stage that runs outside of prepare_string like the solver
+
+        Input: stage name, seconds
+        Output: None
+        """
+        with self._lock:
+            self._stage(stage).observe(seconds)
+
+    def record_fast_path(self, seconds: float) -> None:
+        """
+        Records a query that the fast path returned without running prepare_string
+
+        Input: seconds the fast path took
+        Output: None
+        """
+        with self._lock:
+            self._stage('fast_path').observe(seconds)
+            self.counters['queries'] += 1
+            self.counters['fast_path_hits'] += 1
+
+    def record(self, timer: QueryTimer, query: str, substatements: int, syntax_error: bool, variable_length: bool) -> None:
+        elapsed = timer.last - timer.start
+        with self._lock:
+            for stage, seconds in timer.stages.items():
+                self._stage(stage).observe(seconds)
+            self._stage('prepare_string').observe(elapsed)
+            self.substatements.observe(substatements)
+            self.counters['queries'] += 1
+            self.counters['syntax_errors'] += syntax_error
+            self.counters['variable_length_passthroughs'] += variable_length
+            slow = self._slow_query_callback is not None and elapsed > self._slow_query_threshold
+            self.counters['slow_queries'] += slow
+        # The callback is called outside of the lock so it may read the snapshot
+        if slow:
+            self._slow_query_callback(query, elapsed, dict(timer.stages))
+
+    def _stage(self, stage: str) -> Histogram:
+        if stage not in self.stages:
+            self.stages[stage] = Histogram(LATENCY_BUCKETS)
+        return self.stages[stage]
+
+    def snapshot(self) -> dict:
+        """
+        Returns all collected data as a dictionary
+
+        Input: None
+        Output: dictionary with counters, the substatements per query histogram and a latency histogram per stage
+        """
+        with self._lock:
+            return {'enabled': self.enabled, 'counters': dict(self.counters), 'substatements_per_query': self.substatements.snapshot(),
+                    'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()}}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+# Instrumentation shared by the whole process
+metrics = Instrumentation()
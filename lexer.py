@@ -0,0 +1,88 @@
+from bisect import bisect_left
+from collections.abc import Iterator
+
+# Kinds of tokens produced by the tokenizer
+OPEN_PAREN = '('
+CLOSE_PAREN = ')'
+OPEN_BRACKET = '['
+CLOSE_BRACKET = ']'
+OPEN_BRACE = '{'
+CLOSE_BRACE = '}'
+STAR = '*'
+ARROW = '-'
+STRING = '"'
+NUMBER = '0'
+
+# Characters that start a string literal or a quoted name, content between them is never interpreted
+QUOTES = ('"', "'", '`')
+# Characters that are emitted as single character tokens
+SINGLE_TOKENS = ('(', ')', '[', ']', '{', '}', '*')
+# Characters that can be part of a name, a digit after them is not the start of a number literal
+NAME_CHARACTERS = ('_', '$', '.')
+
+def tokenize(query: str) -> list[tuple[str, int, int]]:
+    """
+    Function that walks the cypher query once and returns the list of its tokens, see iter_tokens
+
+    Input: cypher query
+    Output: list of tokens (kind, start, end)
+    """
+    return list(iter_tokens(query))
+
+def iter_tokens(query: str) -> Iterator[tuple[str, int, int]]:
+    """
+    Function that walks the cypher query once and returns the spans of all the characters the pipeline cares about:
+    node parentheses, relationship brackets, property map braces, stars, arrow fragments, string and number literals.
+    Arrow fragments are '->', '<-' or a single '-', the same way symbol_inserter reads them. Brackets, arrows
+    or parentheses inside string literals are part of the string token and are never misread as pattern parts.
+
+    Input: cypher query: "(a)-[:KNOWS]->(b {name:'A-B'})"
+    Output: tokens (kind, start, end) like: ('(', 0, 1), (')', 2, 3), ('-', 3, 4), ('[', 4, 5), ..., ('"', 21, 26), ...
+    """
+    length = len(query)
+    i = 0
+    while i < length:
+        char = query[i]
+        if char in SINGLE_TOKENS:
+            yield (char, i, i+1)
+            i += 1
+        elif char == '-':
+            # '->' is read as a single fragment, otherwise the dash stands on its own
+            if query[i+1:i+2] == '>':
+                yield (ARROW, i, i+2)
+                i += 2
+            else:
+                yield (ARROW, i, i+1)
+                i += 1
+        elif char == '<' and query[i+1:i+2] == '-':
+            yield (ARROW, i, i+2)
+            i += 2
+        elif char in QUOTES:
+            # Find the closing quote, backslash escapes the next character inside string literals
+            end = i + 1
+            while end < length and query[end] != char:
+                end += 2 if query[end] == '\\' and char != '`' else 1
+            end = min(end + 1, length)
+            yield (STRING, i, end)
+            i = end
+        elif char.isdigit() and (i == 0 or not (query[i-1].isalnum() or query[i-1] in NAME_CHARACTERS)):
+            # Number literals like 10 or 2.5, digits that are part of a name like a1 are skipped
+            end = i + 1
+            while end < length and (query[end].isdigit() or query[end] == '.' and query[end+1:end+2].isdigit()):
+                end += 1
+            yield (NUMBER, i, end)
+            i = end
+        else:
+            i += 1
+
+def slice_tokens(tokens: list[tuple[str, int, int]], start: int, end: int) -> list[tuple[str, int, int]]:
+    """
+    Returns the tokens that lie inside text[start:end] shifted by start, so a substring of an already
+    tokenized string can be processed without tokenizing it again
+
+    Input: tokens of the whole string, start and end offset of the substring
+    Output: tokens of the substring
+    """
+    first = bisect_left(tokens, start, key=lambda token: token[1])
+    last = bisect_left(tokens, end, key=lambda token: token[1])
+    return [(kind, s - start, e - start) for kind, s, e in tokens[first:last] if e <= end]
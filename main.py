@@ -1,68 +1,245 @@
-import csv
-from reconstruction import solver
-from preprocessing import convert_to_single_line, prepare_string
+import argparse
+import asyncio
+import batch
+from batch import correct_file, correct_mapped_file, measure_throughput, read_rows
+from budget import Budget, budget_counter
+from cache import DEDUP_TABLE_SIZE
+from corrector import correct_statement
+from fastpath import fast_path_counter
+from hopcache import HOP_CACHE_SIZE, hop_cache
+from instrumentation import metrics
+from service import serve
+from shards import merge_shards, parse_shard, plan_shards, run_shard
+from preprocessing import convert_to_single_line
+from schema import save_snapshot, schema_pool
 
-def main(csv_path: str, row_number: int) -> bool:
+def evaluate_row(row: list[str]) -> bool:
     """
-    Main function that loads the desired line form csv file and 
-    calls the main processing function on it and then compares the output to the correct anwser
+    Function that calls the main processing function on a single row from the csv file
+    and then compares the output to the correct anwser
 
-    Input: csv_path, row_number
-    Output: None
+    Input: row from the csv file
+    Output: True if the output matches the correct anwser
     """
-    with open(csv_path, 'r') as csv_file:
-        csv_reader = csv.reader(csv_file)
-        # Skip the header
-        next(csv_reader)
-        for _ in range(row_number):
-            next(csv_reader)
-        row = next(csv_reader)
-
-        # Call main preprocessing funciton on input cypher statemenet which also validates the cypher direction
-        output, variable_length_flag = prepare_string(row)
-
-        # Check if the input statement is of variable length (contains *)
-        if not variable_length_flag:
-            # Call main processing function on input cypher statemenet
-            # Triple string quotes are used so this code can work for older versions of python
-            solution = solver(output, f'''{convert_to_single_line(row[0])}''')
-        else:
-            # When variable length is present, the output should just match the input statement
-            solution = output
-        print("Input statement:")
-        print(convert_to_single_line(row[0]))
-        print("------------------------------")
-        print("My output:")
-        print(solution)
-        if row[2] == '':
-            # Some rows were marked as incorrect syntax by Tomaz and were left empty
-            # Since my code marks lines with incorrect syntax as 'Syntax error', I will compare it to that
-            correct_anwser = 'Syntax error'
-        else:
-           correct_anwser = convert_to_single_line(row[2])
-        print('------------------------------')
-        print('Correct input anwser:')
-        print(correct_anwser)
-        # Compare the output of my code to the correct anwser from csv file
-        if solution == correct_anwser:
-            print('Evaluation: Correct')
-            return True
-        elif solution == 'Syntax error':
-            print('My code marks this input statement as invalid (syntax error)')
-        else:
-            print('Evaluation: Incorrect')
-            return False
-        
-if __name__ == '__main__':
-    # Run the main function on all 74 lines from csv file
-    final_evaluation = []   
-    for i in range(74):
+    solution = correct_statement(row[0], row[1])
+    print("Input statement:")
+    print(convert_to_single_line(row[0]))
+    print("------------------------------")
+    print("My output:")
+    print(solution)
+    if row[2] == '':
+        # Some rows were marked as incorrect syntax by Tomaz and were left empty
+        # Since my code marks lines with incorrect syntax as 'Syntax error', I will compare it to that
+        correct_anwser = 'Syntax error'
+    else:
+       correct_anwser = convert_to_single_line(row[2])
+    print('------------------------------')
+    print('Correct input anwser:')
+    print(correct_anwser)
+    # Compare the output of my code to the correct anwser from csv file
+    if solution == correct_anwser:
+        print('Evaluation: Correct')
+        return True
+    elif solution == 'Syntax error':
+        print('My code marks this input statement as invalid (syntax error)')
+    else:
+        print('Evaluation: Incorrect')
+        return False
+
+def evaluate(csv_path: str) -> bool:
+    """
+    Main evaluation function that reads the csv file once and evaluates every line from it
+
+    Input: csv_path
+    Output: True if all lines are correct
+    """
+    final_evaluation = []
+    for i, row in enumerate(read_rows(csv_path)):
         print("===============================================================================")
         print("Statement number: ", i)
-        final_evaluation.append(main('examples.csv', i))
+        final_evaluation.append(evaluate_row(row))
     print("===============================================================================")
     print("Final evaluation:")
     if all(final_evaluation):
         print("All correct")
     else:
         print("Fail")
+    return all(final_evaluation)
+
+def add_persistent_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the options of the persistent cache to a command
+
+    Input: parser of the command
+    Output: None
+    """
+    parser.add_argument('--persistent-cache', help='sqlite file that keeps the corrected queries between runs')
+    parser.add_argument('--persistent-max-entries', type=int, help='evict the least recently used entries above this number')
+    parser.add_argument('--persistent-max-age', type=float, help='evict the entries older than this number of days')
+
+def persistent_options(args: argparse.Namespace) -> dict | None:
+    """
+    Returns the keyword arguments of PersistentCache from the command line options, None if it is not used
+
+    Input: parsed command line arguments
+    Output: dictionary like {'path': 'cache.sqlite', 'max_entries': None, 'max_age': 604800.0} or None
+    """
+    if not args.persistent_cache:
+        return None
+    max_age = args.persistent_max_age * 86400 if args.persistent_max_age is not None else None
+    return {'path': args.persistent_cache, 'max_entries': args.persistent_max_entries, 'max_age': max_age}
+
+def add_budget_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the limits of the per-query budget to a command
+
+    Input: parser of the command
+    Output: None
+    """
+    parser.add_argument('--max-length', type=int, help='return statements longer than this number of characters unchanged')
+    parser.add_argument('--max-hops', type=int, help='return statements with more hops than this unchanged')
+    parser.add_argument('--max-seconds', type=float, help='abandon a statement after this number of seconds and return it unchanged')
+
+def budget_options(args: argparse.Namespace) -> Budget | None:
+    """
+    Returns the budget of every query from the command line options, None if no limit is given
+
+    Input: parsed command line arguments
+    Output: budget like Budget(max_length=None, max_hops=50, max_seconds=0.1) or None
+    """
+    budget = Budget(args.max_length, args.max_hops, args.max_seconds)
+    return budget if any(limit is not None for limit in budget) else None
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Command line entry point, without a command all lines from examples.csv are evaluated
+
+    Input: command line arguments
+    Output: None
+    """
+    parser = argparse.ArgumentParser(description='Validates and corrects the relationship directions of cypher statements')
+    commands = parser.add_subparsers(dest='command')
+
+    evaluate_parser = commands.add_parser('evaluate', help='compare the output with the correct anwsers from a csv file')
+    evaluate_parser.add_argument('--input', default='examples.csv')
+
+    correct_parser = commands.add_parser('correct', help='correct every statement from a csv file in a single streaming pass')
+    correct_parser.add_argument('--input', required=True)
+    correct_parser.add_argument('--output', required=True)
+    correct_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    correct_parser.add_argument('--cache-size', type=int, default=0, help='number of query templates in the result cache of every process, 0 disables it')
+    correct_parser.add_argument('--dedup-size', type=int, default=DEDUP_TABLE_SIZE, help='number of distinct (query, schema) pairs in the dedup table of every process, 0 disables it')
+    correct_parser.add_argument('--hop-cache-size', type=int, default=HOP_CACHE_SIZE, help='number of validated hops in the hop cache of every process, 0 disables it')
+    add_persistent_arguments(correct_parser)
+    correct_parser.add_argument('--schema-snapshot', help='load the compiled schemas from this snapshot instead of parsing them')
+    add_budget_arguments(correct_parser)
+    correct_parser.add_argument('--mmap', action='store_true', help='memory-map the input and send byte ranges to the workers, for multi-gigabyte files')
+    correct_parser.add_argument('--metrics', help='save the per-stage latency histograms and counters of a single process run to this json file')
+
+    throughput_parser = commands.add_parser('throughput', help='report the rows per second for different numbers of worker processes')
+    throughput_parser.add_argument('--input', required=True)
+    throughput_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+
+    serve_parser = commands.add_parser('serve', help='run the json lines correction service on a tcp or unix socket')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--unix', help='listen on this unix socket path instead of tcp')
+    serve_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    serve_parser.add_argument('--batch-size', type=int, default=64, help='maximum number of requests in a micro-batch')
+    serve_parser.add_argument('--batch-window', type=float, default=0.005, help='seconds a micro-batch waits for more requests')
+    serve_parser.add_argument('--max-in-flight', type=int, default=256, help='maximum number of unanswered requests per connection')
+    serve_parser.add_argument('--schema-snapshot', help='every worker loads the compiled schemas from this snapshot instead of parsing them')
+    add_budget_arguments(serve_parser)
+
+    compile_parser = commands.add_parser('compile-schema', help='parse schemas once and write their indexes to a binary snapshot')
+    compile_parser.add_argument('--input', help='csv file, every distinct schema of its schema column is compiled')
+    compile_parser.add_argument('--schema', action='append', default=[], help='schema string to compile, may be repeated')
+    compile_parser.add_argument('--output', required=True, help='snapshot path')
+
+    shard_parser = commands.add_parser('shard', help='cut a csv file into N byte ranges on record boundaries and write the manifest')
+    shard_parser.add_argument('--input', required=True)
+    shard_parser.add_argument('--shards', type=int, required=True, help='number of shards')
+    shard_parser.add_argument('--manifest', required=True, help='manifest path, the shard outputs are written next to it')
+
+    run_parser = commands.add_parser('run', help='correct a single shard, a failed shard resumes from its last committed offset')
+    run_parser.add_argument('--manifest', required=True)
+    run_parser.add_argument('--shard', required=True, help='shard to run as k/N with k from 1 to N')
+    run_parser.add_argument('--cache-size', type=int, default=0, help='number of query templates in the result cache, 0 disables it')
+    run_parser.add_argument('--dedup-size', type=int, default=DEDUP_TABLE_SIZE, help='number of distinct (query, schema) pairs in the dedup table, 0 disables it')
+    run_parser.add_argument('--hop-cache-size', type=int, default=HOP_CACHE_SIZE, help='number of validated hops in the hop cache, 0 disables it')
+    add_persistent_arguments(run_parser)
+    run_parser.add_argument('--schema-snapshot', help='load the compiled schemas from this snapshot instead of parsing them')
+    add_budget_arguments(run_parser)
+
+    merge_parser = commands.add_parser('merge', help='reassemble the shard outputs in input order and check row counts and checksums')
+    merge_parser.add_argument('--manifest', required=True)
+    merge_parser.add_argument('--output', required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == 'correct':
+        if args.metrics:
+            metrics.enable()
+        correct = correct_mapped_file if args.mmap else correct_file
+        rows = correct(args.input, args.output, args.workers, args.cache_size, args.dedup_size, persistent_options(args), args.schema_snapshot,
+                       budget_options(args), args.hop_cache_size)
+        print(f'Corrected {rows} rows')
+        print(f'Schema pool: {schema_pool.stats()}')
+        if args.metrics:
+            with open(args.metrics, 'w') as metrics_file:
+                metrics_file.write(metrics.to_json())
+        if args.workers <= 1:
+            print(f'Fast path: {fast_path_counter.stats()}')
+            print(f'Hop cache: {hop_cache.stats()}')
+        if batch.result_cache is not None and args.workers <= 1:
+            print(f'Result cache: {batch.result_cache.stats()}')
+        if batch.dedup_table is not None and args.workers <= 1:
+            print(f'Dedup: {batch.dedup_table.stats()}')
+        if batch.persistent_cache is not None and args.workers <= 1:
+            print(f'Persistent cache: {batch.persistent_cache.stats()}')
+        if batch.row_budget is not None and args.workers <= 1:
+            print(f'Budget: {budget_counter.stats()}')
+    elif args.command in ('shard', 'run', 'merge'):
+        try:
+            if args.command == 'shard':
+                manifest = plan_shards(args.input, args.shards, args.manifest)
+                for shard in manifest['shards']:
+                    print(f"Shard {shard['shard']}/{args.shards}: bytes {shard['start']}-{shard['end']}")
+            elif args.command == 'run':
+                state = run_shard(args.manifest, *parse_shard(args.shard), args.cache_size, args.dedup_size, persistent_options(args),
+                                  args.schema_snapshot, budget_options(args), args.hop_cache_size)
+                print(f"Shard {args.shard}: {state['rows']} rows, crc32 {state['crc32']:08x}")
+                print(f'Schema pool: {schema_pool.stats()}')
+                if batch.dedup_table is not None:
+                    print(f'Dedup: {batch.dedup_table.stats()}')
+                if batch.persistent_cache is not None:
+                    print(f'Persistent cache: {batch.persistent_cache.stats()}')
+                if batch.row_budget is not None:
+                    print(f'Budget: {budget_counter.stats()}')
+            else:
+                report = merge_shards(args.manifest, args.output)
+                print(f"Merged {report['shards']} shards: {report['rows']} rows, {report['bytes']} bytes, crc32 {report['crc32']:08x}")
+        except ValueError as error:
+            parser.error(str(error))
+    elif args.command == 'compile-schema':
+        if not args.input and not args.schema:
+            parser.error('compile-schema needs --input or --schema')
+        schemas = list(args.schema)
+        if args.input:
+            schemas.extend(row[1] for row in read_rows(args.input))
+        count = save_snapshot(schemas, args.output)
+        print(f'Compiled {count} schemas into {args.output}')
+    elif args.command == 'throughput':
+        print(f"{'workers':>8} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+        for result in measure_throughput(args.input, args.workers):
+            print(f"{result['workers']:>8} {result['rows']:>10} {result['seconds']:>10.3f} {result['rows_per_second']:>12.1f}")
+    elif args.command == 'serve':
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.batch_size, args.batch_window, args.max_in_flight,
+                              args.schema_snapshot, budget_options(args)))
+        except KeyboardInterrupt:
+            pass
+    else:
+        evaluate(getattr(args, 'input', 'examples.csv'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import mmap
+import os
+from collections.abc import Iterator, Sequence
+
+# Size of the byte ranges the input is cut into, every range is corrected as a single task
+RANGE_SIZE = 1 << 20
+# Size of the slices the quotes are counted in while looking for a range boundary
+COUNT_SLICE_SIZE = 1 << 20
+# Encoding of the input csv files
+ENCODING = 'utf-8'
+
+class MappedRow(Sequence):
+    """
+    Lazy view of a single csv record inside the memory-mapped file, the fields are only located on first access
+    and every access decodes just the field that is asked for, row[0], row[1] and row[2] are the query, schema
+    and expected output like in the rows from read_rows
+    """
+    __slots__ = ('buffer', 'start', 'end', '_fields')
+
+    def __init__(self, buffer: mmap.mmap, start: int, end: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._fields = None
+
+    def __len__(self) -> int:
+        return len(self.fields())
+
+    def __getitem__(self, index: int) -> str:
+        start, end, quoted = self.fields()[index]
+        value = self.buffer[start:end].decode(ENCODING)
+        # Quotes inside a quoted field are escaped by doubling them
+        return value.replace('""', '"') if quoted else value
+
+    def __repr__(self) -> str:
+        return f'MappedRow({list(self)!r})'
+
+    def fields(self) -> list[tuple[int, int, bool]]:
+        """
+        Locates the fields of the record, a quoted field may contain commas, newlines and doubled quotes
+
+        Input: None
+        Output: list of fields (start, end, quoted) with the offsets of the field content in the file
+        """
+        if self._fields is None:
+            self._fields = _split_fields(self.buffer, self.start, self.end)
+        return self._fields
+
+class MappedCsv:
+    """
+    Read-only memory map of an input csv file. The file is never read as a whole, record boundaries are found
+    with find over the mapped bytes while respecting quotes, so a quoted statement split over several lines
+    stays one record. Pages of ranges that were processed can be released to keep the resident memory flat.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # Empty files can not be mapped
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.size = size
+        # The data starts after the header
+        self.data_start = _record_end(self.buffer, 0, size)
+
+    def __enter__(self) -> 'MappedCsv':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+
+    def ranges(self, range_size: int = RANGE_SIZE) -> Iterator[tuple[int, int]]:
+        """
+        Generator that cuts the data into byte ranges of about range_size bytes, every range starts and ends on a
+        record boundary. The quotes before a cut are counted to know if the cut falls inside a quoted field.
+
+        Input: approximate size of a range in bytes
+        Output: byte ranges (start, end) in file order
+        """
+        start = self.data_start
+        while start < self.size:
+            end = self.boundary_after(start, start + range_size)
+            yield start, end
+            start = end
+
+    def split(self, parts: int) -> list[tuple[int, int]]:
+        """
+        Cuts the data into parts byte ranges of about the same size, every range starts and ends on a record boundary,
+        ranges may be empty if the file has fewer records than parts
+
+        Input: number of ranges
+        Output: list of byte ranges (start, end)
+        """
+        ranges = []
+        start = self.data_start
+        length = self.size - self.data_start
+        for part in range(1, parts + 1):
+            end = self.boundary_after(start, self.data_start + length * part // parts) if part < parts else self.size
+            ranges.append((start, end))
+            start = end
+        return ranges
+
+    def boundary_after(self, start: int, position: int) -> int:
+        """
+        Finds the first record boundary at or after position
+
+        Input: record boundary start, position after start
+        Output: offset of the first record that starts at or after position, the size of the file if there is none
+        """
+        if position <= start:
+            return start
+        if position >= self.size:
+            return self.size
+        # start is outside of quotes, so an odd number of quotes up to position means position is inside a quoted field
+        quotes = 0
+        for offset in range(start, position, COUNT_SLICE_SIZE):
+            quotes += self.buffer[offset:min(offset + COUNT_SLICE_SIZE, position)].count(b'"')
+        # A cut right after a newline is already a boundary
+        if quotes % 2 == 0 and self.buffer[position-1:position] == b'\n':
+            return position
+        return _record_end(self.buffer, position, self.size, quotes % 2 == 1)
+
+    def rows(self, start: int | None = None, end: int | None = None) -> Iterator[MappedRow]:
+        """
+        Generator that yields lazy views of the records in a byte range, blank lines are skipped
+
+        Input: byte range of the data, the whole data if not given
+        Output: MappedRow views
+        """
+        position = self.data_start if start is None else start
+        end = self.size if end is None else end
+        while position < end:
+            record_end = _record_end(self.buffer, position, end)
+            # The newline (and carriage return) at the end of the record is not part of the last field
+            content_end = record_end
+            if self.buffer[content_end-1:content_end] == b'\n':
+                content_end -= 1
+            if self.buffer[content_end-1:content_end] == b'\r' and content_end > position:
+                content_end -= 1
+            if content_end > position:
+                yield MappedRow(self.buffer, position, content_end)
+            position = record_end
+
+    def release(self, start: int, end: int) -> None:
+        """
+        Tells the kernel that the pages of a processed range are not needed anymore, so they leave the resident
+        memory of the process, it does nothing on platforms without madvise
+
+        Input: byte range
+        Output: None
+        """
+        if not isinstance(self.buffer, mmap.mmap) or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        # madvise needs a page aligned start
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            self.buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def _record_end(buffer: mmap.mmap | bytes, position: int, end: int, in_quotes: bool = False) -> int:
+    # Returns the offset right after the newline that ends the record, newlines inside quotes are part of the record
+    while True:
+        if in_quotes:
+            quote = buffer.find(b'"', position, end)
+            if quote == -1:
+                return end
+            position = quote + 1
+        newline = buffer.find(b'\n', position, end)
+        quote = buffer.find(b'"', position, end if newline == -1 else newline)
+        if quote == -1:
+            return end if newline == -1 else newline + 1
+        # A doubled quote inside a quoted field closes and reopens the field, so it does not change the state
+        position = quote + 1
+        in_quotes = True
+
+def _split_fields(buffer: mmap.mmap | bytes, start: int, end: int) -> list[tuple[int, int, bool]]:
+    # Splits the record on the commas outside of quotes
+    fields = []
+    position = start
+    while True:
+        if position < end and buffer[position:position+1] == b'"':
+            # Quoted field, a doubled quote is an escaped quote and not the end of the field
+            content_start = position + 1
+            closing = buffer.find(b'"', content_start, end)
+            while closing != -1 and buffer[closing+1:closing+2] == b'"':
+                closing = buffer.find(b'"', closing + 2, end)
+            content_end = end if closing == -1 else closing
+            comma = buffer.find(b',', content_end, end)
+            fields.append((content_start, content_end, True))
+        else:
+            comma = buffer.find(b',', position, end)
+            fields.append((position, end if comma == -1 else comma, False))
+        if comma == -1:
+            return fields
+        position = comma + 1
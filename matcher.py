@@ -0,0 +1,133 @@
+from collections.abc import Iterable
+
+# Key of the trie node entry that holds the word ending at that node
+WORD = ''
+
+def is_name_character(char: str) -> bool:
+    """
+    Checks if the character can be part of a label or relationship name
+
+    Input: single character
+    Output: True for letters, digits and _
+    """
+    return char.isalnum() or char == '_'
+
+class LabelMatcher:
+    """
+    Trie of all the labels and relationship types of a schema that finds every whole-word occurrence of them
+    in a single pass over the text. A word only matches when it is not part of a longer name,
+    so Person is found in (a:Person) but not in (a:PersonalInfo).
+    """
+    __slots__ = ('root', 'words')
+
+    def __init__(self, words: Iterable[str]):
+        self.root = {}
+        self.words = set()
+        for word in words:
+            if not word:
+                continue
+            self.words.add(word)
+            node = self.root
+            for char in word:
+                node = node.setdefault(char, {})
+            node[WORD] = word
+
+    @classmethod
+    def from_trie(cls, root: dict, words: set[str]) -> 'LabelMatcher':
+        """
+        Builds a matcher from the trie and words of another matcher, used to load compiled schemas from a snapshot
+
+        Input: nested dictionaries of the trie, set of words
+        Output: LabelMatcher
+        """
+        matcher = cls.__new__(cls)
+        matcher.root = root
+        matcher.words = words
+        return matcher
+
+    def find_all(self, text: str) -> list[tuple[int, str]]:
+        """
+        Finds every whole-word occurrence of the words in the text, the trie is only walked from positions where a name starts
+
+        Input: text like '(a:Person)-[ACTED_IN]->(m:Movie)'
+        Output: list of (start index, word) like [(3, 'Person'), (12, 'ACTED_IN'), (26, 'Movie')]
+        """
+        root = self.root
+        length = len(text)
+        matches = []
+        previous_is_name = False
+        for start in range(length):
+            char = text[start]
+            is_name = is_name_character(char)
+            # Only start matching at the beginning of a name
+            if char in root and not (previous_is_name and is_name):
+                node = root
+                end = start
+                while end < length and text[end] in node:
+                    node = node[text[end]]
+                    end += 1
+                    # The word has to end where the name ends
+                    if WORD in node and (end == length or not is_name_character(text[end]) or not is_name_character(text[end-1])):
+                        matches.append((start, node[WORD]))
+            previous_is_name = is_name
+        return matches
+
+    def first_positions(self, text: str) -> dict[str, int]:
+        """
+        Returns the first start index of every word found in the text
+
+        Input: text
+        Output: dictionary of word -> first start index
+        """
+        positions = {}
+        for start, word in self.find_all(text):
+            if word not in positions:
+                positions[word] = start
+        return positions
+
+    def present(self, text: str) -> set[str]:
+        """
+        Returns the set of words that occur in the text
+
+        Input: text
+        Output: set of words
+        """
+        return {word for _, word in self.find_all(text)}
+
+    def prefixes(self, text: str) -> set[str]:
+        """
+        Returns the set of words that the text starts with, without the whole-word check
+
+        Input: text like 'PersonMovie)'
+        Output: set of words like {'Person', 'PersonMovie'}
+        """
+        node = self.root
+        found = set()
+        for char in text:
+            if char not in node:
+                break
+            node = node[char]
+            if WORD in node:
+                found.add(node[WORD])
+        return found
+
+    def substrings(self, text: str) -> set[str]:
+        """
+        Returns the set of words that occur anywhere in the text, without the whole-word check. The trie is walked
+        from every position of the text, so the cost depends on the text and not on the number of words
+
+        Input: text like '[r:KNOWS_WELL]'
+        Output: set of words like {'KNOWS', 'KNOWS_WELL'}
+        """
+        root = self.root
+        length = len(text)
+        found = set()
+        for start in range(length):
+            node = root
+            end = start
+            while end < length and text[end] in node:
+                node = node[text[end]]
+                end += 1
+                if WORD in node:
+                    found.add(node[WORD])
+        return found
@@ -0,0 +1,93 @@
+import sys
+from functools import lru_cache
+from typing import NamedTuple
+from lexer import iter_tokens
+from patterns import iter_hop_records, node_labels
+
+# Number of distinct node texts whose labels are kept, nodes repeat a lot between queries of the same schema
+LABELS_CACHE_SIZE = 4096
+
+class Node(NamedTuple):
+    """
+    Node of a hop, offsets point into the text of the pattern and the labels are interned
+    """
+    start: int
+    end: int
+    labels: tuple[str, ...]
+
+class Relationship(NamedTuple):
+    """
+    Relationship brackets of a hop, offsets point into the text of the pattern and are -1 if the hop has no brackets.
+    The type is None until extract_relationship finds a meaningful relationship in the hop.
+    """
+    start: int
+    end: int
+    type: str | None = None
+
+class Endpoint(NamedTuple):
+    """
+    Source or target label of a hop found by identify_nodes, the offset points into the text of the hop
+    """
+    label: str
+    start: int
+    triple: tuple[str, str, str]
+
+class Hop:
+    """
+    Single hop of a pattern like (a:Person)-[:ACTED_IN]->(m:Movie), the text is the substatement the stages work on
+    """
+    __slots__ = ('text', 'left', 'right', 'relationship', 'source', 'target')
+
+    def __init__(self, text: str, left: Node, right: Node, relationship: Relationship):
+        self.text = text
+        self.left = left
+        self.right = right
+        self.relationship = relationship
+        self.source = None
+        self.target = None
+
+    def __repr__(self) -> str:
+        return f'Hop({self.text!r})'
+
+class Pattern:
+    """
+    Directed statement like (a)-[:KNOWS]->(b)<-[:KNOWS]-(c) and the hops it is made of
+    """
+    __slots__ = ('text', 'hops')
+
+    def __init__(self, text: str, hops: list[Hop]):
+        self.text = text
+        self.hops = hops
+
+    def __repr__(self) -> str:
+        return f'Pattern({self.text!r}, hops={len(self.hops)})'
+
+def build_pattern(statement: str, tokens: list[tuple[str, int, int]] | None = None) -> Pattern:
+    """
+    Builds the pattern of a directed statement with a single pass over its tokens, see iter_hop_records.
+    Without tokens the statement is tokenized lazily, so no token list is kept in memory.
+    The text of every hop has any instance of ! removed.
+
+    Input: directed statement like '(a)-[:KNOWS]->(b:Person)', optional tokens of the statement
+    Output: pattern holding one hop with the nodes (0, 3, ()) and (15, 24, ('Person',))
+    """
+    if tokens is None:
+        tokens = iter_tokens(statement)
+    hops = []
+    right = None
+    for left_start, left_end, relationship_start, relationship_end, right_start, right_end in iter_hop_records(statement, tokens):
+        # Every node except the first and the last is shared by two neighbouring hops
+        left = right if right is not None and right.start == left_start else _node(statement, left_start, left_end)
+        right = _node(statement, right_start, right_end)
+        hops.append(Hop(statement[left_start:right_end].replace('!', ''), left, right,
+                        Relationship(relationship_start, relationship_end)))
+    return Pattern(statement, hops)
+
+def _node(statement: str, start: int, end: int) -> Node:
+    return Node(start, end, _labels(statement[start:end]))
+
+@lru_cache(maxsize=LABELS_CACHE_SIZE)
+def _labels(node: str) -> tuple[str, ...]:
+    # Labels are stripped of backticks and interned, equal nodes of all queries share one tuple of labels
+    _, labels = node_labels(node, 0, len(node))
+    return tuple(sys.intern(label.strip('`')) for label in labels)
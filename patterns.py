@@ -0,0 +1,162 @@
+from collections.abc import Iterable, Iterator
+from lexer import ARROW, CLOSE_BRACE, CLOSE_BRACKET, CLOSE_PAREN, NUMBER, OPEN_BRACE, OPEN_BRACKET, OPEN_PAREN, STRING, tokenize
+
+# Tokens that may appear inside a simple node or relationship, anything else makes the pattern too complex to read
+PROPERTY_TOKENS = (STRING, NUMBER, OPEN_BRACE, CLOSE_BRACE)
+# Characters after a node that make the pipeline read it as the start of a directed statement
+DIRECTION_CHARACTERS = ('-', '>', '<')
+
+def find_hops(query: str, tokens: list[tuple[str, int, int]]) -> list[tuple[int, int, int, int, int, int, str]] | None:
+    """
+    Function that walks the tokens once and collects every hop of the simple path patterns in the query.
+    A hop is two nodes written right next to a relationship like (a:Person)-[:KNOWS]->(b) or (a)<--(b),
+    nodes and relationships may only contain names and property maps.
+
+    Input: cypher query, tokens of the query
+    Output: list of hops (left start, left end, relationship start, relationship end, right start, right end, direction)
+            where the relationship offsets are -1 for hops without brackets and the direction is '->', '<-' or '-',
+            None if the query contains an arrow or direction character that is not part of such a hop
+    """
+    hops = []
+    count = len(tokens)
+    i = 0
+    while i < count:
+        kind, start, end = tokens[i]
+        if kind == ARROW:
+            # Arrows outside of a simple hop
+            return None
+        if kind == CLOSE_PAREN and query[end:end+1] in DIRECTION_CHARACTERS:
+            # Closing parenthesis of something that is not a simple node followed by a direction
+            return None
+        if kind != OPEN_PAREN:
+            i += 1
+            continue
+        close = _closing_token(tokens, i, CLOSE_PAREN)
+        if close == -1:
+            i += 1
+            continue
+        left_start, left_end = start, tokens[close][2]
+        i = close + 1
+        # Follow the path as long as another hop starts right after the node
+        while left_end < len(query) and query[left_end] in DIRECTION_CHARACTERS:
+            hop = _read_hop(query, tokens, i, left_end)
+            if hop is None:
+                return None
+            relationship_start, relationship_end, right_start, right_end, direction, i = hop
+            hops.append((left_start, left_end, relationship_start, relationship_end, right_start, right_end, direction))
+            left_start, left_end = right_start, right_end
+    return hops
+
+def _closing_token(tokens: list[tuple[str, int, int]], index: int, closing: str) -> int:
+    # Returns the index of the closing token of a node or relationship, -1 if it contains other tokens
+    for j in range(index + 1, len(tokens)):
+        kind = tokens[j][0]
+        if kind == closing:
+            return j
+        if kind not in PROPERTY_TOKENS:
+            return -1
+    return -1
+
+def _read_hop(query: str, tokens: list[tuple[str, int, int]], index: int, position: int) -> tuple | None:
+    # Reads the relationship and the right node that follow a node ending at position, every part has to follow without spaces
+    if index >= len(tokens) or tokens[index][0] != ARROW or tokens[index][1] != position:
+        return None
+    first = query[tokens[index][1]:tokens[index][2]]
+    if first == '->':
+        return None
+    position = tokens[index][2]
+    index += 1
+
+    relationship_start = relationship_end = -1
+    if index < len(tokens) and tokens[index][0] == OPEN_BRACKET and tokens[index][1] == position:
+        close = _closing_token(tokens, index, CLOSE_BRACKET)
+        if close == -1:
+            return None
+        relationship_start, relationship_end = tokens[index][1], tokens[close][2]
+        position = relationship_end
+        index = close + 1
+
+    if index >= len(tokens) or tokens[index][0] != ARROW or tokens[index][1] != position:
+        return None
+    second = query[tokens[index][1]:tokens[index][2]]
+    if second == '<-' or first == '<-' and second == '->':
+        return None
+    position = tokens[index][2]
+    index += 1
+
+    if index >= len(tokens) or tokens[index][0] != OPEN_PAREN or tokens[index][1] != position:
+        return None
+    close = _closing_token(tokens, index, CLOSE_PAREN)
+    if close == -1:
+        return None
+    direction = '<-' if first == '<-' else '->' if second == '->' else '-'
+    return relationship_start, relationship_end, position, tokens[close][2], direction, close + 1
+
+def node_labels(query: str, start: int, end: int) -> tuple[str, list[str]]:
+    """
+    Splits a simple node into its variable and labels, the property map is ignored
+
+    Input: cypher query, start and end offset of the node like (a:Person:Actor {name:"Tom"})
+    Output: variable and list of labels like ('a', ['Person', 'Actor'])
+    """
+    variable, *labels = [part.strip() for part in query[start+1:end-1].split('{', 1)[0].split(':')]
+    return variable, labels
+
+def read_hop(substatement: str, tokens: list[tuple[str, int, int]] | None = None) -> tuple[list[str], str, list[str], tuple[int, int], tuple[int, int]] | None:
+    """
+    Reads the parts of a single hop substatement, labels and the relationship type are stripped of spaces and backticks
+
+    Input: substatement like '(a:Person:Actor)-[ACTED_IN]->(m:Movie)', optional tokens of the substatement
+    Output: labels of the left node, relationship type or '' if untyped, labels of the right node and the spans of
+            the first and last arrow fragment like (['Person', 'Actor'], 'ACTED_IN', ['Movie'], (16, 17), (27, 29)),
+            None if the substatement is not a hop
+    """
+    if tokens is None:
+        tokens = tokenize(substatement)
+    left_end = next((end for kind, _, end in tokens if kind == CLOSE_PAREN), -1)
+    right_start = next((start for kind, start, _ in reversed(tokens) if kind == OPEN_PAREN), -1)
+    if left_end == -1 or right_start < left_end:
+        return None
+    arrows = [(start, end) for kind, start, end in tokens if kind == ARROW and left_end <= start and end <= right_start]
+    if len(arrows) < 2:
+        return None
+
+    relationship = ''
+    bracket_start = substatement.find('[', left_end, right_start)
+    bracket_end = substatement.find(']', left_end, right_start)
+    if bracket_start != -1 and bracket_end > bracket_start:
+        relationship = substatement[bracket_start+1:bracket_end].split('{', 1)[0]
+        if ':' in relationship:
+            relationship = relationship.split(':', 1)[1]
+        relationship = relationship.strip(' `')
+
+    _, left_labels = node_labels(substatement, 0, left_end)
+    _, right_labels = node_labels(substatement, right_start, len(substatement))
+    return [label.strip('`') for label in left_labels], relationship, [label.strip('`') for label in right_labels], arrows[0], arrows[-1]
+
+def iter_hop_records(statement: str, tokens: Iterable[tuple[str, int, int]]) -> Iterator[tuple[int, int, int, int, int, int]]:
+    """
+    Function that walks the tokens of a directed statement once and yields a record of offsets for every hop,
+    two neighbouring body parts ( ... ) form a hop and the first relationship brackets between them are its relationship.
+    Every node except the first and the last is the right node of one hop and the left node of the next one.
+    The tokens may be a lazy iterator so the statement is never tokenized as a whole.
+
+    Input: directed statement like '(a)-[:KNOWS]->(b)<-[:KNOWS]-(c)', tokens of the statement
+    Output: hop records (left start, left end, relationship start, relationship end, right start, right end)
+            like (0, 3, 4, 11, 13, 16), (13, 16, 18, 25, 27, 30), the relationship offsets are -1 if there are no brackets
+    """
+    # Start and end of the previous body part and start of the body part we're currently in, -1 if not found yet
+    previous_start, previous_end, start_index = -1, -1, -1
+    relationship_start, relationship_end = -1, -1
+    for kind, start, end in tokens:
+        if kind == OPEN_PAREN and start_index == -1:
+            start_index = start
+        elif kind == CLOSE_PAREN and start_index != -1:
+            if previous_start != -1:
+                yield previous_start, previous_end, relationship_start, relationship_end, start_index, end
+            previous_start, previous_end, start_index = start_index, end, -1
+            relationship_start, relationship_end = -1, -1
+        elif kind == OPEN_BRACKET and start_index == -1 and relationship_start == -1:
+            relationship_start = start
+        elif kind == CLOSE_BRACKET and start_index == -1 and relationship_start != -1 and relationship_end == -1:
+            relationship_end = end
@@ -1,20 +1,31 @@
+from collections.abc import Iterable, Iterator
 from dicts import extract_relationship, identify_nodes
-
-def check_brackets(s: str) -> bool:
+from instrumentation import metrics
+from budget import QueryBudget
+from hopcache import hop_cache
+from lexer import CLOSE_BRACKET, CLOSE_PAREN, OPEN_BRACKET, OPEN_PAREN, STAR, iter_tokens, slice_tokens, tokenize
+from model import Hop, Pattern, build_pattern
+from patterns import read_hop
+from reconstruction import apply_edits
+from schema import BACKWARD, FORWARD, INVALID, CompiledSchema, compile_schema, format_schema
+
+def check_brackets(s: str, tokens: list[tuple[str, int, int]] | None = None) -> bool:
     """
     This function checks if the cypher query contains variable length relationships as those are not supposed
     to be processed by this code which marks them as 'Syntax error' if they do not make sense according to the schema
 
-    Input: cypher query
+    Input: cypher query, optional tokens of the query
     Output: True if variable length relationship is present, False otherwise
     """
+    if tokens is None:
+        tokens = tokenize(s)
     inside_brackets = False
-    for char in s:
-        if char == '[':
+    for kind, _, _ in tokens:
+        if kind == OPEN_BRACKET:
             inside_brackets = True
-        elif char == ']':
+        elif kind == CLOSE_BRACKET:
             inside_brackets = False
-        elif char == '*' and inside_brackets:
+        elif kind == STAR and inside_brackets:
             return True
     return False
 
@@ -30,284 +41,271 @@ def convert_to_single_line(cypher_statement: str) -> str:
 def infer_labels_from_schema(query: str, schema_dict: dict) -> str:
     """
     This function infers the labels of nodes in the query that are not specified in the query
-    like () or (a) or by looking at the schema and converting them to (a:Person) or (a:Person:Actor)
+    like () or (a) or by looking at the schema and converting them to (a:Person) or (a:Person:Actor).
+    The rewrites are collected in a single scan and applied at once.
 
     Input: query, schema_dict
     Output: query with inferred labels
     """
-    start = 0
-    while True:
-        start = query.find('(', start)
-        if start == -1: break
-        end = query.find(')', start)
-        if end == -1: break
-        node_name = query[start+1:end].strip()
-        
-        if node_name == '*' or node_name == '':
-            start = end + 1
-            continue
-
-        if ':' not in node_name:
-            if node_name in schema_dict:
-                query = query[:start] + f'({node_name}:{schema_dict[node_name]})' + query[end+1:]
-        start = end + 1
-        
-    return query
-
-def get_mappings(query: str, schema: str) -> str:
-    """
-    This function gets the mappings between the query and the schema like, converts all the nodes in the query to be like those in schema if possible
-    
-    Input: query, schema
-    Output: query with nodes mapped to schema    
-    """
-    # Extract nodes from schema
-    schema_nodes=[part.strip() for part in schema.replace('(', '').replace(')', '').split(',')]
-    schema_dict = {}
-    for i in range(0, len(schema_nodes), 3):
-        label = schema_nodes[i].strip()
-        relationship = schema_nodes[i+1].strip()
-        
-        if label in schema_dict:
-            schema_dict[label].append(relationship)
-        else:
-            schema_dict[label] = [relationship]
-
-    # Extract nodes from query
-    start = 0
-    query_nodes = []
-    while True:
-        start = query.find('(', start)
-        if start == -1: break
-        end = query.find(')', start)
-        if end == -1: break
-        node = query[start+1:end].strip()
-        query_nodes.append(node)
-        start = end+1
-
-    query_nodes_dict = {node.split(':')[0]: node for node in query_nodes if ':' in node}
-
-    # Iterate through the query nodes and update the query
-    for node in query_nodes:
-        if node == '*' or node == ' ':
-            continue
-
-        if ':' in node:
-            continue
-
-        # Check if the node is in schema_dict
-        if node in schema_dict:
-            query = query.replace(f'({node})', f'({node}:{schema_dict[node]})')
-        else:
-            # Check if there's a mapping in query_nodes_dict
-            if node in query_nodes_dict:
-                query = query.replace(f'({node})', f'({query_nodes_dict[node]})')
-            else:
-                # If not, raise an error
-                continue
-
-    # Handle nodes like () by inferring labels from the schema
-    query = infer_labels_from_schema(query, schema_dict)
+    edits = []
+    # The scan goes on at the old end of a rewritten node in the rewritten query, so a rewrite that is shorter than the node
+    # skips that many characters after it. resume is that offset and shift the length difference of the rewritten query so far
+    resume, shift = 0, 0
+    for start, end, _ in scan_nodes(query):
+        text = query[start:end+1]
+        rewritten, resume = _infer_node_labels(text, start + shift, resume, schema_dict)
+        if rewritten != text:
+            edits.append((start, end + 1, rewritten))
+            shift += len(rewritten) - len(text)
+    return apply_edits(query, edits)
+
+def scan_nodes(query: str, tokens: Iterable[tuple[str, int, int]] | None = None) -> Iterator[tuple[int, int, str]]:
+    """
+    Generator that scans the tokens of the query once from left to right and yields every node, a node runs from an
+    opening parenthesis to the first closing parenthesis after it and the scan continues after that.
+    Parentheses inside string literals are part of the string token, so a literal never ends a node.
 
-    return query
+    Input: query like 'MATCH (a:Person)-->( b ) RETURN b', optional tokens of the query
+    Output: nodes (start, offset of the closing parenthesis, text without surrounding spaces) like (6, 15, 'a:Person'), (19, 23, 'b')
+    """
+    if tokens is None:
+        tokens = iter_tokens(query)
+    start = -1
+    for kind, position, _ in tokens:
+        if kind == OPEN_PAREN and start == -1:
+            start = position
+        elif kind == CLOSE_PAREN and start != -1:
+            yield start, position, query[start+1:position].strip()
+            start = -1
+
+def bind_variables(nodes: Iterable[tuple[int, int, str]]) -> tuple[list[tuple[int, int, str]], dict[str, str]]:
+    """
+    Builds the binding table of the variables while the nodes are scanned. Labels of a variable are shared by every
+    clause of the query (MATCH, OPTIONAL MATCH, WITH, comma separated patterns), so a bare (a) takes the labels of
+    the last labeled (a:Person) anywhere in the query, before or after it.
 
+    Input: nodes from scan_nodes
+    Output: list of the nodes and bindings of variable -> labeled node text like {'a': 'a:Person'}
+    """
+    scanned = []
+    bindings = {}
+    for node in nodes:
+        scanned.append(node)
+        if ':' in node[2]:
+            bindings[node[2].split(':')[0]] = node[2]
+    return scanned, bindings
+
+def get_mappings(query: str, schema: str | CompiledSchema) -> str:
+    """
+    This function gets the mappings between the query and the schema like, converts all the nodes in the query to be like those in schema if possible.
+    Bare variables named like a source label of the schema get the relationships of that label, other bare variables
+    get the labels of their binding in the query, nodes like ( a ) get their labels with infer_labels_from_schema.
+    The query is scanned once and all label insertions are applied as one batch of edits.
 
-def process_relationship(cypher: str, schema: str) -> str | list[tuple[str, str, str]]:
+    Input: query, schema string or compiled schema
+    Output: query with nodes mapped to schema
+    """
+    # Nodes from schema are already extracted by the compiled schema
+    schema_dict = compile_schema(schema).label_relationships
+    nodes, bindings = bind_variables(scan_nodes(query))
+    # Bare variables that are rewritten wherever they appear as (variable), and every bare node that rewrites them in query order
+    rewrites = {node: f'({node}:{schema_dict[node]})' if node in schema_dict else f'({bindings[node]})'
+                for _, _, node in nodes if node != '*' and ':' not in node and (node in schema_dict or node in bindings)}
+    sequence = [node for _, _, node in nodes if node in rewrites]
+
+    edits = []
+    # Offset where the label scan of the rewritten query goes on and length difference of the rewritten query so far, see infer_labels_from_schema
+    resume, shift = 0, 0
+    for start, end, node in nodes:
+        text = rewritten = query[start:end+1]
+        exact = node in rewrites and text == f'({node})'
+        if exact and rewrites[node].find('(', 1) == -1:
+            rewritten = rewrites[node]
+        elif exact or text.find('(', 1) != -1:
+            # Nested parentheses like f((a)) or a binding that contains a parenthesis, the rewrites are replayed
+            # on the node in query order so a rewrite that creates another (variable) is rewritten again
+            for variable in sequence:
+                rewritten = rewritten.replace(f'({variable})', rewrites[variable])
+        # Nodes that are still bare like ( a ) get the labels of the schema
+        rewritten, resume = _infer_node_labels(rewritten, start + shift, resume, schema_dict)
+        if rewritten != text:
+            edits.append((start, end + 1, rewritten))
+            shift += len(rewritten) - len(text)
+
+    return apply_edits(query, edits)
+
+def _infer_node_labels(node: str, position: int, resume: int, schema_dict: dict) -> tuple[str, int]:
+    # Adds the relationships of the schema to a bare node named like a source label, the node starts at position in the
+    # rewritten query and the label scan only looks at it from resume on. Returns the node and the new resume offset.
+    start = 0 if resume <= position else node.find('(', resume - position)
+    if start == -1:
+        return node, resume
+    node_name = node[start+1:-1].strip()
+    if node_name == '*' or node_name == '' or ':' in node_name or node_name not in schema_dict:
+        return node, resume
+    return node[:start] + f'({node_name}:{schema_dict[node_name]})', position + len(node)
+
+def process_relationship(cypher: str, schema: str | CompiledSchema, tokens: list[tuple[str, int, int]] | None = None) -> str | list[tuple[str, str, str]]:
     """
     This function processes the relationships in the cypher query to be more similar to the schema, removes abnormalities
     If there is multiple relationships between two nodes, it will only keep the first one, 
     since two relationships between two same nodes should always have same 
 
-    Input: cypher query, schema
+    Input: cypher query, schema string or compiled schema, optional tokens of the query
     Output: cypher query with relationships processed
     """
-    # Split the schema by "), (" to get a list of raw triples
-    raw_triples = schema.strip("()").split("), (")
-
-    # For each raw triple, split by ", " to get the nodes and relationship
-    triples = [triple.split(", ") for triple in raw_triples if triple.strip()]
-
-    # Initialize a processed cypher string
-    processed_cypher = ""
-
-    # Initialize a flag to denote if we're currently processing a relationship
-    processing_relationship = False
-
-    # Iterate through the characters of the cypher string
-    for char in cypher:
-        if char == '[':
-            processing_relationship = True
-            relationship = ""
-        
-        if processing_relationship:
-            relationship += char
-
-        if char == ']':
-            processing_relationship = False
-
-            # Check if the found relationship matches a relationship in the schema, if yes, replace it
-            for triple in triples:
-                source_node, relation, target_node = [t.strip(' `') for t in triple]
-                if relation in relationship:
-                    relationship = f'[{relation}]'
-                    break
-
-            processed_cypher += relationship
-        elif not processing_relationship:
-            processed_cypher += char
-
-    return processed_cypher, triples
-
-def process_target_source(cypher: str, triples: list) -> str:
+    # Triples with spaces and backticks already stripped from the compiled schema
+    schema = compile_schema(schema)
+    triples = schema.clean_triples
+    if tokens is None:
+        tokens = tokenize(cypher)
+
+    # Pieces of the processed cypher string that are joined at the end
+    processed_cypher = []
+    # End of the part of the cypher string that was already copied to the pieces
+    copied = 0
+    # Start of the relationship we're currently processing, -1 if we're not inside one
+    relationship_start = -1
+
+    # Iterate through the bracket tokens of the cypher string
+    for kind, start, end in tokens:
+        if kind == OPEN_BRACKET:
+            # Copy everything up to the relationship, a second opening bracket starts the relationship over
+            if relationship_start == -1:
+                processed_cypher.append(cypher[copied:start])
+            relationship_start = start
+        elif kind == CLOSE_BRACKET and relationship_start != -1:
+            relationship = cypher[relationship_start:end]
+
+            # Check if the found relationship contains a relationship of the schema, if yes, replace it with the one
+            # of the first triple. The relationships are looked up in the trie of the schema instead of scanning the triples
+            relation = schema.find_relationship(relationship)
+            if relation is not None:
+                relationship = f'[{relation}]'
+
+            processed_cypher.append(relationship)
+            copied = end
+            relationship_start = -1
+
+    # An unclosed relationship is dropped
+    if relationship_start == -1:
+        processed_cypher.append(cypher[copied:])
+
+    return ''.join(processed_cypher), triples
+
+def process_target_source(cypher: str, triples: list | CompiledSchema, tokens: list[tuple[str, int, int]] | None = None) -> str:
     """
-    This function processes the target and source nodes in the cypher query to be more similar to the schema
+    This function processes the target and source nodes in the cypher query to be more similar to the schema,
+    the fragments are rewritten in a single pass with the memoized node rewrites of the compiled schema
 
 
-    Input: cypher query, schema
+    Input: cypher query, triples from process_relationship or compiled schema, optional tokens of the query
     Output: cypher query with target and source nodes processed
     """
+    schema = triples if isinstance(triples, CompiledSchema) else compile_schema(format_schema(triples))
+    if not schema.clean_triples:
+        return cypher
+    if tokens is None:
+        tokens = tokenize(cypher)
+
+    # Split the cypher into fragments that end with ( or ), the split is only done once
+    cypher_fragments = []
+    last_index = 0
+    for kind, start, end in tokens:
+        if kind == OPEN_PAREN or kind == CLOSE_PAREN:
+            cypher_fragments.append(cypher[last_index:end])
+            last_index = end
+
+    # An empty label matches every fragment, including the ( fragments the rewrites add, so the triples are applied one by one
+    if '' in schema.clean_labels:
+        for source_node, relation, target_node in schema.clean_triples:
+            processed_fragments = []
+            for fragment in cypher_fragments:
+                if fragment.lstrip('(`').startswith(source_node):
+                    processed_fragments += ('(', f'{source_node})')
+                elif fragment.lstrip('(`').startswith(target_node):
+                    processed_fragments += ('(', f'{target_node})')
+                else:
+                    processed_fragments.append(fragment)
+            cypher_fragments = processed_fragments
+        return ''.join(cypher_fragments)
+
+    # If fragment starts with a source or target node, replace it with as many ( as the triples that rewrite it and the final node)
+    processed_fragments = []
+    for fragment in cypher_fragments:
+        rewrite = schema.rewrite_node(fragment.lstrip('(`'))
+        if rewrite is None:
+            processed_fragments.append(fragment)
+        else:
+            processed_fragments.append('(' * rewrite[0] + f'{rewrite[1]})')
 
-    for triple in triples:
-        source_node, relation, target_node = [t.strip(' `') for t in triple]
-
-        # Lists to hold our cypher fragments
-        cypher_fragments = []
-        last_index = 0
-
-        # Find the next ( or ) starting at the given index
-        for index in range(len(cypher)):
-            if cypher[index] in ['(', ')']:
-                # Append the cypher fragment to our list
-                cypher_fragments.append(cypher[last_index:index+1])
-                last_index = index + 1
-
-        # Process the cypher fragments
-        for index, fragment in enumerate(cypher_fragments):
-            # If fragment starts with source_node or target_node, replace it
-            if fragment.lstrip('(`').startswith(source_node):
-                cypher_fragments[index] = f'({source_node})'
-            elif fragment.lstrip('(`').startswith(target_node):
-                cypher_fragments[index] = f'({target_node})'
-
-        # Join the processed fragments back into the cypher string
-        cypher = ''.join(cypher_fragments)
-
-    return cypher
+    # Join the processed fragments back into the cypher string
+    return ''.join(processed_fragments)
 
-def extract_directed_statement(text: str) -> list[str]:
+def extract_directed_statement(text: str, tokens: list[tuple[str, int, int]] | None = None) -> list[str]:
     """
     This function extracts the directed statements from the cypher query
 
-    Input: cypher query: 'MATCH (a)-[:RELATIONSHIP]->(b) RETURN a, b'
+    Input: cypher query: 'MATCH (a)-[:RELATIONSHIP]->(b) RETURN a, b', optional tokens of the query
     Output: list of directed statements found inside the cypher query: ['(a)-[:RELATIONSHIP]->(b)']
     """
+    if tokens is None:
+        tokens = tokenize(text)
+    return [text[start:end] for start, end in directed_statement_spans(text, tokens)]
+
+def directed_statement_spans(text: str, tokens: list[tuple[str, int, int]]) -> list[tuple[int, int]]:
+    """
+    This function finds the start and end offsets of the directed statements in the cypher query
+
+    Input: cypher query, tokens of the query
+    Output: list of (start, end) offsets of the directed statements
+    """
     # Initialize list to hold directed staments
     directed_statements = []
-    # Initialize statements start and end indices
-    start, end = -1, -1
+    # Initialize statements start index and the index of the last opening bracket
+    start, last_open = -1, -1
 
-    # Iterate over the text from left to right
-    for i in range(len(text)):
+    # Iterate over the bracket tokens from left to right
+    for kind, i, _ in tokens:
+        if kind == OPEN_PAREN:
+            last_open = i
         # Check if the character is a closing bracket
-        if text[i] == ")":
-            # If we're not already tracking a directed staments, find the begining of a source/target
+        elif kind == CLOSE_PAREN:
+            # If we're not already tracking a directed staments, the begining of a source/target is the last opening bracket
             if start == -1:
                 if i+1 < len(text) and text[i+1] in ["-", ">", "<"]:
-                    # Loop backwards to find the opening bracket
-                    for j in range(i, -1, -1):
-                        if text[j] == "(":
-                            start = j
-                            break
+                    start = last_open
             # If we're already tracking a staments, find the end of a source/target
             else:
                 # If the next character isn't a direction indicator, this is the end of the directed part of the stament
                 if i+1 == len(text) or text[i+1] not in ["-", ">", "<"]:
-                    end = i+1
                     # Append the stament to the list of staments
-                    directed_statements.append(text[start:end])
-                    # Reset 'start' and 'end' for the next stament
-                    start, end = -1, -1
+                    directed_statements.append((start, i+1))
+                    # Reset 'start' for the next stament
+                    start = -1
 
     return directed_statements
 
-def split_into_substatements(statments: list) -> list[str]:
+def split_into_patterns(statments: list, tokens: list | None = None) -> list[Pattern]:
     """
-    A function that splits the complex directed_statements into sub-statements while simple ones remain the same. This process may alter the total number of nodes,
-    but the number of vectors and paths remains unaltered. That's whyit can be used for accurate direction validation and standardization purposes,
+    A function that splits the directed_statements into patterns made of single hops, the hops are found with a single
+    forward pass over the tokens. This process may alter the total number of nodes, but the number of vectors and paths
+    remains unaltered. That's why it can be used for accurate direction validation and standardization purposes,
     regardless of the complexity of the input Cypher query.
-    
-    Input: list of a single directed_statment: ['(a)-[:RELATIONSHIP]->(b)<-[:RELATIONSHIP]-(c)']
-    Output: list of substatements like: ['(a)-[:RELATIONSHIP]->(b)', '(b)<-[:RELATIONSHIP]-(c)']
-    """
-    substatements = []
-
-    for statment in statments:
-        nodes_indices = []
-        start_index = 0
-
-        while True:
-            # Find the start of the next body part
-            start_index = statment.find('(', start_index)
-            if start_index == -1:
-                break
-
-            # Find the end of the body part
-            end_index = statment.find(')', start_index)
-            if end_index == -1:
-                break
-
-            # Append the indices of the body part to nodes_indices list
-            nodes_indices.append((start_index, end_index))
-            # Move the start_index beyond the current body part
-            start_index = end_index + 1
-
-            # If we have two body parts, join them into a substatment
-            if len(nodes_indices) == 2:
-                start, end = nodes_indices[0][0], nodes_indices[1][1]
-                substatment = statment[start:end + 1]
-                #remove any instance of ! inside the substatment string
-                substatment = substatment.replace('!', '')
-
-                substatements.append(substatment)
-                # Remove the first body part
-                nodes_indices.pop(0)
-    return substatements
-
-def find_used_trios(cypher_string: str, schema_list: list) -> list[tuple[str, str, str]]:
-    """
-    Function that finds the used schema in the cypher_string
-
-    Input: cypher_string, schema_list
-    Output: list of used schema like: [('Person', 'ACTED_IN', 'Movie'), ('Person', 'DIRECTED', 'Movie')]
-    """
-    # Extract distinct node types from schema_list
-    node_types = set([item for sublist in schema_list for item in sublist])
-    # Identify node types present in cypher_string
-    nodes_in_statement = [node for node in node_types if node in cypher_string]
-    # Filter schema list
-    filtered_trios = [trio for trio in schema_list if 
-                      (trio[0] in nodes_in_statement and trio[2] in nodes_in_statement
-                      and nodes_in_statement.index(trio[0]) != nodes_in_statement.index(trio[2])) or 
-                      (trio[0] in nodes_in_statement and trio[1] in nodes_in_statement) or 
-                      (trio[1] in nodes_in_statement and trio[2] in nodes_in_statement)
-    ]
-    return filtered_trios
-
-def extract_schema(schema_str: str):
+
+    Input: list of directed_statments: ['(a)-[:RELATIONSHIP]->(b)<-[:RELATIONSHIP]-(c)'], optional list with the tokens of every statement
+    Output: list of patterns, one for every directed_statment, holding hops like '(a)-[:RELATIONSHIP]->(b)' and '(b)<-[:RELATIONSHIP]-(c)'
+    """
+    return [build_pattern(statment, tokens[i] if tokens is not None else None) for i, statment in enumerate(statments)]
+
+def extract_schema(schema_str: str | CompiledSchema) -> list[tuple[str, str, str]]:
     """
     Extracts the schema as a list from the schema tuple string
 
-    Input: schema_str
+    Input: schema_str or compiled schema
     Output: list of schema like: [('Person', 'ACTED_IN', 'Movie'), ('Person', 'DIRECTED', 'Movie')]
     """
-    schema_str = schema_str.strip('()')
-    schemas = schema_str.split('), (')
-    schema_list = []
-    schema_list.clear()
-    for schema in schemas:
-        nodes = schema.split(', ')
-        schema_list.append((nodes[0], nodes[1], nodes[2]))
-    return schema_list
+    return list(compile_schema(schema_str).triples)
 
 def process_strings(input_list: list) -> list[str]:
     """
@@ -318,22 +316,25 @@ def process_strings(input_list: list) -> list[str]:
     """
     processed_list = []
     for string in input_list:
-        inside_brackets = False
-        processed_string = ''
-        for char in string:
-            if char == '[':
-                inside_brackets = True
-                bracket_content = ''
-            elif char == ']':
-                inside_brackets = False
+        # Pieces of the processed string, end of the copied part and start of the bracket we're inside
+        processed_string = []
+        copied = 0
+        bracket_start = -1
+        for kind, start, end in tokenize(string):
+            if kind == OPEN_BRACKET:
+                if bracket_start == -1:
+                    processed_string.append(string[copied:start])
+                bracket_start = start
+            elif kind == CLOSE_BRACKET and bracket_start != -1:
+                bracket_content = string[bracket_start+1:start]
                 if ':' in bracket_content:
                     bracket_content = bracket_content.split(':')[1]
-                processed_string += '[' + bracket_content + ']'
-            elif inside_brackets:
-                bracket_content += char
-            else:
-                processed_string += char
-        processed_list.append(processed_string)
+                processed_string.append('[' + bracket_content + ']')
+                copied = end
+                bracket_start = -1
+        if bracket_start == -1:
+            processed_string.append(string[copied:])
+        processed_list.append(''.join(processed_string))
     
     return processed_list
 
@@ -346,190 +347,220 @@ def remove_brackets(input_string: str) -> str:
     """
     #Used to standardzie strings without relationship node
     inside_brackets = False
-    processed_string = ''
-    for char in input_string:
-        if char == '[':
+    processed_string = []
+    copied = 0
+    for kind, start, end in tokenize(input_string):
+        if kind == OPEN_BRACKET:
+            if not inside_brackets:
+                processed_string.append(input_string[copied:start])
             inside_brackets = True
-        elif char == ']':
+        elif kind == CLOSE_BRACKET:
+            if not inside_brackets:
+                processed_string.append(input_string[copied:start])
+            copied = end
             inside_brackets = False
-        elif not inside_brackets:
-            processed_string += char
+    if not inside_brackets:
+        processed_string.append(input_string[copied:])
     
-    return processed_string
+    return ''.join(processed_string)
 
-def check_syntax(cypher_substring: str, schema: list) -> bool:
+def check_syntax(cypher_substring: str, schema: list | CompiledSchema) -> bool:
     """
     Function that evaluates if the cypher_substring is syntactically correct according to the schema, 
     this function also marks variable length relationships as syntactically incorrect,
     thats why we need to raise the variable relationship flag before calling this function.
+    The hop is looked up in the direction table of the compiled schema, a multi-label node fits if any of its labels fits.
     
-    Input: cypher_substring, schema
+    Input: cypher_substring, schema list or compiled schema
     Output: True if syntactically correct, False otherwise
     """
+    schema = compile_schema(schema if isinstance(schema, CompiledSchema) else format_schema(schema))
     # Extract elements from the cypher substring
-    cypher_elements = cypher_substring[1:-1].split("-") 
-    try:
-        # Determine direction of relationship
-        if '>' in cypher_elements[2]:
-            cypher_source = cypher_elements[0].split(":")[1] 
-            cypher_rel = cypher_elements[1][1:-1] 
-            cypher_target = cypher_elements[2].split(":")[1]
-        elif '<' in cypher_elements[0]:
-            cypher_source = cypher_elements[2].split(":")[1]
-            cypher_rel = cypher_elements[1][1:-1] 
-            cypher_target = cypher_elements[0].split(":")[1] 
-        else:
-            #Error handling if we're still unable to identify the relationship node while it isn't empty, we can still check the direction if source and target nodes are present
-            #nodes are unidentified because we do not know what nodes are used since identify_nodes function needs relationship info which we do not have here
-            unidentified_node1 = cypher_elements[0].split(":")[1]
-            cypher_rel = cypher_elements[1][1:-1]
-            unidentified_node2 = cypher_elements[2].split(":")[1]
-            for schema_element in schema:
-                schema_source, schema_rel, schema_target = schema_element
-                if (schema_source in unidentified_node1 and 
-                    schema_rel in cypher_rel and 
-                    schema_target in unidentified_node2) or (schema_source in unidentified_node2 and 
-                    schema_rel in cypher_rel and 
-                    schema_target in unidentified_node1):
-                    return True 
-            try:
-                if cypher_rel == '':
-                    return True
-            except UnboundLocalError:
-                return True
-            return False
-    except IndexError:
+    hop = read_hop(cypher_substring)
+    # We're unable to check hops without labels on both nodes or without a relationship type
+    if hop is None:
         return True
-    try:
-        if cypher_rel == '':
-            return True
-    except UnboundLocalError:
+    left_labels, relationship, right_labels, first_arrow, last_arrow = hop
+    if not left_labels or not right_labels or relationship == '':
         return True
-    for schema_element in schema:
-        schema_source, schema_rel, schema_target = schema_element
-        if (schema_source in cypher_source and 
-            schema_rel in cypher_rel and 
-            schema_target in cypher_target):
-            return True 
-
-    return False
-
-def validate_direction(substatements: list, relationship_dict: dict, schema: str, identified_nodes: dict) -> list[str] | list[tuple[str, str, str]]:
+    decision = schema.direction(left_labels, relationship, right_labels)
+    # Determine direction of relationship
+    if cypher_substring[last_arrow[0]:last_arrow[1]] == '->':
+        return bool(decision & FORWARD)
+    elif cypher_substring[first_arrow[0]:first_arrow[1]] == '<-':
+        return bool(decision & BACKWARD)
+    # Undirected relationships are correct in either direction
+    return decision != INVALID
+
+def orient_hop(substatment: str, schema: CompiledSchema) -> str:
     """
-    Function that validates the direction of the relationships in the substatements
+    Function that points the arrow of a single hop the way the direction table of the schema decides,
+    only the two arrow fragments of the hop are rewritten
 
-    Input: substatements, relationship_dict, schema, identified_nodes
-    Output: list of substatements with corrected direction
+    Input: substatment like '(m:Movie)-[ACTED_IN]->(a:Person)', compiled schema
+    Output: substatment with corrected direction like '(m:Movie)<-[ACTED_IN]-(a:Person)'
     """
+    hop = read_hop(substatment)
+    if hop is None:
+        return substatment
+    left_labels, relationship, right_labels, first_arrow, last_arrow = hop
+    forward = substatment[last_arrow[0]:last_arrow[1]] == '->'
+    backward = substatment[first_arrow[0]:first_arrow[1]] == '<-'
+    # Undirected hops are never given a direction
+    if forward == backward:
+        return substatment
+    # Labels that are not in the schema are read as an unlabeled node, a node written as a bare label like (Person) is labeled
+    left_labels = _schema_labels(substatment, 0, first_arrow[0], left_labels, schema)
+    right_labels = _schema_labels(substatment, last_arrow[1], len(substatment), right_labels, schema)
+    decision = schema.direction(left_labels, relationship, right_labels)
+    if decision == FORWARD and backward:
+        arrows = ('-', '->')
+    elif decision == BACKWARD and forward:
+        arrows = ('<-', '-')
+    else:
+        return substatment
+    return (substatment[:first_arrow[0]] + arrows[0] + substatment[first_arrow[1]:last_arrow[0]] + arrows[1] +
+            substatment[last_arrow[1]:])
+
+def _schema_labels(substatment: str, start: int, end: int, labels: list[str], schema: CompiledSchema) -> list[str]:
+    # Returns the labels of the node that the schema knows about
+    if not labels:
+        variable = substatment[start+1:end-1].strip(' `(')
+        return [variable] if variable in schema.clean_labels else []
+    return [label for label in labels if label in schema.clean_labels]
+
+def validate_hops(hops: list[Hop], schema: str | CompiledSchema) -> tuple[list[str], list[bool], CompiledSchema]:
+    """
+    Function that validates the direction of the hops with orient_hop and checks the syntax of the corrected
+    hops with check_syntax. The outcome of a hop is kept in the hop cache by the labels of its nodes, the text between
+    them and the schema fingerprint, so a hop that occurred in any earlier query is not validated again.
 
+    Input: hops from identify_nodes, schema string or compiled schema
+    Output: list of substatements with corrected direction, whether every substatement fits the schema, compiled schema
+    """
     final_statments = []
-    # Extract the schemas as a list for easier processing
-    schemalist = extract_schema(schema)
-    # Standardize the strings
-    substatements = process_strings(substatements)
-    # Iterate over each substatment
-    for i, substatment in enumerate(substatements):
-        # Find the used schema in the substatment
-        used_schema = find_used_trios(substatment, schemalist)
-
-        # if relationship info status is True and the nodes are identified 
-        if relationship_dict[i][2] and bool(identified_nodes[i]):
-            for schema in used_schema:
-                # Find the position of "->" or "<-" symbol
-                arrow_forward_position = substatment.find("-[{}]->".format(schema[1]))
-                arrow_backward_position = substatment.find("<-[{}]-".format(schema[1]))
-                # Find the position of the source and target nodes
-                source_position = substatment.find(schema[0])
-                relation_position = substatment.find(schema[1])
-                target_position = substatment.find(schema[2])
-                # Logic if the source is not present 
-                if source_position == -1:
-                    if target_position > relation_position and arrow_backward_position != -1 and arrow_forward_position ==-1:
-                        substatment = substatment.replace(f"<-[{schema[1]}]-", f"-[{schema[1]}]->")
-                    elif target_position < relation_position and arrow_backward_position == -1 and arrow_forward_position !=-1:
-                        substatment = substatment.replace(f"-[{schema[1]}]->", f"<-[{schema[1]}]-")
-                # Logic if the target is not present
-                elif target_position == -1:
-                    if source_position > relation_position and arrow_backward_position == -1 and arrow_forward_position !=-1:
-                        substatment = substatment.replace(f"-[{schema[1]}]->", f"<-[{schema[1]}]-")
-                    elif source_position < relation_position and arrow_backward_position != -1 and arrow_forward_position ==-1:
-                        substatment = substatment.replace(f"<-[{schema[1]}]-", f"-[{schema[1]}]->")
-                # If neither source nor target is present, we return the original substatment
-                # If a node is defined but uses a weird marking it should've been correct in get_mappings function
-                elif source_position == -1 and target_position == -1:
-                    continue
-                # Logic if both source and target are present
-                elif source_position != -1 and target_position != -1:
-                    if source_position > target_position and arrow_backward_position == -1 and arrow_forward_position !=-1:
-                        substatment = substatment.replace(f"-[{schema[1]}]->", f"<-[{schema[1]}]-")
-                    elif source_position < target_position and arrow_backward_position != -1 and arrow_forward_position ==-1:
-                        substatment = substatment.replace(f"<-[{schema[1]}]-", f"-[{schema[1]}]->")
-
-            final_statments.append(substatment)
+    valid = []
+    # The compiled schema holds the direction table
+    schemalist = compile_schema(schema)
+    for hop in hops:
+        parts = _hop_parts(hop)
+        if parts is None:
+            substatment, fits = _validate_hop(hop, schemalist)
         else:
-            # The relationship node is not present
-            # Remove the brackets from the substatment, if present, when the relationship node is not identified
-            substatment = remove_brackets(substatment)
-            for schema in used_schema:
-                # Find the position of "->" or "<-" symbol
-                arrow_forward_position = substatment.find("-->".format(schema[1]))
-                arrow_backward_position = substatment.find("<--".format(schema[1]))
-                source_position = substatment.find(schema[0])
-                target_position = substatment.find(schema[2])
-
-                # Same logic as above, but without the relationship node
-                if target_position > source_position and arrow_backward_position != -1 and arrow_forward_position ==-1:
-                    substatment = substatment.replace("<--", "-->")
-                elif target_position < source_position and arrow_backward_position == -1 and arrow_forward_position !=-1:
-                     substatment = substatment.replace("-->", "<--")
-                elif (source_position == -1 and target_position == -1)  or (arrow_backward_position ==-1 and arrow_forward_position !=-1):
-                    continue
-            final_statments.append(substatment)
-
-    return final_statments, schemalist
-
-def prepare_string(row: list) -> tuple[list[str], bool]:
-    """
-    Main function that prepares and processes the string for the extraction of the vectors
-
-    Input: row from the dataframe
+            left, middle, right = parts
+            # Unlabeled nodes are keyed by their text, orient_hop reads a node named like a label as labeled
+            key = (hop.left.labels or left, middle, hop.right.labels or right,
+                   hop.relationship.type is None or not (hop.source or hop.target), schemalist.fingerprint)
+            outcome = hop_cache.get(key)
+            if outcome is None:
+                substatment, fits = _validate_hop(hop, schemalist)
+                # The stages only rewrite the text between the nodes, the new text is kept for the other hops of the key
+                if substatment.startswith(left) and substatment.endswith(right) and len(substatment) >= len(left) + len(right):
+                    hop_cache.put(key, (substatment[len(left):len(substatment)-len(right)], fits))
+            else:
+                substatment, fits = left + outcome[0] + right, outcome[1]
+        final_statments.append(substatment)
+        valid.append(fits)
+
+    return final_statments, valid, schemalist
+
+def _validate_hop(hop: Hop, schema: CompiledSchema) -> tuple[str, bool]:
+    # Standardize the string
+    substatment = process_strings([hop.text])[0]
+    # if no relationship info was found or the nodes are not identified, the relationship node is not used
+    if hop.relationship.type is None or not (hop.source or hop.target):
+        # Remove the brackets from the substatment, if present, the direction is decided by the labels only
+        substatment = remove_brackets(substatment)
+    substatment = orient_hop(substatment, schema)
+    return substatment, check_syntax(substatment, schema)
+
+def _hop_parts(hop: Hop) -> tuple[str, str, str] | None:
+    # Splits the hop into its nodes and the text between them. read_hop ends the right node at the last parenthesis
+    # and the stages rewrite every bracket, so hops whose right node holds a parenthesis or whose nodes hold brackets
+    # are split differently by the stages than by the hop records and are never cached
+    text = hop.text
+    # A removed ! shifts the offsets of the hop records
+    if len(text) != hop.right.end - hop.left.start:
+        return None
+    left = text[:hop.left.end - hop.left.start]
+    right = text[hop.right.start - hop.left.start:]
+    if right.find('(', 1) != -1 or '[' in left or ']' in left or '[' in right or ']' in right:
+        return None
+    return left, text[len(left):len(text) - len(right)], right
+
+def prepare_string(row: list, budget: QueryBudget | None = None) -> tuple[list[str], bool]:
+    """
+    Main function that prepares and processes the string for the extraction of the vectors,
+    every stage is measured when the instrumentation is enabled.
+    With a budget the query is abandoned with BudgetExceeded between the stages once it goes over a limit.
+
+    Input: row from the dataframe, optional budget of the query
     Output: list of processed strings
     """
+    timer = metrics.start_query()
+
+    # Parse the schema only once, every stage below shares the compiled version
+    schema = compile_schema(row[1])
+    if timer: timer.lap('compile_schema')
+
     # Get the mappings between the unknown nodes in query and the schema, for example this converts nodes like (a) to (a:Person)
-    statement = get_mappings(convert_to_single_line(row[0]), row[1])
+    statement = get_mappings(convert_to_single_line(row[0]), schema)
+    if timer: timer.lap('get_mappings')
+    if budget: budget.check_time()
+
+    # Walk the statement once, the following stages work on the offsets of its tokens
+    tokens = tokenize(statement)
+    if budget: budget.check_tokens(tokens)
 
     # Extract the relevant part containing vectors
-    directed_statment = extract_directed_statement(statement)
+    directed_spans = directed_statement_spans(statement, tokens)
+    if timer: timer.lap('extract_directed_statement')
+    if budget: budget.check_time()
 
     # Check to see if the statement contains variable length relationships if it does, return the original statement
-    variable_length_flag = check_brackets(statement)
+    variable_length_flag = check_brackets(statement, tokens)
     if variable_length_flag:
+        if timer:
+            timer.lap('check_brackets')
+            timer.finish(row[0], variable_length=True)
         return statement, variable_length_flag
+    if timer: timer.lap('check_brackets')
     
     # Preprocess nodes to not contain unrelevant data
-    for i in range(len(directed_statment)):
-        directed_statment[i],triples = process_relationship(directed_statment[i], row[1])
-        directed_statment[i] = process_target_source(directed_statment[i], triples)
-
-    # Split the directed_statment into substatements
-    substatements= split_into_substatements(directed_statment)
-
-    # Get the node info from the substatements, 
-    # relationship info is a dict but in the final  version only the bool value is used
-
-    relationship_info = extract_relationship(substatements)
-    nodes = identify_nodes(substatements, relationship_info, row[1])
-
-    # Validate the direction of the relationships in the substatements
-    directed_statment , schema = validate_direction(substatements, relationship_info, row[1], nodes)
-
-    # Check the syntax of the substatements before returning them
+    directed_statment = [None] * len(directed_spans)
+    for i, (start, end) in enumerate(directed_spans):
+        directed_statment[i], _ = process_relationship(statement[start:end], schema, slice_tokens(tokens, start, end))
+        if timer: timer.lap('process_relationship')
+        directed_statment[i] = process_target_source(directed_statment[i], schema)
+        if timer: timer.lap('process_target_source')
+        if budget: budget.check_time()
+
+    # Split the directed_statment into patterns of single hops, every following stage passes the hops along
+    hops = [hop for pattern in split_into_patterns(directed_statment) for hop in pattern.hops]
+    if timer: timer.lap('split_into_substatements')
+    if budget: budget.check_time()
+
+    # Get the relationship type and the source and target nodes of every hop,
+    # in the final version only whether they were found is used
+    identify_nodes(extract_relationship(hops), schema)
+    if timer: timer.lap('identify_nodes')
+    if budget: budget.check_time()
+
+    # Validate the direction of the relationships in the hops and check the syntax of the corrected hops,
+    # hops that occurred in earlier queries are taken from the hop cache
+    directed_statment, valid, schema = validate_hops(hops, schema)
+
+    # Substatements that do not fit the schema are marked before returning them
     output = [None] * len(directed_statment)
     for i in range(len(directed_statment)):
-        used_schema = find_used_trios(substatements[i], schema)
-        if check_syntax(directed_statment[i], used_schema):
+        if valid[i]:
             output[i] = directed_statment[i]
         else:
-            output[i] = 'Syntax error'            
+            output[i] = 'Syntax error'
+    if budget: budget.check_time()
 
+    if timer:
+        timer.lap('validate_hops')
+        # Relationship brackets are resolved with the relationship trie and hops with the direction table of the schema
+        timer.finish(row[0], substatements=len(hops), syntax_error='Syntax error' in output)
     return output, variable_length_flag
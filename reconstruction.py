@@ -1,3 +1,5 @@
+from lexer import ARROW, iter_tokens
+
 def symbol_extractor(stringlist: list) -> list[str,]:
     """
     This function extracts the symbols resembling vectors from the input stringlist and returns them as a list
@@ -5,60 +7,91 @@ def symbol_extractor(stringlist: list) -> list[str,]:
     Input: stringlist
     Output: list of symbols like ['->', '<-', '-']
     """
-    symbols = []
-    if stringlist == ['Syntax error']:
+    # A single hop that does not fit the schema makes the whole statement a syntax error
+    if 'Syntax error' in stringlist:
         return ['Syntax error']
-    for string in stringlist:
-        i = 0
-        while i < len(string):
-            if string[i:i+2] in ('->', '<-'):
-                symbols.append(string[i:i+2])
-                i += 2
-            elif string[i] == '-':
-                symbols.append(string[i])
-                i += 1
-            else:
-                i += 1
-    return symbols
+    return [string[start:end] for string in stringlist for kind, start, end in iter_tokens(string) if kind == ARROW]
 
 def symbol_inserter(target_string: str, input_sequence: list) -> str:
     """
     This function inserts the symbols from input_sequence into the target_string
     
     Input: target_string, input_sequence
-    Output: output string with inserted sequence
+    Output: output string with inserted sequence or 'Syntax error' if input_sequence has too few symbols
+    """
+    edits = arrow_edits(target_string, input_sequence)
+    if edits is None:
+        return 'Syntax error'
+    return apply_edits(target_string, edits)
+
+def arrow_edits(target_string: str, input_sequence: list) -> list[tuple[int, int, str]] | None:
+    """
+    This function pairs every arrow fragment of the target_string with the symbol from input_sequence
+    and returns an edit only for the arrows that differ from their symbol
+
+    Input: target_string like 'MATCH (a)<-[:R]-(b)', input_sequence like ['-', '->']
+    Output: list of edits (start, end, replacement) like [(9, 11, '-'), (15, 16, '->')],
+            None if input_sequence has fewer symbols than target_string has arrows
+    """
+    edits = []
+    symbols = iter(input_sequence)
+    for kind, start, end in iter_tokens(target_string):
+        if kind == ARROW:
+            symbol = next(symbols, None)
+            if symbol is None:
+                # The arrows can not be paired with the substatements, the statement is not reconstructed
+                return None
+            # Compare in place so arrows that are already correct do not allocate anything
+            if len(symbol) != end - start or not target_string.startswith(symbol, start):
+                edits.append((start, end, symbol))
+    return edits
+
+def apply_edits(target_string: str, edits: list[tuple[int, int, str]]) -> str:
     """
-    output = ''
-    input_index = 0
-    skip_next = False
-    for i in range(len(target_string)):
-        if skip_next:
-            skip_next = False
-            continue
-        if i < len(target_string) - 1 and target_string[i:i+2] in ['->', '<-']:
-            output += input_sequence[input_index]
-            input_index += 1
-            skip_next = True
-        elif target_string[i] == '-':
-            output += input_sequence[input_index]
-            input_index += 1
-        else:
-            output += target_string[i]
-    return output
+    This function applies the edits to the target_string, the output is assembled with a single join
+    and the target_string itself is returned when there are no edits
 
+    Input: target_string, list of edits (start, end, replacement) sorted by start
+    Output: output string with the edits applied
+    """
+    if not edits:
+        return target_string
+    output = []
+    copied = 0
+    for start, end, replacement in edits:
+        output.append(target_string[copied:start])
+        output.append(replacement)
+        copied = end
+    output.append(target_string[copied:])
+    return ''.join(output)
+
+
+
+def solver_edits(stringlist: list, target_string: str) -> list[tuple[int, int, str]] | None:
+    """
+    This function returns the arrow edits that turn the target string into the output string
+    
+    Input: stringlist, target_string
+    Output: list of edits (start, end, replacement) or None if any substatement of the stringlist is a syntax error
+            or the substatements have fewer arrows than the target string
+    """ 
+    # The sentinel has to be checked before the symbols are extracted, it has no arrows of its own
+    if 'Syntax error' in stringlist:
+        return None
 
+    return arrow_edits(target_string, symbol_extractor(stringlist))
 
 def solver(stringlist: list, target_string: str) -> str:
     """
-    This is the main function from this helper module that takes the input stringlist and the target string and returns the output string
+    This is the main function from this helper module that takes the input stringlist and the target string and returns the output string,
+    only the arrows whose direction changed are patched in the target string
     
     Input: stringlist, target_string
     Output: output string
     """ 
-    input_sequence = symbol_extractor(stringlist)
+    edits = solver_edits(stringlist, target_string)
     
-    if 'Syntax error' in input_sequence:
+    if edits is None:
         return 'Syntax error'
     
-    output = symbol_inserter(target_string, input_sequence)
-    return output
+    return apply_edits(target_string, edits)
@@ -0,0 +1,405 @@
+import marshal
+import mmap
+import sys
+import threading
+from bisect import bisect_right
+from collections.abc import Iterable
+from functools import lru_cache
+from hashlib import blake2b
+from matcher import LabelMatcher
+
+# Maximum number of distinct schema strings kept compiled at the same time
+SCHEMA_CACHE_SIZE = 256
+# Direction decisions of the direction table, EITHER is FORWARD | BACKWARD and INVALID means no triple fits the hop
+INVALID = 0
+FORWARD = 1
+BACKWARD = 2
+EITHER = 3
+# First bytes of a schema snapshot file and the version of its layout
+SNAPSHOT_MAGIC = b'CYSCHEMA'
+SNAPSHOT_FORMAT = 3
+# Characters the pipeline reads as part of a pattern, literals containing them are never lifted into a query template
+PATTERN_CHARACTERS = ('-', ':', '!', '<', '>', '(', ')', '[', ']', '|', '*')
+# Slots of CompiledSchema that hold a LabelMatcher, snapshots keep their tries as nested dictionaries
+MATCHER_SLOTS = ('label_prefixes', 'relationship_matcher', 'matcher')
+
+class CompiledSchema:
+    """
+    Parsed form of a schema string like '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+    that is built once and then shared by every stage of the pipeline instead of splitting the string again.
+    All labels and relationships are interned and the schema is never changed after it was built, only the
+    node_rewrites memo grows, so one object can be shared by every row that uses the schema
+
+    Attributes:
+        - source: the original schema string
+        - fingerprint: short hash of the schema string used as a cache key
+        - triples: tuple of (source, relationship, target) tuples exactly as they appear in the schema
+        - clean_triples: same triples with spaces and backticks stripped from every element
+        - clean_labels: frozenset of the stripped source and target labels of clean_triples
+        - label_positions: dictionary of clean label -> sorted positions of the clean triples that start or end with it
+        - label_prefixes: trie of the clean labels that finds the labels a node starts with
+        - relationship_positions: dictionary of clean relationship -> position of the first clean triple that holds it
+        - relationship_matcher: trie of the clean relationships that finds the relationships a bracket contains
+        - node_rewrites: memo of the node rewrites of process_target_source, see rewrite_node
+        - label_relationships: dictionary of source label -> list of relationships, used for label inference
+        - node_types: frozenset of every distinct element (labels and relationships) used in the schema
+        - by_relationship: hash index of the triples keyed by their relationship
+        - matcher: trie of all node types that finds their whole-word occurrences in a single pass
+        - directions: direction table of (left label, relationship, right label) -> FORWARD, BACKWARD or EITHER,
+          a label of None stands for an unlabeled node and a relationship of '' for an untyped one, missing keys are INVALID
+    """
+    __slots__ = ('source', 'fingerprint', 'triples', 'clean_triples', 'clean_labels', 'label_positions', 'label_prefixes',
+                 'relationship_positions', 'relationship_matcher', 'node_rewrites', 'label_relationships', 'node_types',
+                 'by_relationship', 'matcher',
+                 'directions')
+
+    def __init__(self, schema: str):
+        self.source = sys.intern(schema)
+        self.fingerprint = schema_fingerprint(schema)
+
+        # Split the schema by "), (" to get the raw triples and then split every triple by ", ".
+        # Labels and relationships are interned, so all schemas that use a label share a single string
+        raw_triples = [item.split(", ") for item in schema.strip("()").split("), (")]
+        self.triples = tuple((sys.intern(nodes[0]), sys.intern(nodes[1]), sys.intern(nodes[2])) for nodes in raw_triples if len(nodes) >= 3)
+        self.clean_triples = tuple(tuple(sys.intern(t.strip(' `')) for t in triple) for triple in self.triples)
+        self.clean_labels = frozenset(label for source, _, target in self.clean_triples for label in (source, target))
+        self.label_positions = {}
+        for position, (source, _, target) in enumerate(self.clean_triples):
+            for label in {source, target}:
+                self.label_positions.setdefault(label, []).append(position)
+        self.label_prefixes = LabelMatcher(self.clean_labels)
+        self.relationship_positions = {}
+        for position, (_, relationship, _) in enumerate(self.clean_triples):
+            self.relationship_positions.setdefault(relationship, position)
+        self.relationship_matcher = LabelMatcher(self.relationship_positions)
+        self.node_rewrites = {}
+
+        # Label inference looks at the schema with all brackets removed, every three elements are one triple
+        schema_nodes = [sys.intern(part.strip()) for part in schema.replace('(', '').replace(')', '').split(',')]
+        self.label_relationships = {}
+        for i in range(0, len(schema_nodes) - 1, 3):
+            self.label_relationships.setdefault(schema_nodes[i], []).append(schema_nodes[i+1])
+
+        # Build the hash indexes
+        self.node_types = set()
+        self.by_relationship = {}
+        for triple in self.triples:
+            self.node_types.update(triple)
+            self.by_relationship.setdefault(triple[1], []).append(triple)
+        self.node_types = frozenset(self.node_types)
+        self.matcher = LabelMatcher(self.node_types)
+
+        # Every triple decides the direction of the hops that can be read as it, in both orders of its labels.
+        # A typed hop is decided by a single label, an untyped hop needs the labels of both nodes.
+        self.directions = {}
+        for source, relationship, target in self.clean_triples:
+            for key in ((source, relationship, target), (source, relationship, None), (None, relationship, target), (source, '', target)):
+                self.directions[key] = self.directions.get(key, INVALID) | FORWARD
+            for key in ((target, relationship, source), (target, relationship, None), (None, relationship, source), (target, '', source)):
+                self.directions[key] = self.directions.get(key, INVALID) | BACKWARD
+
+    def direction(self, left_labels: list[str], relationship: str, right_labels: list[str]) -> int:
+        """
+        Looks up the direction of a hop in the direction table, multi-label nodes combine the decisions of all their labels
+
+        Input: labels of the left node, relationship type or '' if untyped, labels of the right node, empty lists for unlabeled nodes
+        Output: FORWARD, BACKWARD, EITHER or INVALID
+        """
+        decision = INVALID
+        for left in left_labels or (None,):
+            for right in right_labels or (None,):
+                decision |= self.directions.get((left, relationship, right), INVALID)
+        return decision
+
+    def find_relationship(self, text: str) -> str | None:
+        """
+        Returns the relationship that process_relationship puts in place of a relationship bracket: the relationship
+        of the first triple that occurs anywhere in the bracket. The relationships in the bracket are found with the trie
+        and the first of them in schema order with relationship_positions, so the triples are never scanned.
+
+        Input: relationship bracket like '[r:KNOWS {since: 2020}]'
+        Output: relationship like 'KNOWS' or None if no relationship of the schema occurs in the bracket
+        """
+        found = self.relationship_matcher.substrings(text)
+        # An empty relationship occurs in every bracket
+        if '' in self.relationship_positions:
+            found.add('')
+        if not found:
+            return None
+        return min(found, key=self.relationship_positions.__getitem__)
+
+    def rewrite_node(self, text: str) -> tuple[int, str] | None:
+        """
+        Returns how process_target_source rewrites a node fragment. Going through the triples in order, a fragment that
+        starts with the source or target label of a triple is replaced by ( and that label, and the new label fragment
+        is replaced again by every later triple with a label it starts with. The chain only depends on the first label
+        and its triple, so it is computed once per schema and label.
+
+        Input: node fragment with leading ( and backticks stripped like 'PersonA:Actor)'
+        Output: (number of opening parentheses, final label) like (1, 'Person') or None if the fragment stays
+        """
+        prefixes = self.label_prefixes.prefixes(text)
+        if not prefixes:
+            return None
+        position = min(self.label_positions[label][0] for label in prefixes)
+        source, _, target = self.clean_triples[position]
+        label = source if source in prefixes else target
+        key = (label, position)
+        if key not in self.node_rewrites:
+            self.node_rewrites[key] = self._rewrite_chain(label, position)
+        return self.node_rewrites[key]
+
+    def _rewrite_chain(self, label: str, position: int) -> tuple[int, str]:
+        # Follows the label through the later triples that rewrite it again
+        count = 1
+        while True:
+            prefixes = self.label_prefixes.prefixes(label)
+            following = [positions[index] for positions in (self.label_positions[prefix] for prefix in prefixes)
+                         if (index := bisect_right(positions, position)) < len(positions)]
+            if not following:
+                return count, label
+            position = min(following)
+            source, _, target = self.clean_triples[position]
+            label = source if source in prefixes else target
+            count += 1
+
+    def __repr__(self) -> str:
+        return f'CompiledSchema({self.source!r})'
+
+    def to_state(self) -> tuple:
+        """
+        Returns every attribute as plain builtin values that marshal can serialize, the tries of the matchers are kept
+        as their nested dictionaries so nothing has to be rebuilt when the state is loaded
+
+        Input: None
+        Output: tuple with one value for every slot
+        """
+        return tuple((getattr(self, name).root, getattr(self, name).words) if name in MATCHER_SLOTS else getattr(self, name)
+                     for name in self.__slots__)
+
+    @classmethod
+    def from_state(cls, state: tuple) -> 'CompiledSchema':
+        """
+        Builds a compiled schema from the values of to_state without parsing the schema string again
+
+        Input: tuple from to_state
+        Output: CompiledSchema
+        """
+        schema = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, state):
+            if name in MATCHER_SLOTS:
+                value = LabelMatcher.from_trie(*value)
+            setattr(schema, name, value)
+        return schema
+
+def schema_fingerprint(schema: str) -> str:
+    """
+    Returns a short stable hash of the schema string, it stays the same between runs and processes
+
+    Input: schema string
+    Output: hex digest like '3f2a9c0d1b7e4a55'
+    """
+    return blake2b(schema.encode(), digest_size=8).hexdigest()
+
+def format_schema(triples: list[tuple[str, str, str]]) -> str:
+    """
+    Formats a list of triples as a schema string, the opposite of extract_schema
+
+    Input: list of triples like [('Person', 'KNOWS', 'Person')]
+    Output: schema string like '(Person, KNOWS, Person)'
+    """
+    return ', '.join(f'({source}, {relationship}, {target})' for source, relationship, target in triples)
+
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _compile(schema: str) -> CompiledSchema:
+    # Schemas of a loaded snapshot are read from it instead of being parsed
+    entry = _snapshot_index.get(schema)
+    if entry is not None:
+        data, start, end = entry
+        return CompiledSchema.from_state(marshal.loads(data[start:end]))
+    return CompiledSchema(schema)
+
+def compile_schema(schema: str | CompiledSchema) -> CompiledSchema:
+    """
+    Returns the compiled version of the schema, every distinct schema string is only parsed once
+    and kept in a bounded LRU cache so rows that share a schema also share the parsed object.
+    Schemas of a loaded snapshot are never parsed.
+
+    Input: schema string or already compiled schema
+    Output: CompiledSchema
+    """
+    if isinstance(schema, CompiledSchema):
+        return schema
+    # Pooled schemas are kept for the whole process and never go through the LRU cache
+    pooled = schema_pool.find(schema)
+    if pooled is not None:
+        return pooled
+    return _compile(schema)
+
+class SchemaPool:
+    """
+    Process-wide interning pool of schemas. Every distinct schema string gets a small id and a single compiled schema,
+    rows keep the id or the canonical string of the pool instead of their own copy of the schema, so the copies
+    read from the input are dropped right away. The canonical string caches its hash and compares by identity,
+    so looking up a pooled schema costs the same for a schema of a few bytes and one of a few megabytes.
+    The pool only grows, it is meant for inputs with a few hundred distinct schemas and millions of rows.
+    Schemas are added under a lock, so the pool can be shared by threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # schema string -> id, the id is the position of the compiled schema in _schemas
+        self._ids = {}
+        self._schemas = []
+        self.lookups = 0
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def add(self, schema: str) -> int:
+        """
+        Returns the id of the schema, the schema is compiled the first time it is added
+
+        Input: schema string
+        Output: schema id like 0
+        """
+        with self._lock:
+            self.lookups += 1
+            schema_id = self._ids.get(schema)
+            if schema_id is None:
+                compiled = _compile(schema)
+                schema_id = len(self._schemas)
+                self._schemas.append(compiled)
+                self._ids[compiled.source] = schema_id
+                return schema_id
+            self.hits += 1
+            if schema is not self._schemas[schema_id].source:
+                # A copy of the canonical string that the caller can drop
+                self.bytes_saved += sys.getsizeof(schema)
+            return schema_id
+
+    def intern(self, schema: str) -> str:
+        """
+        Returns the canonical string of the schema, see add
+
+        Input: schema string
+        Output: the string of the pool that is equal to the schema
+        """
+        return self._schemas[self.add(schema)].source
+
+    def source(self, schema_id: int) -> str:
+        """
+        Returns the canonical string of a schema id
+
+        Input: schema id
+        Output: schema string
+        """
+        return self._schemas[schema_id].source
+
+    def get(self, schema_id: int) -> CompiledSchema:
+        """
+        Returns the compiled schema of a schema id
+
+        Input: schema id
+        Output: CompiledSchema
+        """
+        return self._schemas[schema_id]
+
+    def find(self, schema: str) -> CompiledSchema | None:
+        """
+        Returns the compiled schema of a pooled schema string without counting a lookup
+
+        Input: schema string
+        Output: CompiledSchema or None if the schema is not in the pool
+        """
+        schema_id = self._ids.get(schema)
+        return None if schema_id is None else self._schemas[schema_id]
+
+    def clear(self) -> None:
+        """
+        Removes every schema from the pool, the ids handed out before are not valid anymore. The counters are kept
+        """
+        with self._lock:
+            self._ids.clear()
+            self._schemas.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the pool
+
+        Input: None
+        Output: dictionary with distinct_schemas, lookups, hits, hit_rate and bytes_saved
+        """
+        return {'distinct_schemas': len(self._schemas), 'lookups': self.lookups, 'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0, 'bytes_saved': self.bytes_saved}
+
+    def __len__(self) -> int:
+        return len(self._schemas)
+
+# Schema pool of the current process, every worker process has its own
+schema_pool = SchemaPool()
+
+# Schemas of the loaded snapshots, schema string -> (mapped snapshot, start, end of the marshaled state)
+_snapshot_index = {}
+
+def save_snapshot(schemas: Iterable[str], path: str) -> int:
+    """
+    Compiles the schemas and writes all of their indexes (label sets, relationship index, direction table, tries)
+    to a compact binary snapshot. Every schema is marshaled on its own after a header with the index of the schema
+    strings, so a snapshot can be mapped and only the schemas that are used are ever read.
+
+    Input: schema strings, snapshot path
+    Output: number of distinct schemas in the snapshot
+    """
+    index = []
+    states = []
+    offset = 0
+    for schema in dict.fromkeys(schemas):
+        state = marshal.dumps(compile_schema(schema).to_state())
+        index.append((schema, offset, offset + len(state)))
+        states.append(state)
+        offset += len(state)
+    header = marshal.dumps((SNAPSHOT_FORMAT, CompiledSchema.__slots__, index))
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(len(header).to_bytes(8, 'little'))
+        snapshot_file.write(header)
+        snapshot_file.writelines(states)
+    return len(index)
+
+def load_snapshot(path: str) -> int:
+    """
+    Maps a snapshot written by save_snapshot and reads its index, compile_schema reads the compiled schemas from the
+    snapshot from then on instead of parsing the schema strings. Snapshots are trusted files written by this program.
+
+    Input: snapshot path
+    Output: number of schemas in the snapshot
+    """
+    with open(path, 'rb') as snapshot_file:
+        data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    prefix = len(SNAPSHOT_MAGIC) + 8
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f'{path} is not a schema snapshot')
+    header_size = int.from_bytes(data[len(SNAPSHOT_MAGIC):prefix], 'little')
+    snapshot_format, slots, index = marshal.loads(data[prefix:prefix + header_size])
+    # A snapshot of another layout of CompiledSchema has to be compiled again
+    if snapshot_format != SNAPSHOT_FORMAT or tuple(slots) != CompiledSchema.__slots__:
+        raise ValueError(f'{path} was written by another version, run compile-schema again')
+    states_start = prefix + header_size
+    for schema, start, end in index:
+        _snapshot_index[schema] = (data, states_start + start, states_start + end)
+    return len(index)
+
+def literals_affect_result(literals: list[str], schema: CompiledSchema) -> bool:
+    """
+    Checks if the literal values could change the outcome of the pipeline, this is the case when a literal contains
+    a label or relationship from the schema or characters that the pipeline reads as part of a pattern
+
+    Input: literals of the query, compiled schema
+    Output: True if the query has to go through the whole pipeline on its own
+    """
+    for literal in literals:
+        if any(character in literal for character in PATTERN_CHARACTERS):
+            return True
+        if any(node in literal for node in schema.node_types):
+            return True
+    return False
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from budget import Budget
+from corrector import STATUS_ERROR, correct_with_status
+from schema import load_snapshot, schema_pool
+
+# Maximum number of requests in one micro-batch
+BATCH_SIZE = 64
+# Seconds the first request of a micro-batch waits for more requests
+BATCH_WINDOW = 0.005
+# Maximum number of requests of one connection that are read but not yet answered
+MAX_IN_FLIGHT = 256
+# Maximum number of requests waiting to be put into a micro-batch across all connections
+QUEUE_SIZE = 4096
+# Maximum length of a single request line in bytes
+LINE_LIMIT = 16 * 1024 * 1024
+# Status of requests that are not valid json objects with a query and a schema
+STATUS_INVALID_REQUEST = 'invalid_request'
+
+# Micro-batches the executor fails on are logged with their traceback before they are answered with the error status
+logger = logging.getLogger(__name__)
+
+def correct_batch(batch: list[tuple[str, str]], budget: Budget | None = None) -> list[tuple[str | None, str]]:
+    """
+    Corrects a micro-batch of requests inside a worker, the schemas go through the schema pool of the worker
+
+    Input: list of (query, schema), budget of every query
+    Output: list of (corrected query or None, status) in the same order
+    """
+    return [correct_with_status(query, schema_pool.intern(schema), budget) for query, schema in batch]
+
+class CorrectionService:
+    """
+    Asyncio service that reads newline delimited json requests like {"query": ..., "schema": ...} and answers every one of them
+    with {"corrected": ..., "status": ...} in the order the requests were sent on that connection. If a request has an "id" it is
+    copied into the response. Requests from all connections are gathered into micro-batches of batch_size requests or whatever
+    arrived within batch_window seconds, and every batch is corrected in the executor so the event loop never blocks.
+    A connection stops being read once it has max_in_flight unanswered requests.
+    Requests that go over the budget are answered with the query unchanged and the status 'budget_exceeded'.
+    """
+
+    def __init__(self, workers: int = 1, batch_size: int = BATCH_SIZE, batch_window: float = BATCH_WINDOW,
+                 max_in_flight: int = MAX_IN_FLIGHT, executor: Executor | None = None, snapshot: str | None = None,
+                 budget: Budget | None = None):
+        self.workers = workers
+        self.snapshot = snapshot
+        self.budget = budget
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_in_flight = max_in_flight
+        self._executor = executor
+        self._own_executor = executor is None
+        self._queue = None
+        self._batcher = None
+        self._batches = None
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str | None = None, port: int | None = None, path: str | None = None) -> asyncio.AbstractServer:
+        """
+        Starts listening on a unix socket if path is given, otherwise on the tcp host and port
+
+        Input: host, port or unix socket path
+        Output: asyncio server
+        """
+        if self._executor is None:
+            # Forked workers would inherit the client sockets and keep connections open after the service closes them
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            # Every worker loads the schema snapshot once when it starts
+            initializer, initargs = (load_snapshot, (self.snapshot,)) if self.snapshot else (None, ())
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method),
+                                                 initializer=initializer, initargs=initargs)
+        self._queue = asyncio.Queue(QUEUE_SIZE)
+        # Every worker has one batch running and one waiting
+        self._batches = asyncio.Semaphore(self.workers * 2)
+        self._batcher = asyncio.create_task(self._gather_batches())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path, limit=LINE_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, limit=LINE_LIMIT)
+        return self._server
+
+    async def close(self) -> None:
+        """
+        Stops the server, the batcher and the executor if the service created it
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for connection in list(self._connections):
+            connection.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Futures of the responses in the order the requests were read, None marks the end of the connection
+        responses = asyncio.Queue()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        respond = asyncio.create_task(self._respond(writer, responses, in_flight))
+        loop = asyncio.get_running_loop()
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # Backpressure, the connection is not read further until older requests are answered
+                await in_flight.acquire()
+                future = loop.create_future()
+                request = self._parse(line)
+                if request is None:
+                    future.set_result(({}, None, STATUS_INVALID_REQUEST))
+                else:
+                    await self._queue.put((request, future))
+                await responses.put(future)
+            await responses.put(None)
+            await respond
+        except asyncio.CancelledError:
+            respond.cancel()
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    def _parse(line: bytes) -> dict | None:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(request, dict) or not isinstance(request.get('query'), str) or not isinstance(request.get('schema'), str):
+            return None
+        return request
+
+    async def _respond(self, writer: asyncio.StreamWriter, responses: asyncio.Queue, in_flight: asyncio.Semaphore) -> None:
+        while (future := await responses.get()) is not None:
+            request, corrected, status = await future
+            response = {'corrected': corrected, 'status': status}
+            if 'id' in request:
+                response['id'] = request['id']
+            try:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                # The client is gone, the remaining responses are still awaited so the batches finish
+                pass
+            in_flight.release()
+
+    async def _gather_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        # The pending get is kept between batches, cancelling it on a timeout could lose a request
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(self._queue.get())
+                batch = [await getter]
+                getter = None
+                deadline = loop.time() + self.batch_window
+                while len(batch) < self.batch_size:
+                    if not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    getter = asyncio.ensure_future(self._queue.get())
+                    done, _ = await asyncio.wait({getter}, timeout=timeout)
+                    if not done:
+                        break
+                    batch.append(getter.result())
+                    getter = None
+                # Wait for a free worker before taking the next batch, this keeps the queue and the connections under backpressure
+                await self._batches.acquire()
+                asyncio.create_task(self._run_batch(batch))
+        finally:
+            if getter is not None:
+                getter.cancel()
+
+    async def _run_batch(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, correct_batch, [(request['query'], request['schema']) for request, _ in batch],
+                                                 self.budget)
+        except Exception:
+            # A broken worker pool or a bug fails every request of the batch, the traceback keeps the cause visible
+            logger.exception('Micro-batch of %d requests failed', len(batch))
+            results = [(None, STATUS_ERROR)] * len(batch)
+        finally:
+            self._batches.release()
+        for (request, future), (corrected, status) in zip(batch, results):
+            if not future.done():
+                future.set_result((request, corrected, status))
+
+async def serve(host: str | None = None, port: int | None = None, path: str | None = None, workers: int = 1,
+                batch_size: int = BATCH_SIZE, batch_window: float = BATCH_WINDOW, max_in_flight: int = MAX_IN_FLIGHT,
+                snapshot: str | None = None, budget: Budget | None = None) -> None:
+    """
+    Runs the correction service until it is cancelled
+
+    Input: tcp host and port or unix socket path, number of worker processes, micro-batch size and window, in-flight limit per connection,
+           path of a schema snapshot loaded by every worker, budget of every query
+    Output: None
+    """
+    service = CorrectionService(workers, batch_size, batch_window, max_in_flight, snapshot=snapshot, budget=budget)
+    server = await service.start(host, port, path)
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
@@ -0,0 +1,192 @@
+import csv
+import io
+import json
+import os
+import zlib
+from batch import OUTPUT_BUFFER_SIZE, OUTPUT_HEADER, correct_source_range, init_cache
+from budget import Budget
+from hopcache import HOP_CACHE_SIZE
+from mapped import RANGE_SIZE, MappedCsv
+
+# Size of the blocks the shard outputs are copied and checked in by merge
+COPY_BLOCK_SIZE = 1 << 20
+
+def shard_name(input_path: str, index: int, count: int) -> str:
+    """
+    Returns the base name of the files of a shard
+
+    Input: input_path, shard number from 1 to count, number of shards
+    Output: name like 'log.csv.shard-2-of-8'
+    """
+    return f'{os.path.basename(input_path)}.shard-{index}-of-{count}'
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """
+    Reads a shard given as k/N on the command line
+
+    Input: text like '2/8'
+    Output: shard number and number of shards like (2, 8)
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f'shard has to be given as k/N, got {text!r}') from None
+    if not 1 <= index <= count:
+        raise ValueError(f'shard number has to be between 1 and {count}, got {index}')
+    return index, count
+
+def plan_shards(input_path: str, count: int, manifest_path: str) -> dict:
+    """
+    Cuts the input csv file into count byte ranges of about the same size on record boundaries (quotes are respected)
+    and writes the manifest. The manifest records the size and modification time of the input, so a shard is never
+    run against a file that changed, and the output and state file of every shard, relative to the manifest.
+
+    Input: input_path, number of shards, manifest_path
+    Output: manifest dictionary
+    """
+    if count < 1:
+        raise ValueError(f'number of shards has to be at least 1, got {count}')
+    with MappedCsv(input_path) as source:
+        ranges = source.split(count)
+    stat = os.stat(input_path)
+    manifest = {
+        'input': os.path.abspath(input_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'shards': [{'shard': index, 'start': start, 'end': end,
+                    'output': shard_name(input_path, index, count) + '.csv', 'state': shard_name(input_path, index, count) + '.json'}
+                   for index, (start, end) in enumerate(ranges, start=1)],
+    }
+    _write_json(manifest_path, manifest)
+    return manifest
+
+def run_shard(manifest_path: str, index: int, count: int, cache_size: int = 0, dedup_size: int = 0, persistent: dict | None = None,
+              snapshot: str | None = None, budget: Budget | None = None, hop_cache_size: int = HOP_CACHE_SIZE,
+              range_size: int = RANGE_SIZE) -> dict:
+    """
+    Corrects the byte range of a single shard. The output is committed after every range of about range_size bytes:
+    the rows are appended and synced, then the state file records the committed input offset, the number of rows,
+    the output size and the crc32 of the output. A shard that failed resumes from its last committed offset,
+    anything written after the last commit is cut off. A finished shard is not run again.
+
+    Input: manifest_path, shard number from 1 to count, number of shards, size of the result cache and the dedup table,
+           options of the persistent cache, path of a schema snapshot, budget of every query, size of the hop cache,
+           approximate size of a commit in bytes
+    Output: state dictionary of the shard
+    """
+    manifest = load_manifest(manifest_path)
+    if len(manifest['shards']) != count:
+        raise ValueError(f'the manifest has {len(manifest["shards"])} shards, not {count}')
+    _check_input(manifest)
+    shard = manifest['shards'][index - 1]
+    output_path, state_path = _shard_paths(manifest_path, shard)
+
+    state = _read_json(state_path) if os.path.exists(state_path) else None
+    if state is None:
+        state = {'shard': index, 'start': shard['start'], 'end': shard['end'], 'committed_offset': shard['start'],
+                 'rows': 0, 'bytes': 0, 'crc32': 0, 'done': False}
+    if state['done']:
+        return state
+
+    init_cache(cache_size, dedup_size, persistent, snapshot, budget, hop_cache_size)
+    # Open without truncating and cut off everything after the last commit
+    with open(output_path, 'ab'):
+        pass
+    with MappedCsv(manifest['input']) as source, open(output_path, 'r+b', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        output_file.truncate(state['bytes'])
+        output_file.seek(state['bytes'])
+        start = state['committed_offset']
+        while start < shard['end']:
+            end = min(source.boundary_after(start, start + range_size), shard['end'])
+            rows, text = correct_source_range(source, start, end)
+            data = text.encode('utf-8')
+            output_file.write(data)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            state.update(committed_offset=end, rows=state['rows'] + rows, bytes=state['bytes'] + len(data),
+                         crc32=zlib.crc32(data, state['crc32']))
+            _write_json(state_path, state)
+            source.release(start, end)
+            start = end
+    state['done'] = True
+    _write_json(state_path, state)
+    return state
+
+def merge_shards(manifest_path: str, output_path: str) -> dict:
+    """
+    Reassembles the shard outputs in the original order under a single header. Every shard has to be finished,
+    and its output has to have the size and crc32 recorded in its state file and the number of rows it recorded.
+
+    Input: manifest_path, output_path
+    Output: report like {'shards': 8, 'rows': 1000000, 'bytes': 123456789, 'crc32': 305419896}
+    """
+    manifest = load_manifest(manifest_path)
+    header = io.StringIO()
+    csv.writer(header).writerow(OUTPUT_HEADER)
+    header = header.getvalue().encode('utf-8')
+
+    states = []
+    for shard in manifest['shards']:
+        _, state_path = _shard_paths(manifest_path, shard)
+        state = _read_json(state_path) if os.path.exists(state_path) else None
+        if state is None or not state['done']:
+            raise ValueError(f'shard {shard["shard"]} is not finished')
+        states.append(state)
+
+    rows = 0
+    checksum = zlib.crc32(header)
+    with open(output_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        output_file.write(header)
+        for shard, state in zip(manifest['shards'], states):
+            shard_path, _ = _shard_paths(manifest_path, shard)
+            shard_checksum, size = 0, 0
+            with open(shard_path, 'rb') as shard_file:
+                while block := shard_file.read(COPY_BLOCK_SIZE):
+                    output_file.write(block)
+                    shard_checksum = zlib.crc32(block, shard_checksum)
+                    checksum = zlib.crc32(block, checksum)
+                    size += len(block)
+            if size != state['bytes'] or shard_checksum != state['crc32']:
+                raise ValueError(f'output of shard {shard["shard"]} does not match its checksum')
+            shard_rows = _count_rows(shard_path)
+            if shard_rows != state['rows']:
+                raise ValueError(f'output of shard {shard["shard"]} has {shard_rows} rows instead of {state["rows"]}')
+            rows += shard_rows
+    return {'shards': len(states), 'rows': rows, 'bytes': len(header) + sum(state['bytes'] for state in states), 'crc32': checksum}
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Reads the manifest written by plan_shards
+
+    Input: manifest_path
+    Output: manifest dictionary
+    """
+    return _read_json(manifest_path)
+
+def _check_input(manifest: dict) -> None:
+    # The byte ranges are only valid for the exact file they were cut from
+    stat = os.stat(manifest['input'])
+    if stat.st_size != manifest['size'] or stat.st_mtime_ns != manifest['mtime_ns']:
+        raise ValueError(f'{manifest["input"]} changed since the shards were planned')
+
+def _count_rows(path: str) -> int:
+    # Rows are counted with the csv reader, so statements split over several lines count once
+    with open(path, 'r', newline='', encoding='utf-8') as csv_file:
+        return sum(1 for _ in csv.reader(csv_file))
+
+def _shard_paths(manifest_path: str, shard: dict) -> tuple[str, str]:
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    return os.path.join(directory, shard['output']), os.path.join(directory, shard['state'])
+
+def _read_json(path: str) -> dict:
+    with open(path) as json_file:
+        return json.load(json_file)
+
+def _write_json(path: str, data: dict) -> None:
+    # Write to a temporary file first so a crash never leaves a half written file behind
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as json_file:
+        json.dump(data, json_file, indent=2)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temporary_path, path)
@@ -0,0 +1,204 @@
+import importlib
+import sqlite3
+import time
+from collections.abc import Callable, Iterable
+from functools import lru_cache
+from hashlib import blake2b
+from corrector import CORRECTOR_VERSION, STATUS_BUDGET_EXCEEDED, STATUS_ERROR, correct_with_status
+from preprocessing import convert_to_single_line
+from schema import CompiledSchema, schema_fingerprint
+
+# Modules whose source decides the output of the corrector, a change in any of them invalidates the stored results
+PIPELINE_MODULES = ('corrector', 'fastpath', 'preprocessing', 'hopcache', 'dicts', 'model', 'patterns', 'lexer', 'matcher', 'schema',
+                    'reconstruction')
+# Number of keys looked up with a single select
+LOOKUP_BATCH_SIZE = 500
+
+@lru_cache(maxsize=1)
+def corrector_version() -> str:
+    """
+    Returns the version of the corrector that is stored with every result, it combines CORRECTOR_VERSION with a hash
+    of the source of the pipeline modules, so results of an older corrector are never returned
+
+    Input: None
+    Output: version like '1-9c1f0e6d2a7b4c3e'
+    """
+    digest = blake2b(digest_size=8)
+    for name in PIPELINE_MODULES:
+        with open(importlib.import_module(name).__file__, 'rb') as source:
+            digest.update(source.read())
+    return f'{CORRECTOR_VERSION}-{digest.hexdigest()}'
+
+def query_hash(statement: str) -> bytes:
+    """
+    Returns the 16 byte hash of the single line version of the statement
+
+    Input: cypher statement (may be split over multiple lines)
+    Output: hash bytes
+    """
+    return blake2b(convert_to_single_line(statement).encode(), digest_size=16).digest()
+
+class PersistentCache:
+    """
+    Optional SQLite cache of corrected queries that survives between runs. Results are stored by
+    (query hash, schema fingerprint, corrector version), so a changed schema string or corrector never hits an old entry,
+    and entries of other corrector versions are removed when the cache is opened. Lookups and inserts are done in bulk
+    inside a single transaction, the database runs in WAL mode so several processes can read while one writes.
+    Entries are evicted by age and by count, the least recently used entries go first.
+    """
+
+    def __init__(self, path: str, max_entries: int | None = None, max_age: float | None = None, version: str | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.version = corrector_version() if version is None else version
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS results (query_hash BLOB NOT NULL, schema_fingerprint TEXT NOT NULL, '
+                                 'version TEXT NOT NULL, result TEXT, status TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL, '
+                                 'PRIMARY KEY (query_hash, schema_fingerprint, version)) WITHOUT ROWID')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        with self._transaction():
+            self._connection.execute('DELETE FROM results WHERE version != ?', (self.version,))
+        self.evict()
+
+    def __enter__(self) -> 'PersistentCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def correct(self, statement: str, schema: str | CompiledSchema) -> tuple[str | None, str]:
+        """
+        Corrects a single statement like correct_with_status, see correct_many
+
+        Input: cypher statement, schema string or compiled schema
+        Output: corrected statement or None, status like 'corrected'
+        """
+        return self.correct_many([(statement, schema)])[0]
+
+    def correct_many(self, pairs: Iterable[tuple[str, str | CompiledSchema]],
+                     compute: Callable[[str, str | CompiledSchema], tuple[str | None, str]] = correct_with_status) -> list[tuple[str | None, str]]:
+        """
+        Corrects a batch of statements, the stored results are looked up with a single transaction, the missing ones
+        are computed and inserted with another one. Errors and statements that went over the budget are not stored,
+        so they are retried on the next run.
+
+        Input: pairs of (statement, schema), function that corrects a statement and returns the result and its status
+        Output: list of (corrected statement or None, status) in the same order
+        """
+        pairs = list(pairs)
+        keys = [(query_hash(statement), schema.fingerprint if isinstance(schema, CompiledSchema) else schema_fingerprint(schema))
+                for statement, schema in pairs]
+        found = self.lookup(keys)
+        results = []
+        inserts = {}
+        for key, (statement, schema) in zip(keys, pairs):
+            if key in found:
+                self.hits += 1
+                results.append(found[key])
+                continue
+            self.misses += 1
+            result = inserts[key] if key in inserts else compute(statement, schema)
+            if result[1] not in (STATUS_ERROR, STATUS_BUDGET_EXCEEDED):
+                inserts[key] = result
+            results.append(result)
+        self.store(inserts)
+        return results
+
+    def lookup(self, keys: Iterable[tuple[bytes, str]]) -> dict[tuple[bytes, str], tuple[str | None, str]]:
+        """
+        Looks up a batch of keys in a single transaction and marks the found entries as used
+
+        Input: keys (query hash, schema fingerprint)
+        Output: dictionary of the found keys -> (result, status)
+        """
+        by_schema = {}
+        for query_key, fingerprint in keys:
+            by_schema.setdefault(fingerprint, set()).add(query_key)
+        found = {}
+        now = time.time()
+        with self._transaction():
+            for fingerprint, query_keys in by_schema.items():
+                query_keys = list(query_keys)
+                for i in range(0, len(query_keys), LOOKUP_BATCH_SIZE):
+                    batch = query_keys[i:i+LOOKUP_BATCH_SIZE]
+                    placeholders = ','.join('?' * len(batch))
+                    rows = self._connection.execute(
+                        f'SELECT query_hash, result, status FROM results WHERE schema_fingerprint = ? AND version = ? AND query_hash IN ({placeholders})',
+                        (fingerprint, self.version, *batch)).fetchall()
+                    for query_key, result, status in rows:
+                        found[(query_key, fingerprint)] = (result, status)
+            self._connection.executemany('UPDATE results SET used = ? WHERE query_hash = ? AND schema_fingerprint = ? AND version = ?',
+                                         [(now, query_key, fingerprint, self.version) for query_key, fingerprint in found])
+        return found
+
+    def store(self, entries: dict[tuple[bytes, str], tuple[str | None, str]]) -> None:
+        """
+        Inserts a batch of results in a single transaction, the entries are evicted afterwards if the cache is too large
+
+        Input: dictionary of keys (query hash, schema fingerprint) -> (result, status)
+        Output: None
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._transaction():
+            self._connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                         [(query_key, fingerprint, self.version, result, status, now, now)
+                                          for (query_key, fingerprint), (result, status) in entries.items()])
+        if self.max_entries is not None:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Removes the entries older than max_age seconds and the least recently used entries above max_entries
+
+        Input: None
+        Output: number of removed entries
+        """
+        removed = 0
+        with self._transaction():
+            if self.max_age is not None:
+                removed += self._connection.execute('DELETE FROM results WHERE created < ?', (time.time() - self.max_age,)).rowcount
+            if self.max_entries is not None:
+                count = self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+                if count > self.max_entries:
+                    removed += self._connection.execute(
+                        'DELETE FROM results WHERE (query_hash, schema_fingerprint, version) IN '
+                        '(SELECT query_hash, schema_fingerprint, version FROM results ORDER BY used LIMIT ?)',
+                        (count - self.max_entries,)).rowcount
+        return removed
+
+    def invalidate_schema(self, schema: str | CompiledSchema) -> int:
+        """
+        Removes every stored result for the schema
+
+        Input: schema string or compiled schema
+        Output: number of removed entries
+        """
+        fingerprint = schema.fingerprint if isinstance(schema, CompiledSchema) else schema_fingerprint(schema)
+        with self._transaction():
+            return self._connection.execute('DELETE FROM results WHERE schema_fingerprint = ?', (fingerprint,)).rowcount
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns the counters of the cache
+
+        Input: None
+        Output: dictionary with size, hits, misses and hit_rate
+        """
+        lookups = self.hits + self.misses
+        size = self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def _transaction(self):
+        # The connection is in autocommit mode, the context manager of the connection commits or rolls back the transaction
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self._connection
@@ -0,0 +1,40 @@
+from cache import DedupTable
+from corrector import correct_statement
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+OTHER_SCHEMA = '(Person, KNOWS, Person), (Organization, WORKS_AT, Person)'
+QUERY = 'MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a'
+CORRECTED = 'MATCH (a:Person)-[:WORKS_AT]->(b:Organization) RETURN a'
+
+def counting(calls):
+    def compute(statement, schema):
+        calls.append(statement)
+        return correct_statement(statement, schema)
+    return compute
+
+def test_duplicates_are_computed_once():
+    calls = []
+    table = DedupTable(maxsize=10)
+    # The statement split over lines is the same single line query
+    for statement in [QUERY, 'MATCH (a:Person)<-[:WORKS_AT]-(b:Organization)\nRETURN a', QUERY]:
+        assert table.correct(statement, SCHEMA, counting(calls)) == CORRECTED
+    assert len(calls) == 1
+    # Another schema is another pair
+    assert table.correct(QUERY, OTHER_SCHEMA, counting(calls)) == QUERY
+    stats = table.stats()
+    assert (stats['size'], stats['rows'], stats['unique'], stats['duplicates'], stats['evictions']) == (2, 4, 2, 2, 0)
+    assert stats['dedup_ratio'] == 0.5
+
+def test_least_recently_used_pair_is_evicted():
+    calls = []
+    table = DedupTable(maxsize=2)
+    first, second, third = (f'MATCH (a:Person)-[:KNOWS]->(b{i}:Person) RETURN a' for i in range(3))
+    table.correct(first, SCHEMA, counting(calls))
+    table.correct(second, SCHEMA, counting(calls))
+    # The hit makes first the most recently used, so third evicts second
+    table.correct(first, SCHEMA, counting(calls))
+    table.correct(third, SCHEMA, counting(calls))
+    assert len(table) == 2 and table.stats()['evictions'] == 1
+    table.correct(first, SCHEMA, counting(calls))
+    table.correct(second, SCHEMA, counting(calls))
+    assert calls == [first, second, third, second]
@@ -0,0 +1,76 @@
+import csv
+import logging
+import os
+import pytest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import corrector
+from budget import Budget, BudgetExceeded, budget_counter
+from cache import ResultCache
+from corrector import Corrector, correct_statement, correct_with_status
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+
+def test_parentheses_inside_literal_do_not_end_the_node():
+    query = 'MATCH (b:Person {name:"Smith (Jr)"}) MATCH (b)-[:KNOWS]->(c:Person) RETURN b'
+    assert correct_statement(query, SCHEMA) == query
+    assert correct_with_status(query, SCHEMA) == (query, 'unchanged')
+
+def test_multi_hop_query_with_one_invalid_hop_is_a_syntax_error():
+    # KNOWS only connects two Person nodes, so the second hop fits no triple in either direction
+    for query in ['MATCH (a:Person)-[:WORKS_AT]-(c:Organization)-[:KNOWS]-(d:Person) RETURN a',
+                  'MATCH (a:Person)-[:WORKS_AT]->(c:Organization)<-[:KNOWS]-(d:Person) RETURN a']:
+        assert correct_statement(query, SCHEMA) == 'Syntax error'
+        assert correct_with_status(query, SCHEMA) == (None, 'syntax_error')
+
+def test_multi_hop_query_with_valid_hops_is_corrected():
+    query = 'MATCH (a:Person)<-[:WORKS_AT]-(c:Organization)<-[:WORKS_AT]-(d:Person) RETURN a'
+    assert correct_with_status(query, SCHEMA) == ('MATCH (a:Person)-[:WORKS_AT]->(c:Organization)<-[:WORKS_AT]-(d:Person) RETURN a', 'corrected')
+
+def test_pipeline_errors_are_logged(monkeypatch, caplog):
+    def broken_solver(*args):
+        raise IndexError('list index out of range')
+    monkeypatch.setattr(corrector, 'solver', broken_solver)
+    query = 'MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a'
+    with caplog.at_level(logging.ERROR, logger='corrector'):
+        assert correct_with_status(query, SCHEMA) == (None, 'error')
+    assert caplog.records[0].exc_info[0] is IndexError
+    assert query in caplog.records[0].getMessage()
+
+def test_budget_is_checked_before_the_fast_path_and_the_cache():
+    # Every hop of the chain fits the schema, so without the check the fast path and the cache would return it untouched
+    query = 'MATCH ' + '-[:KNOWS]->'.join(f'(n{i}:Person)' for i in range(501)) + ' RETURN n0'
+    budget = Budget(max_hops=10)
+    assert correct_with_status(query, SCHEMA) == (query, 'schema_match')
+    trips = budget_counter.stats()['hops']
+    assert correct_with_status(query, SCHEMA, budget) == (query, 'budget_exceeded')
+    with pytest.raises(BudgetExceeded):
+        correct_statement(query, SCHEMA, budget)
+    cache = ResultCache()
+    with pytest.raises(BudgetExceeded):
+        cache.correct(query, SCHEMA, budget)
+    # A template hit is checked as well
+    reversed_query = 'MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a'
+    cache.correct(reversed_query, SCHEMA)
+    with pytest.raises(BudgetExceeded):
+        cache.correct(reversed_query, SCHEMA, Budget(max_hops=0))
+    assert cache.stats()['hits'] == 0
+    assert budget_counter.stats()['hops'] == trips + 4
+
+def test_corrector_shared_by_threads_matches_correct_with_status():
+    with open(os.path.join(os.path.dirname(__file__), 'examples.csv'), newline='') as examples:
+        rows = list(csv.DictReader(examples))
+    schema = Counter(row['schema'] for row in rows).most_common(1)[0][0]
+    queries = [row['statement'] for row in rows if row['schema'] == schema] * 20
+    expected = [correct_with_status(query, schema) for query in queries]
+    shared = Corrector(schema)
+    chunks = [queries[i:i + 25] for i in range(0, len(queries), 25)]
+    with ThreadPoolExecutor(8) as executor:
+        # correct is called per statement on half of the chunks, correct_many is consumed lazily inside the thread on the rest
+        results = executor.map(lambda chunk: [shared.correct(query) for query in chunk], chunks[::2])
+        lazy = executor.map(lambda chunk: list(shared.correct_many(chunk)), chunks[1::2])
+        by_chunk = [None] * len(chunks)
+        by_chunk[::2], by_chunk[1::2] = list(results), list(lazy)
+    results = [result for chunk in by_chunk for result in chunk]
+    assert [(result.corrected, result.status) for result in results] == expected
+    assert shared.stats() == Counter(status for _, status in expected)
@@ -0,0 +1,39 @@
+from fastpath import STATUS_SCHEMA_MATCH, classify_query
+from instrumentation import metrics
+from schema import compile_schema, format_schema
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+
+def test_schema_match():
+    assert classify_query('MATCH (a:Person)-[:KNOWS]->(b:Person) RETURN a', SCHEMA) == STATUS_SCHEMA_MATCH
+
+def test_node_that_starts_with_a_label_needs_the_pipeline():
+    # process_target_source rewrites (PersonA) and (Organizations:Person), so they are never taken by the fast path
+    assert classify_query('MATCH (PersonA)-[:KNOWS]->(b:Person) RETURN b', SCHEMA) is None
+    assert classify_query('MATCH (a:Person)-[:WORKS_AT]->(Organizations:Person) RETURN a', SCHEMA) is None
+
+def test_wide_schema():
+    schema = format_schema([(f'L{i:05d}', f'R{i:05d}', f'L{i + 1:05d}') for i in range(5000)])
+    assert classify_query('MATCH (a:L00010)-[:R00010]->(b:L00011) RETURN a', schema) == STATUS_SCHEMA_MATCH
+    assert classify_query('MATCH (a:L00011)-[:R00010]->(b:L00010) RETURN a', schema) is None
+
+def test_relationship_that_contains_an_earlier_relationship_needs_the_pipeline():
+    # process_relationship turns [:KNOWS_WELL] into [KNOWS], the first relationship of the schema it contains
+    schema = '(Person, KNOWS, Person), (Person, KNOWS_WELL, Person)'
+    assert classify_query('MATCH (a:Person)-[:KNOWS_WELL]->(b:Person) RETURN a', schema) is None
+    assert classify_query('MATCH (a:Person)-[:KNOWS]->(b:Person) RETURN a', schema) == STATUS_SCHEMA_MATCH
+    assert classify_query('MATCH (a:Person)-[:KNOWS_WELL]->(b:Person) RETURN a', format_schema(reversed(compile_schema(schema).triples))) == STATUS_SCHEMA_MATCH
+
+def test_fast_path_hits_are_recorded_as_queries():
+    metrics.reset()
+    metrics.enable()
+    try:
+        classify_query('MATCH (a:Person)-[:KNOWS]->(b:Person) RETURN a', SCHEMA)
+        classify_query('MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a', SCHEMA)
+    finally:
+        metrics.disable()
+    snapshot = metrics.snapshot()
+    metrics.reset()
+    assert snapshot['counters']['queries'] == 1
+    assert snapshot['counters']['fast_path_hits'] == 1
+    assert snapshot['stages']['fast_path']['count'] == 1
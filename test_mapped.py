@@ -0,0 +1,62 @@
+import csv
+import io
+import pytest
+from mapped import MappedCsv
+
+# Quoted statements split over several lines, doubled quotes, a comma inside quotes and no newline after the last record
+CONTENT = ('statement,schema,correct_query\n'
+           '"MATCH (a:Person)\n-[:KNOWS]->(b) RETURN a","(Person, KNOWS, Person)",""\n'
+           'MATCH (a) RETURN a,"(Person, KNOWS, Person)",x\n'
+           '"MATCH (a {name:""Smith, Jr""})\n\nRETURN a","(Person, KNOWS, Person)","y"\n'
+           '"MATCH (b)\r\nRETURN b","(Person, KNOWS, Person)",z')
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'input.csv'
+    path.write_bytes(CONTENT.encode())
+    with MappedCsv(str(path)) as mapped:
+        yield mapped
+
+def expected_rows() -> list[list[str]]:
+    return list(csv.reader(io.StringIO(CONTENT, newline='')))[1:]
+
+def is_boundary(offset: int) -> bool:
+    # Record boundaries are the end of the file and the offsets right after a newline outside of quotes,
+    # a doubled quote flips the state twice
+    text = CONTENT.encode()
+    boundaries = {len(text)}
+    in_quotes = False
+    for index, byte in enumerate(text):
+        if byte == ord('"'):
+            in_quotes = not in_quotes
+        elif byte == ord('\n') and not in_quotes:
+            boundaries.add(index + 1)
+    return offset in boundaries
+
+def test_ranges_start_and_end_on_record_boundaries(source):
+    for range_size in range(1, source.size + 2):
+        ranges = list(source.ranges(range_size))
+        assert ranges[0][0] == source.data_start
+        assert ranges[-1][1] == source.size
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start
+            assert is_boundary(end)
+        rows = [list(row) for start, end in ranges for row in source.rows(start, end)]
+        assert rows == expected_rows(), range_size
+
+def test_split_into_parts(source):
+    for parts in range(1, 8):
+        ranges = source.split(parts)
+        assert len(ranges) == parts
+        assert ranges[0][0] == source.data_start and ranges[-1][1] == source.size
+        assert all(is_boundary(end) for _, end in ranges)
+        assert [list(row) for start, end in ranges for row in source.rows(start, end)] == expected_rows()
+
+def test_boundary_inside_a_quoted_newline_moves_past_the_record(source):
+    inside = CONTENT.encode().index(b'\n-[:KNOWS]') + 1
+    boundary = source.boundary_after(source.data_start, inside)
+    assert boundary == CONTENT.encode().index(b'MATCH (a) RETURN a')
+
+def test_last_record_without_newline(source):
+    last = list(source.rows())[-1]
+    assert list(last) == ['MATCH (b)\r\nRETURN b', '(Person, KNOWS, Person)', 'z']
@@ -0,0 +1,133 @@
+import csv
+import os
+import random
+import preprocessing
+from hopcache import HOP_CACHE_SIZE, hop_cache
+from instrumentation import metrics
+from preprocessing import bind_variables, get_mappings, infer_labels_from_schema, prepare_string, process_relationship, scan_nodes
+from schema import compile_schema
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+
+def test_scan_nodes_skips_parentheses_inside_literals():
+    query = 'MATCH (b:Person {name:"Smith (Jr)"}) MATCH (b)-[:KNOWS]->(c:Person) RETURN b'
+    assert [node for _, _, node in scan_nodes(query)] == ['b:Person {name:"Smith (Jr)"}', 'b', 'c:Person']
+
+def test_bind_variables_keeps_the_whole_literal():
+    query = 'MATCH (b:Person {name:"Smith (Jr)"}) MATCH (b)-[:KNOWS]->(c:Person) RETURN b'
+    _, bindings = bind_variables(scan_nodes(query))
+    assert bindings == {'b': 'b:Person {name:"Smith (Jr)"}', 'c': 'c:Person'}
+
+def test_get_mappings_binds_node_with_parentheses_in_literal():
+    query = 'MATCH (b:Person {name:"Smith (Jr)"}) MATCH (b)-[:KNOWS]->(c:Person) RETURN b'
+    assert get_mappings(query, SCHEMA) == ('MATCH (b:Person {name:"Smith (Jr)"}) MATCH (b:Person {name:"Smith (Jr)"})-[:KNOWS]->(c:Person) RETURN b')
+
+def reference_nodes(query: str) -> list[str]:
+    # Node scan of get_mappings before the single forward scan, one find for every parenthesis
+    start = 0
+    query_nodes = []
+    while True:
+        start = query.find('(', start)
+        if start == -1: break
+        end = query.find(')', start)
+        if end == -1: break
+        query_nodes.append(query[start+1:end].strip())
+        start = end+1
+    return query_nodes
+
+def reference_get_mappings(query: str, schema: str) -> str:
+    # get_mappings before the single forward scan, every bare variable rewrites the whole query
+    schema_dict = compile_schema(schema).label_relationships
+    query_nodes = reference_nodes(query)
+    query_nodes_dict = {node.split(':')[0]: node for node in query_nodes if ':' in node}
+    for node in query_nodes:
+        if node == '*' or node == ' ' or ':' in node:
+            continue
+        if node in schema_dict:
+            query = query.replace(f'({node})', f'({node}:{schema_dict[node]})')
+        elif node in query_nodes_dict:
+            query = query.replace(f'({node})', f'({query_nodes_dict[node]})')
+    return infer_labels_from_schema(query, schema_dict)
+
+def mapping_cases() -> list[tuple[str, str]]:
+    # Statements of the examples without literals (the old scan ended a node at a parenthesis inside a literal)
+    # and random queries made of node fragments
+    with open(os.path.join(os.path.dirname(__file__), 'examples.csv'), newline='') as examples:
+        cases = [(row['statement'], row['schema']) for row in csv.DictReader(examples) if not set('"\'`') & set(row['statement'])]
+    schemas = ['(Person, KNOWS, Person), (a, R, Movie)', '(a, ACTED_IN, b), (b, R, a), (Person, X, Y)', '(P, K, P)', '']
+    fragments = ['(', ')', 'a', 'b', 'Person', ' ', ':', '*', '-', '->', '[', ']', ',', 'MATCH ', '(a)', '(b:Person)',
+                 '( a )', '(a     )', '((a))', '(:P)', '()', '(Person           )', '(P    )', '(a:(', '(a:b)', '(P)']
+    generator = random.Random(0)
+    for _ in range(5000):
+        query = ''.join(generator.choice(fragments) for _ in range(generator.randint(0, 14)))
+        cases.append((query, generator.choice(schemas)))
+    return cases
+
+def test_scan_nodes_matches_the_old_scan():
+    for query, _ in mapping_cases():
+        nodes, bindings = bind_variables(scan_nodes(query))
+        old_nodes = reference_nodes(query)
+        assert [node for _, _, node in nodes] == old_nodes, query
+        assert bindings == {node.split(':')[0]: node for node in old_nodes if ':' in node}, query
+
+def test_get_mappings_matches_the_old_get_mappings():
+    for query, schema in mapping_cases():
+        assert get_mappings(query, schema) == reference_get_mappings(query, schema), (query, schema)
+
+def test_process_relationship_takes_the_first_relationship_in_schema_order():
+    schema = '(Person, KNOWS_WELL, Person), (Person, KNOWS, Person), (Person, WELL, Person)'
+    # Relationships are matched anywhere in the bracket, the first triple wins
+    assert process_relationship('(a)-[r:KNOWS_WELL]->(b)', schema)[0] == '(a)-[KNOWS_WELL]->(b)'
+    assert process_relationship('(a)-[r:KNOWS]->(b)<-[:WELL]-(c)', schema)[0] == '(a)-[KNOWS]->(b)<-[WELL]-(c)'
+    assert process_relationship('(a)-[r:LIKES]->(b)', schema)[0] == '(a)-[r:LIKES]->(b)'
+
+def test_find_relationship_matches_a_scan_of_the_triples():
+    generator = random.Random(0)
+    for _ in range(2000):
+        relationships = [''.join(generator.choice('ABK_') for _ in range(generator.randint(0, 3))) for _ in range(generator.randint(1, 6))]
+        schema = compile_schema(', '.join(f'(P, {relationship}, Q)' for relationship in relationships))
+        bracket = '[' + ''.join(generator.choice('ABK_:r {}') for _ in range(generator.randint(0, 8))) + ']'
+        scanned = next((relation for _, relation, _ in schema.clean_triples if relation in bracket), None)
+        assert schema.find_relationship(bracket) == scanned, (schema.source, bracket)
+
+def test_prepare_string_marks_only_the_invalid_hop():
+    output, variable_length = prepare_string(['MATCH (a:Person)-[:WORKS_AT]->(c:Organization)<-[:KNOWS]-(d:Person) RETURN a', SCHEMA])
+    assert not variable_length
+    assert output == ['(a:Person)-[WORKS_AT]->(c:Organization)', 'Syntax error']
+
+def test_prepare_string_metrics_counters():
+    metrics.reset()
+    metrics.enable()
+    try:
+        prepare_string(['MATCH (a:Person)-[:WORKS_AT]->(c:Organization)<-[:KNOWS]-(d:Person) RETURN a', SCHEMA])
+    finally:
+        metrics.disable()
+    counters = metrics.snapshot()['counters']
+    metrics.reset()
+    assert counters == {'queries': 1, 'fast_path_hits': 0, 'syntax_errors': 1, 'variable_length_passthroughs': 0, 'slow_queries': 0}
+
+def hop_cases() -> list[tuple[str, str]]:
+    # Statements of the examples as they are and with every arrow reversed
+    with open(os.path.join(os.path.dirname(__file__), 'examples.csv'), newline='') as examples:
+        rows = [(row['statement'], row['schema']) for row in csv.DictReader(examples)]
+    reversed_rows = [(statement.replace('->', '\0').replace('<-', '->').replace('\0', '<-'), schema) for statement, schema in rows]
+    return rows + reversed_rows
+
+def prepare_all(cases: list[tuple[str, str]]) -> list[tuple[list[str], bool]]:
+    return [prepare_string([statement, schema]) for statement, schema in cases]
+
+def test_validate_hops_is_the_same_with_and_without_the_hop_cache(monkeypatch):
+    cases = hop_cases()
+    try:
+        hop_cache.clear()
+        cold = prepare_all(cases)
+        warm = prepare_all(cases)
+        assert hop_cache.stats()['hits'] > 0
+        hop_cache.resize(0)
+        disabled = prepare_all(cases)
+        assert len(hop_cache) == 0
+    finally:
+        hop_cache.resize(HOP_CACHE_SIZE)
+    # Every hop through orient_hop and check_syntax
+    monkeypatch.setattr(preprocessing, '_hop_parts', lambda hop: None)
+    assert cold == warm == disabled == prepare_all(cases)
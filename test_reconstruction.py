@@ -0,0 +1,19 @@
+from reconstruction import arrow_edits, solver, solver_edits, symbol_extractor, symbol_inserter
+
+def test_solver_flips_arrows():
+    assert solver(['(a:Person)-[KNOWS]->(b:Person)'], 'MATCH (a:Person)<-[:KNOWS]-(b:Person) RETURN a') == 'MATCH (a:Person)-[:KNOWS]->(b:Person) RETURN a'
+
+def test_syntax_error_alone():
+    assert solver(['Syntax error'], 'MATCH (a)-[:KNOWS]->(b) RETURN a') == 'Syntax error'
+
+def test_syntax_error_mixed_with_valid_substatements():
+    stringlist = ['(a:Person)-[WORKS_AT]->(c:Organization)', 'Syntax error']
+    target = 'MATCH (a:Person)-[:WORKS_AT]->(c:Organization)<-[:KNOWS]-(d:Person) RETURN a'
+    assert symbol_extractor(stringlist) == ['Syntax error']
+    assert solver_edits(stringlist, target) is None
+    assert solver(stringlist, target) == 'Syntax error'
+
+def test_too_few_symbols_are_not_an_index_error():
+    target = 'MATCH (a)-[:KNOWS]->(b)-[:KNOWS]->(c) RETURN a'
+    assert arrow_edits(target, ['-', '->']) is None
+    assert symbol_inserter(target, ['-', '->']) == 'Syntax error'
@@ -0,0 +1,79 @@
+import sys
+import threading
+import pytest
+import schema
+from corrector import correct_with_status
+from schema import CompiledSchema, SchemaPool, compile_schema, load_snapshot, save_snapshot
+
+SCHEMAS = ['(Person, KNOWS, Person), (Person, WORKS_AT, Organization)',
+           '(Actor, ACTED_IN, Movie), (Director, DIRECTED, Movie), (Movie, IN_GENRE, Genre), (Actor, ACTED_IN, Show)']
+QUERY = 'MATCH (a:Movie)<-[:ACTED_IN]-(b:Actor)-[:ACTED_IN]->(c) RETURN a'
+
+@pytest.fixture
+def snapshot_index(monkeypatch):
+    # Every test starts and ends without loaded snapshots or compiled schemas read from them
+    monkeypatch.setattr(schema, '_snapshot_index', {})
+    schema._compile.cache_clear()
+    yield schema._snapshot_index
+    schema._compile.cache_clear()
+
+def test_snapshot_round_trip(tmp_path, snapshot_index):
+    path = str(tmp_path / 'schemas.snapshot')
+    expected = correct_with_status(QUERY, SCHEMAS[1])
+    assert save_snapshot(SCHEMAS + SCHEMAS[:1], path) == 2
+    schema._compile.cache_clear()
+    assert load_snapshot(path) == 2 and list(snapshot_index) == SCHEMAS
+
+    def parse(self, source):
+        raise AssertionError(f'{source} was parsed again')
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(CompiledSchema, '__init__', parse)
+        loaded = [compile_schema(source) for source in SCHEMAS]
+    for source, compiled in zip(SCHEMAS, loaded):
+        assert compiled.to_state() == CompiledSchema(source).to_state()
+    # The direction table and the tries survive marshal and answer like the ones of a parsed schema
+    assert loaded[1].directions == CompiledSchema(SCHEMAS[1]).directions
+    assert loaded[1].matcher.substrings('Actor Movie') == CompiledSchema(SCHEMAS[1]).matcher.substrings('Actor Movie')
+    assert correct_with_status(QUERY, SCHEMAS[1]) == expected
+
+def test_snapshot_of_another_file_or_version_is_rejected(tmp_path, monkeypatch, snapshot_index):
+    other = tmp_path / 'other.snapshot'
+    other.write_bytes(b'not a snapshot at all')
+    with pytest.raises(ValueError, match='is not a schema snapshot'):
+        load_snapshot(str(other))
+    path = str(tmp_path / 'schemas.snapshot')
+    save_snapshot(SCHEMAS, path)
+    # A newer format or another layout of CompiledSchema
+    for target, name, value in [(schema, 'SNAPSHOT_FORMAT', schema.SNAPSHOT_FORMAT + 1),
+                                (CompiledSchema, '__slots__', CompiledSchema.__slots__[:-1])]:
+        with monkeypatch.context() as patch:
+            patch.setattr(target, name, value)
+            with pytest.raises(ValueError, match='another version'):
+                load_snapshot(path)
+    assert snapshot_index == {}
+
+def test_pool_interns_copies_of_a_schema():
+    pool = SchemaPool()
+    original = SCHEMAS[0]
+    # A copy that is equal but not the same object, like a schema read again from the input
+    copy = ''.join(list(original))
+    assert copy is not original
+    canonical = pool.intern(original)
+    assert canonical == original and pool.intern(copy) is canonical
+    # Only the copy counts as saved, the canonical string is the one the pool keeps
+    assert pool.add(canonical) == 0 and pool.add(SCHEMAS[1]) == 1
+    assert pool.source(1) == SCHEMAS[1] and pool.get(0) is pool.find(copy)
+    assert pool.stats() == {'distinct_schemas': 2, 'lookups': 4, 'hits': 2, 'hit_rate': 0.5, 'bytes_saved': sys.getsizeof(copy)}
+
+def test_pool_shared_by_threads_hands_out_one_id_per_schema():
+    pool = SchemaPool()
+    ids = []
+    def add():
+        ids.extend(pool.add(''.join(list(source))) for source in SCHEMAS * 50)
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(pool) == 2 and set(ids) == {0, 1}
+    assert pool.stats()['lookups'] == 400 and pool.stats()['hits'] == 398
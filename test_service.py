@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from corrector import correct_with_status
+from service import CorrectionService
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+QUERIES = ['MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a', 'MATCH (a:Person)-[:KNOWS]->(b:Person) RETURN a',
+           'MATCH (a:Person)-[:KNOWS]->(c:Organization) RETURN a', 'MATCH (a) RETURN a']
+
+class GatedExecutor(ThreadPoolExecutor):
+    # In-process executor that holds every batch until the gate is opened
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def submit(self, fn, batch, *args):
+        def gated():
+            self.gate.wait()
+            return fn(batch, *args)
+        return super().submit(gated)
+
+class FailingExecutor(ThreadPoolExecutor):
+    def submit(self, fn, *args):
+        return super().submit(self._fail)
+
+    @staticmethod
+    def _fail():
+        raise RuntimeError('worker died')
+
+async def exchange(path: str, lines: list[str]) -> list[dict]:
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(''.join(line + '\n' for line in lines).encode())
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in lines]
+    writer.close()
+    await writer.wait_closed()
+    return responses
+
+def run_service(tmp_path, executor, client, **options):
+    async def main():
+        path = str(tmp_path / 'service.sock')
+        service = CorrectionService(executor=executor, **options)
+        await service.start(path=path)
+        try:
+            return await client(service, path)
+        finally:
+            await service.close()
+            executor.shutdown()
+    return asyncio.run(main())
+
+def test_responses_keep_the_order_of_the_connection_and_echo_the_id(tmp_path):
+    requests = [json.dumps({'id': i, 'query': QUERIES[i % len(QUERIES)], 'schema': SCHEMA}) for i in range(40)]
+    async def client(service, path):
+        # Two connections at once, the micro-batches mix their requests
+        return await asyncio.gather(exchange(path, requests), exchange(path, requests[::-1]))
+    first, second = run_service(tmp_path, GatedExecutor(), client, batch_size=7)
+    assert [response['id'] for response in first] == list(range(40))
+    assert [response['id'] for response in second] == list(range(39, -1, -1))
+    for response in first:
+        corrected, status = correct_with_status(QUERIES[response['id'] % len(QUERIES)], SCHEMA)
+        assert (response['corrected'], response['status']) == (corrected, status)
+
+def test_invalid_requests(tmp_path):
+    lines = ['not json', json.dumps({'query': 1, 'schema': SCHEMA}), json.dumps(['query', 'schema']),
+             json.dumps({'id': 'a', 'query': QUERIES[0], 'schema': SCHEMA})]
+    async def client(service, path):
+        return await exchange(path, lines)
+    responses = run_service(tmp_path, GatedExecutor(), client)
+    assert responses[:3] == [{'corrected': None, 'status': 'invalid_request'}] * 3
+    assert responses[3] == {'corrected': 'MATCH (a:Person)-[:WORKS_AT]->(b:Organization) RETURN a', 'status': 'corrected', 'id': 'a'}
+
+def test_connection_is_not_read_past_max_in_flight(tmp_path):
+    executor = GatedExecutor()
+    executor.gate.clear()
+    lines = [json.dumps({'id': i, 'query': QUERIES[0], 'schema': SCHEMA}) for i in range(10)]
+    async def client(service, path):
+        parsed = []
+        parse = service._parse
+        service._parse = lambda line: parsed.append(line) or parse(line)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        await writer.drain()
+        await asyncio.sleep(0.2)
+        # Only the requests in flight were taken from the connection, the rest waits unparsed
+        read = len(parsed)
+        executor.gate.set()
+        responses = [json.loads(await reader.readline()) for _ in lines]
+        writer.close()
+        await writer.wait_closed()
+        return read, responses
+    read, responses = run_service(tmp_path, executor, client, max_in_flight=3, batch_size=1, batch_window=0)
+    assert read == 3
+    assert [response['id'] for response in responses] == list(range(10))
+
+def test_failed_batches_are_logged(tmp_path, caplog):
+    async def client(service, path):
+        return await exchange(path, [json.dumps({'id': 1, 'query': QUERIES[0], 'schema': SCHEMA})])
+    with caplog.at_level(logging.ERROR, logger='service'):
+        responses = run_service(tmp_path, FailingExecutor(max_workers=1), client)
+    assert responses == [{'corrected': None, 'status': 'error', 'id': 1}]
+    assert caplog.records[0].exc_info[0] is RuntimeError
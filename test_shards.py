@@ -0,0 +1,84 @@
+import os
+import pytest
+import shards
+from batch import correct_file
+from shards import merge_shards, plan_shards, run_shard
+
+@pytest.fixture
+def log(tmp_path):
+    # A few hundred rows of the examples, some statements are split over several lines inside quotes
+    with open(os.path.join(os.path.dirname(__file__), 'examples.csv'), newline='') as examples:
+        header, *rows = examples.read().splitlines(keepends=True)
+    path = tmp_path / 'log.csv'
+    path.write_text(header + ''.join(rows * 3))
+    return str(path)
+
+def reference(log: str, tmp_path) -> bytes:
+    output = tmp_path / 'reference.csv'
+    correct_file(log, str(output))
+    return output.read_bytes()
+
+def test_merged_shards_match_a_single_run(log, tmp_path):
+    manifest = str(tmp_path / 'manifest.json')
+    plan_shards(log, 3, manifest)
+    for index in range(1, 4):
+        run_shard(manifest, index, 3, range_size=4096)
+    report = merge_shards(manifest, str(tmp_path / 'merged.csv'))
+    assert (tmp_path / 'merged.csv').read_bytes() == reference(log, tmp_path)
+    assert report['shards'] == 3
+
+def test_killed_shard_resumes_from_its_last_commit(log, tmp_path, monkeypatch):
+    manifest = str(tmp_path / 'manifest.json')
+    plan_shards(log, 2, manifest)
+    correct = shards.correct_source_range
+    calls = []
+
+    def killed_after_two_ranges(source, start, end):
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        calls.append((start, end))
+        return correct(source, start, end)
+
+    monkeypatch.setattr(shards, 'correct_source_range', killed_after_two_ranges)
+    with pytest.raises(KeyboardInterrupt):
+        run_shard(manifest, 1, 2, range_size=2048)
+    monkeypatch.setattr(shards, 'correct_source_range', correct)
+
+    state = shards._read_json(str(tmp_path / 'log.csv.shard-1-of-2.json'))
+    assert not state['done'] and state['committed_offset'] == calls[-1][1]
+    # Rows written after the last commit are cut off when the shard runs again
+    with open(tmp_path / 'log.csv.shard-1-of-2.csv', 'ab') as output:
+        output.write(b'half a row,')
+
+    assert run_shard(manifest, 1, 2, range_size=2048)['done']
+    run_shard(manifest, 2, 2, range_size=2048)
+    merge_shards(manifest, str(tmp_path / 'merged.csv'))
+    assert (tmp_path / 'merged.csv').read_bytes() == reference(log, tmp_path)
+
+def test_merge_detects_a_corrupted_shard(log, tmp_path):
+    manifest = str(tmp_path / 'manifest.json')
+    plan_shards(log, 2, manifest)
+    run_shard(manifest, 1, 2)
+    run_shard(manifest, 2, 2)
+    path = tmp_path / 'log.csv.shard-2-of-2.csv'
+    data = bytearray(path.read_bytes())
+    data[10] ^= 1
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='checksum'):
+        merge_shards(manifest, str(tmp_path / 'merged.csv'))
+
+def test_merge_needs_every_shard(log, tmp_path):
+    manifest = str(tmp_path / 'manifest.json')
+    plan_shards(log, 2, manifest)
+    run_shard(manifest, 1, 2)
+    with pytest.raises(ValueError, match='shard 2 is not finished'):
+        merge_shards(manifest, str(tmp_path / 'merged.csv'))
+
+def test_changed_input_is_rejected(log, tmp_path):
+    manifest = str(tmp_path / 'manifest.json')
+    plan_shards(log, 2, manifest)
+    with open(log, 'a') as input_file:
+        input_file.write('"MATCH (a)-->(b) RETURN a","(Person, KNOWS, Person)",\n')
+    os.utime(log, ns=(0, 0))
+    with pytest.raises(ValueError, match='changed'):
+        run_shard(manifest, 1, 2)
@@ -0,0 +1,55 @@
+import batch
+import corrector
+from preprocessing import convert_to_single_line
+from store import PersistentCache
+
+SCHEMA = '(Person, KNOWS, Person), (Person, WORKS_AT, Organization)'
+OTHER_SCHEMA = '(Person, KNOWS, Person), (Organization, WORKS_AT, Person)'
+QUERY = 'MATCH (a:Person)<-[:WORKS_AT]-(b:Organization) RETURN a'
+CORRECTED = 'MATCH (a:Person)-[:WORKS_AT]->(b:Organization) RETURN a'
+
+def test_stored_results_are_returned(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    with PersistentCache(path, version='1') as cache:
+        assert cache.correct(QUERY, SCHEMA) == (CORRECTED, 'corrected')
+    with PersistentCache(path, version='1') as cache:
+        assert cache.correct(QUERY, SCHEMA) == (CORRECTED, 'corrected')
+        assert cache.stats()['hits'] == 1
+
+def test_schema_change_invalidates_results(tmp_path):
+    with PersistentCache(str(tmp_path / 'cache.sqlite'), version='1') as cache:
+        cache.correct(QUERY, SCHEMA)
+        # A different schema string has its own fingerprint and never hits the entry of the old schema
+        assert cache.correct(QUERY, OTHER_SCHEMA) == (convert_to_single_line(QUERY), 'schema_match')
+        assert cache.stats()['misses'] == 2
+        assert cache.invalidate_schema(SCHEMA) == 1
+        cache.correct(QUERY, SCHEMA)
+        assert cache.stats()['misses'] == 3
+
+def test_version_change_drops_results(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    with PersistentCache(path, version='1') as cache:
+        cache.correct(QUERY, SCHEMA)
+        assert cache.stats()['size'] == 1
+    with PersistentCache(path, version='2') as cache:
+        assert cache.stats()['size'] == 0
+        cache.correct(QUERY, SCHEMA)
+        assert cache.stats()['hits'] == 0
+
+def broken_pipeline(*args):
+    raise IndexError('list index out of range')
+
+def test_errors_are_not_stored_by_the_library(tmp_path, monkeypatch):
+    monkeypatch.setattr(corrector, 'solver', broken_pipeline)
+    with PersistentCache(str(tmp_path / 'cache.sqlite'), version='1') as cache:
+        assert cache.correct(QUERY, SCHEMA) == (None, 'error')
+        assert cache.stats()['size'] == 0
+
+def test_errors_are_not_stored_by_the_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, '_correct_pair', broken_pipeline)
+    batch.init_cache(0, persistent={'path': str(tmp_path / 'cache.sqlite'), 'version': '1'})
+    try:
+        assert batch.correct_chunk([[QUERY, SCHEMA]]) == ['Syntax error']
+        assert batch.persistent_cache.stats()['size'] == 0
+    finally:
+        batch.init_cache(0)